@@ -0,0 +1,220 @@
+"""
+Benchmark the pandham hot queries on SQLite with and without the
+Meta.indexes added in migrations 0034 and 0035.
+
+Seeds a throw-away SQLite database with realistic volumes, prints the
+query plan and median timing of every hot query, then adds the indexes
+and prints them again.
+
+Usage:
+    python benchmarks/pandham_indexes.py [--requests 200000] [--repeat 50]
+"""
+import argparse
+import datetime
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "ptptk.settings.dev")
+
+
+def setup_django(db_path):
+    import django
+    from django.conf import settings
+
+    # ใช้ฐานข้อมูลชั่วคราว ไม่แตะ db.sqlite3 ของโปรเจกต์
+    settings.DATABASES["default"]["NAME"] = db_path
+    django.setup()
+
+
+def create_tables():
+    from django.apps import apps
+    from django.conf import settings
+    from django.core.management import call_command
+    from django.db import connection
+
+    from pandham.models import InventoryTransaction
+    from pandham.models import Propagation
+    from pandham.models import RequestPandham
+
+    # สร้างตารางจาก models โดยตรงแทนการรัน migrations ทั้งหมด
+    settings.MIGRATION_MODULES = {app.label: None for app in apps.get_app_configs()}
+    call_command("migrate", run_syncdb=True, verbosity=0)
+
+    # เริ่มจากตารางที่ไม่มี Meta.indexes
+    models = [InventoryTransaction, Propagation, RequestPandham]
+    with connection.schema_editor() as editor:
+        for model in models:
+            for index in model._meta.indexes:
+                editor.remove_index(model, index)
+    return models
+
+
+def seed(options):
+    from django.db import connection
+    from django.db import transaction
+    from django.utils import timezone
+
+    from pandham.models import BookInventory
+    from pandham.models import InventoryTransaction
+    from pandham.models import PandhamTargetGroup
+    from pandham.models import Propagation
+    from pandham.models import RequestPandham
+
+    rng = random.Random(1)
+    now = timezone.now()
+
+    def created_at(i, total):
+        return now - datetime.timedelta(minutes=total - i)
+
+    with transaction.atomic():
+        groups = PandhamTargetGroup.objects.bulk_create(
+            PandhamTargetGroup(name=f"group {i}", priority=i) for i in range(5)
+        )
+        books = BookInventory.objects.bulk_create(
+            BookInventory(book_name=f"book {i}", current_stock=1000) for i in range(options.books)
+        )
+        InventoryTransaction.objects.bulk_create(
+            (
+                InventoryTransaction(
+                    book_inventory=rng.choice(books),
+                    transaction_type=rng.choice(InventoryTransaction.TRANSACTION_CHOICES)[0],
+                    quantity=rng.randint(1, 20),
+                )
+                for _ in range(options.transactions)
+            ),
+            batch_size=5000,
+        )
+        propagations = Propagation.objects.bulk_create(
+            (
+                Propagation(
+                    reference_number=f"PROP{i:014d}",
+                    book_inventory=rng.choice(books),
+                    donate_books=rng.randint(0, 10),
+                    remaining_donated=rng.choice([0, 0, 0, 1, 5]),
+                    phone_number=f"08{rng.randint(0, 99999999):08d}",
+                )
+                for i in range(options.propagations)
+            ),
+            batch_size=5000,
+        )
+        Through = Propagation.target_groups.through
+        Through.objects.bulk_create(
+            (
+                Through(propagation_id=propagation.pk, pandhamtargetgroup_id=rng.choice(groups).pk)
+                for propagation in propagations
+            ),
+            batch_size=5000,
+        )
+        RequestPandham.objects.bulk_create(
+            (
+                RequestPandham(
+                    reference_number=f"REQP{i:014d}",
+                    book_inventory=rng.choice(books),
+                    recipient_category=rng.choice(groups),
+                    name=f"requester {i}",
+                    phone_number=f"08{rng.randint(0, 99999999):08d}",
+                    is_waiting=rng.random() < 0.1,
+                )
+                for i in range(options.requests)
+            ),
+            batch_size=5000,
+        )
+
+        # กระจาย created_at ให้เหมือนข้อมูลที่สะสมมาหลายเดือน
+        with connection.cursor() as cursor:
+            for model, total in [
+                (InventoryTransaction, options.transactions),
+                (Propagation, options.propagations),
+                (RequestPandham, options.requests),
+            ]:
+                table = model._meta.db_table
+                cursor.execute(
+                    f"UPDATE {table} SET created_at = datetime('now', '-' || (%s - id) || ' minutes')",
+                    [total],
+                )
+        cursor = connection.cursor()
+        cursor.execute("ANALYZE")
+
+    return books, groups
+
+
+def hot_queries(books, groups):
+    from pandham.models import InventoryTransaction
+    from pandham.models import Propagation
+    from pandham.models import RequestPandham
+
+    book = books[len(books) // 2]
+    group = groups[0]
+    sample = RequestPandham.objects.order_by("?").values_list("phone_number", flat=True).first()
+    return {
+        "RequestPandhamView duplicate check": RequestPandham.objects.filter(
+            phone_number=sample, book_inventory=book,
+        ),
+        "waiting list FIFO": RequestPandham.objects.filter(
+            book_inventory=book, is_waiting=True,
+        ).order_by("created_at")[:100],
+        # queryset เดียวกับที่ Propagation.claim() ใช้
+        "propagation allocation": Propagation.claim_candidates(book.id, group.id, 1)[:1],
+        "admin transaction list": InventoryTransaction.objects.order_by("-created_at")[:20],
+        "admin list filtered by type": InventoryTransaction.objects.filter(
+            transaction_type="request",
+        ).order_by("-created_at")[:20],
+        "book transaction history": InventoryTransaction.objects.filter(
+            book_inventory=book,
+        ).order_by("-created_at")[:20],
+    }
+
+
+def measure(queries, repeat):
+    for name, queryset in queries.items():
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            list(queryset.all())
+            timings.append((time.perf_counter() - start) * 1000)
+        print(f"\n{name}: median {statistics.median(timings):.3f} ms")
+        for line in queryset.explain().splitlines():
+            print(f"    {line}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--books", type=int, default=50)
+    parser.add_argument("--transactions", type=int, default=300000)
+    parser.add_argument("--propagations", type=int, default=50000)
+    parser.add_argument("--requests", type=int, default=200000)
+    parser.add_argument("--repeat", type=int, default=50)
+    options = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        setup_django(os.path.join(tmp, "benchmark.sqlite3"))
+        from django.db import connection
+
+        models = create_tables()
+        print("Seeding...")
+        books, groups = seed(options)
+        queries = hot_queries(books, groups)
+
+        print("\n===== before: no Meta.indexes =====")
+        measure(queries, options.repeat)
+
+        with connection.schema_editor() as editor:
+            for model in models:
+                for index in model._meta.indexes:
+                    editor.add_index(model, index)
+        connection.cursor().execute("ANALYZE")
+
+        print("\n===== after: Meta.indexes =====")
+        measure(queries, options.repeat)
+        connection.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+"""
+เปรียบเทียบ throughput ของการส่งคำขอรับ/สมทบปันธรรมพร้อมกันหลาย process บน SQLite
+ระหว่าง backend ปกติของ Django (rollback journal, BEGIN แบบ deferred)
+กับ utils.sqlite (WAL, busy_timeout, BEGIN IMMEDIATE ของ write_atomic)
+
+แต่ละรอบใช้ฐานข้อมูลไฟล์ใหม่ในโฟลเดอร์ชั่วคราว ไม่แตะ db.sqlite3 ของโปรเจกต์
+การส่งหนึ่งครั้งเท่ากับงานเขียนของ view หลังยืนยัน OTP: บันทึก session แล้วสร้าง
+Propagation (พร้อมกลุ่มเป้าหมาย) หรือ RequestPandham (พร้อมจัดสรรหนังสือ)
+
+    python benchmarks/sqlite_concurrency.py --processes 8 --submissions 50
+"""
+import argparse
+import logging
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+
+PROFILES = {
+    'default': 'django.db.backends.sqlite3',
+    'tuned': 'utils.sqlite',
+}
+
+
+def setup_django(engine, name):
+    sys.path.insert(0, str(BASE_DIR))
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ptptk.settings.dev')
+    os.environ.setdefault('LINE_CHANNEL_ACCESS_TOKEN', 'benchmark')
+    os.environ.setdefault('LINE_CHANNEL_SECRET', 'benchmark')
+
+    from django.conf import settings
+    # ต้องกำหนดก่อน django.setup() เพราะ connection อ่าน DATABASES ครั้งแรกที่ใช้งาน
+    settings.DATABASES['default'].update(ENGINE=engine, NAME=name)
+    settings.SESSION_ENGINE = 'django.contrib.sessions.backends.db'
+    settings.LOGGING_CONFIG = None
+
+    import django
+    django.setup()
+    # ข้อผิดพลาด "database is locked" นับรวมในผลลัพธ์แล้ว
+    logging.disable(logging.CRITICAL)
+
+
+class DisableMigrations(dict):
+    # สร้างตารางจาก model โดยตรง (เหมือน --nomigrations ของ pytest-django)
+    def __contains__(self, item):
+        return True
+
+    def __getitem__(self, item):
+        return None
+
+
+def create_database(processes, submissions):
+    from django.conf import settings
+    from django.core.management import call_command
+
+    settings.MIGRATION_MODULES = DisableMigrations()
+    call_command('migrate', run_syncdb=True, verbosity=0)
+
+    from pandham.models import BookInventory
+    from pandham.models import PandhamStock
+    from pandham.models import PandhamTargetGroup
+
+    stock = processes * submissions * 10
+    book = BookInventory.objects.create(
+        book_name="benchmark", price=100, initial_stock=stock, current_stock=stock)
+    PandhamStock.objects.create(book_inventory=book, initial_stock=stock, current_stock=stock)
+    group = PandhamTargetGroup.objects.create(name="benchmark")
+    return book.pk, group.pk
+
+
+def _create_in_child(engine, name, processes, submissions):
+    setup_django(engine, name)
+    return create_database(processes, submissions)
+
+
+def worker(engine, name, book_id, group_id, worker_id, submissions, start_event, results):
+    setup_django(engine, name)
+
+    from django.contrib.sessions.backends.db import SessionStore
+    from django.db import OperationalError
+    from django.db import close_old_connections
+
+    from pandham.models import Propagation
+    from pandham.models import RequestPandham
+    from utils.db import write_atomic
+
+    latencies, errors = [], 0
+    start_event.wait()
+    for i in range(submissions):
+        phone_number = f"08{worker_id:04d}{i:04d}"
+        start = time.perf_counter()
+        try:
+            session = SessionStore()
+            session['otp_flow'] = phone_number
+            session.save()
+            if i % 2 == 0:
+                # เหมือน ContributePandhamVerifyOTPView.create_propagation
+                with write_atomic():
+                    propagation = Propagation.objects.create(
+                        book_inventory_id=book_id, name="benchmark", phone_number=phone_number,
+                        number_of_books=2, receive_books=1, donate_books=1)
+                    propagation.target_groups.set([group_id])
+            else:
+                RequestPandham.objects.create(
+                    book_inventory_id=book_id, recipient_category_id=group_id,
+                    name="benchmark", phone_number=phone_number)
+        except OperationalError:
+            # "database is locked"
+            errors += 1
+            close_old_connections()
+        latencies.append(time.perf_counter() - start)
+    results.put((latencies, errors))
+
+
+def run(profile, processes, submissions):
+    engine = PROFILES[profile]
+    with tempfile.TemporaryDirectory() as directory:
+        name = os.path.join(directory, 'benchmark.sqlite3')
+        context = multiprocessing.get_context('spawn')
+        setup = context.Pool(1)
+        book_id, group_id = setup.apply(_create_in_child, (engine, name, processes, submissions))
+        setup.close()
+        setup.join()
+
+        start_event = context.Event()
+        results = context.Queue()
+        workers = [
+            context.Process(
+                target=worker,
+                args=(engine, name, book_id, group_id, worker_id, submissions, start_event, results))
+            for worker_id in range(processes)
+        ]
+        for process in workers:
+            process.start()
+        # รอให้ทุก process โหลด Django เสร็จก่อนเริ่มจับเวลา
+        time.sleep(3)
+        started = time.perf_counter()
+        start_event.set()
+        collected = [results.get() for _ in workers]
+        elapsed = time.perf_counter() - started
+        for process in workers:
+            process.join()
+
+    latencies = sorted(latency for worker_latencies, _ in collected for latency in worker_latencies)
+    errors = sum(worker_errors for _, worker_errors in collected)
+    total = len(latencies)
+    return {
+        'profile': profile,
+        'submissions': total,
+        'errors': errors,
+        'throughput': (total - errors) / elapsed,
+        'p50_ms': latencies[total // 2] * 1000,
+        'p95_ms': latencies[min(total - 1, int(total * 0.95))] * 1000,
+        'max_ms': latencies[-1] * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--processes', type=int, default=8, help="Number of concurrent worker processes.")
+    parser.add_argument('--submissions', type=int, default=50, help="Submissions per worker process.")
+    parser.add_argument(
+        '--profile', choices=[*PROFILES, 'both'], default='both',
+        help="Database profile to benchmark (default: both, before and after).")
+    args = parser.parse_args()
+
+    profiles = list(PROFILES) if args.profile == 'both' else [args.profile]
+    print("profile\tsubmissions\terrors\tok/s\tp50_ms\tp95_ms\tmax_ms")
+    for profile in profiles:
+        result = run(profile, args.processes, args.submissions)
+        print(
+            f"{result['profile']}\t{result['submissions']}\t{result['errors']}\t{result['throughput']:.1f}"
+            f"\t{result['p50_ms']:.1f}\t{result['p95_ms']:.1f}\t{result['max_ms']:.1f}"
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+"""
+ย้ายรายการ InventoryTransaction ของปีที่ปิดแล้วออกจากตาราง ledger
+รายการถูกเขียนเป็นไฟล์ JSONL บีบอัดด้วย gzip ใน media/ และเหลือยอดสรุป
+(InventoryTransactionSummary) ต่อหนังสือและประเภทไว้แทน ยอดคงเหลือจึงยังคำนวณได้ตรง
+"""
+import datetime
+import gzip
+import json
+import tempfile
+
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db.models import Max
+from django.utils import timezone
+
+from utils.db import write_atomic
+
+from .ledger import create_checkpoint
+from .ledger import latest_checkpoint
+from .models import InventoryTransaction
+from .models import InventoryTransactionSummary
+from .models import StockCheckpoint
+
+
+ARCHIVE_DIR = 'ledger-archive'
+ARCHIVE_FIELDS = [
+    'id', 'book_inventory_id', 'transaction_type', 'quantity', 'details', 'created_at', 'updated_at',
+]
+
+
+def year_bounds(year):
+    tz = timezone.get_current_timezone()
+    return (
+        timezone.make_aware(datetime.datetime(year, 1, 1), tz),
+        timezone.make_aware(datetime.datetime(year + 1, 1, 1), tz),
+    )
+
+
+def archivable(cutoff, checkpoint=True):
+    """
+    รายการก่อน cutoff ที่ checkpoint ล่าสุดนับรวมแล้ว (สร้าง checkpoint ใหม่ก่อนเพื่อให้ครอบคลุม)
+    คืนค่า (queryset, รายการปีที่มีรายการให้ archive)
+    """
+    if checkpoint:
+        create_checkpoint()
+    boundary, _ = latest_checkpoint()
+    queryset = InventoryTransaction.objects.filter(created_at__lt=cutoff, pk__lte=boundary)
+    years = [date.year for date in queryset.dates('created_at', 'year')]
+    return queryset, years
+
+
+def archive_year(queryset, year, chunk_size=1000):
+    """
+    archive รายการใน queryset ของปี year คืนค่า (จำนวนรายการ, path ของไฟล์ archive) หรือ (0, None)
+    เขียนไฟล์นอก transaction แล้วจึงลงยอดสรุปและลบรายการทีละชุดใน transaction สั้น ๆ
+    เพื่อไม่ถือสิทธิ์เขียนของฐานข้อมูลไว้ตลอดงาน
+    """
+    start, end = year_bounds(year)
+    rows = queryset.filter(created_at__gte=start, created_at__lt=end).order_by('pk')
+    # ตรึงช่วงของรายการไว้ที่ last_id ทั้งไฟล์และการลบใช้ช่วงเดียวกัน
+    last_id = rows.aggregate(last_id=Max('pk'))['last_id']
+    if last_id is None:
+        return 0, None
+    rows = rows.filter(pk__lte=last_id)
+
+    with tempfile.TemporaryFile() as tmp:
+        first_id = None
+        with gzip.GzipFile(fileobj=tmp, mode='wb') as archive:
+            for row in rows.values(*ARCHIVE_FIELDS).iterator(chunk_size=chunk_size):
+                archive.write(json.dumps(row, ensure_ascii=False, default=str).encode('utf-8') + b'\n')
+                if first_id is None:
+                    first_id = row['id']
+        if first_id is None:
+            return 0, None
+        tmp.seek(0)
+        path = default_storage.save(
+            f"{ARCHIVE_DIR}/inventory-transactions-{year}-{first_id}-{last_id}.jsonl.gz", File(tmp))
+
+    summaries = {}
+    count = 0
+    after_id = 0
+    try:
+        while True:
+            archived_id, archived_count = _archive_chunk(
+                rows.filter(pk__gt=after_id), start, end, path, summaries, chunk_size)
+            if not archived_count:
+                break
+            after_id = archived_id
+            count += archived_count
+    except Exception:
+        # ยังไม่มียอดสรุปใดอ้างถึงไฟล์ จึงลบทิ้งได้ และการรันใหม่จะเขียนไฟล์ชื่อเดิม
+        # ถ้าบางชุด commit ไปแล้ว ไฟล์คือที่เก็บรายการของชุดเหล่านั้นจึงต้องเก็บไว้
+        if not count:
+            default_storage.delete(path)
+        raise
+    return count, path
+
+
+def _archive_chunk(rows, start, end, path, summaries, chunk_size):
+    """
+    ลงยอดสรุปและลบรายการชุดถัดไปใน transaction เดียว ยอดสรุปจึงตรงกับรายการที่ถูกลบเสมอ
+    summaries คือ InventoryTransactionSummary ของไฟล์นี้ต่อ (หนังสือ, ประเภท) ที่สะสมข้ามชุด
+    คืนค่า (id สุดท้ายของชุด, จำนวนรายการ) หรือ (None, 0) เมื่อไม่มีรายการเหลือ
+    """
+    with write_atomic():
+        chunk = list(rows.values_list('pk', 'book_inventory_id', 'transaction_type', 'quantity')[:chunk_size])
+        if not chunk:
+            return None, 0
+        created, changed = set(), set()
+        for pk, book_id, transaction_type, quantity in chunk:
+            key = (book_id, transaction_type)
+            summary = summaries.get(key)
+            if summary is None:
+                summary = summaries[key] = InventoryTransactionSummary(
+                    book_inventory_id=book_id,
+                    transaction_type=transaction_type,
+                    period_start=start,
+                    period_end=end,
+                    archive_file=path,
+                    quantity=0,
+                    transaction_count=0,
+                    first_transaction_id=pk,
+                )
+                created.add(key)
+            elif key not in created:
+                changed.add(key)
+            summary.quantity += quantity
+            summary.transaction_count += 1
+            summary.last_transaction_id = pk
+        InventoryTransactionSummary.objects.bulk_create([summaries[key] for key in created])
+        InventoryTransactionSummary.objects.bulk_update(
+            [summaries[key] for key in changed], ['quantity', 'transaction_count', 'last_transaction_id'])
+
+        last_id = chunk[-1][0]
+        InventoryTransaction.objects.filter(pk__in=[row[0] for row in chunk]).delete()
+        # checkpoint ที่นับรายการ archive ไม่ครบใช้ไม่ได้อีก (ดู pandham.ledger.archived_totals)
+        StockCheckpoint.objects.filter(last_transaction_id__lt=last_id).delete()
+    return last_id, len(chunk)
@@ -0,0 +1,103 @@
+"""
+cache ความพร้อมของหนังสือรายเล่ม (สต็อกคลังหลัก, สต็อกปันธรรม, ราคา, พร้อมใช้งาน)
+entry ถูกลบเมื่อมีการลงยอดสต็อก (stock_changed หลัง commit) หรือแก้ไขหนังสือ/คลังปันธรรม
+พร้อมกับเปลี่ยน stock version ที่ใช้เป็น ETag/Last-Modified ของ stock API
+"""
+import datetime
+
+from django.core.cache import cache
+from django.db.models import Max
+from django.utils import timezone
+
+from .models import BookInventory
+from .models import InventoryTransaction
+from .models import PandhamStock
+
+
+# อายุของ entry (วินาที) เผื่อกรณีที่การล้าง cache ชนกับการอ่านค่าเก่า
+AVAILABILITY_TIMEOUT = 300
+STOCK_VERSION_KEY = 'pandham:stock_version'
+
+
+def _availability_key(book_id):
+    return f"pandham:availability:{book_id}"
+
+
+def get_many(book_ids):
+    """
+    คืน dict {book_id: availability} ของหนังสือที่มีอยู่จริง
+    อ่านจาก cache ก่อน แล้วดึงเล่มที่ไม่มีใน cache ด้วย query เดียว
+    """
+    keys = {int(book_id): _availability_key(book_id) for book_id in book_ids}
+    cached = cache.get_many(keys.values())
+    availability = {
+        book_id: cached[key] for book_id, key in keys.items() if key in cached
+    }
+
+    missing = [book_id for book_id in keys if book_id not in availability]
+    if missing:
+        rows = BookInventory.objects.filter(pk__in=missing).values(
+            'id', 'book_name', 'price', 'is_available',
+            'current_stock', 'stock__current_stock',
+        )
+        fresh = {}
+        for row in rows:
+            fresh[row['id']] = {
+                'book_name': row['book_name'],
+                'price': row['price'],
+                'is_available': row['is_available'],
+                'main_stock': row['current_stock'],
+                'pandham_stock': row['stock__current_stock'] or 0,
+            }
+        cache.set_many(
+            {keys[book_id]: entry for book_id, entry in fresh.items()},
+            AVAILABILITY_TIMEOUT,
+        )
+        availability.update(fresh)
+    return availability
+
+
+def get(book_id):
+    """
+    คืน availability ของหนังสือหนึ่งเล่ม หรือ None หากไม่พบหนังสือ
+    """
+    return get_many([book_id]).get(int(book_id))
+
+
+def invalidate(book_ids):
+    cache.delete_many([_availability_key(book_id) for book_id in book_ids])
+    bump_stock_version()
+
+
+def _version_from(last_modified):
+    return {
+        'stamp': int(last_modified.timestamp() * 1_000_000),
+        'last_modified': last_modified,
+    }
+
+
+def stock_version():
+    """
+    คืน {'stamp', 'last_modified'} ของการเปลี่ยนแปลงสต็อกล่าสุด
+    ถ้าไม่มีใน cache จะคำนวณจากเวลาแก้ไขล่าสุดของรายการบัญชีและตารางสต็อก
+    """
+    version = cache.get(STOCK_VERSION_KEY)
+    if version is None:
+        # การแก้ไขรายการบัญชีเดิมจะปรับ updated_at ของตารางสต็อกด้วย
+        # จึงใช้ created_at (มี index) ของรายการบัญชีได้
+        candidates = [
+            InventoryTransaction.objects.aggregate(last=Max('created_at'))['last'],
+            BookInventory.objects.aggregate(last=Max('updated_at'))['last'],
+            PandhamStock.objects.aggregate(last=Max('updated_at'))['last'],
+        ]
+        last_modified = max(
+            filter(None, candidates),
+            default=datetime.datetime(2000, 1, 1, tzinfo=datetime.timezone.utc),
+        )
+        cache.add(STOCK_VERSION_KEY, _version_from(last_modified), None)
+        version = cache.get(STOCK_VERSION_KEY) or _version_from(last_modified)
+    return version
+
+
+def bump_stock_version():
+    cache.set(STOCK_VERSION_KEY, _version_from(timezone.now()), None)
@@ -0,0 +1,116 @@
+"""
+ป้ายกำกับหน้าเว็บที่ wagtail-cache เก็บไว้ ตามหนังสือที่หน้านั้นแสดงสต็อก
+เมื่อสต็อกของหนังสือเปลี่ยน จะล้างเฉพาะหน้าที่ขึ้นกับหนังสือนั้น แทนการล้าง cache ทั้งหมด
+
+หนังสือแต่ละเล่มมีรุ่น (generation) ของตัวเองใน cache และหน้าที่แสดงหนังสือจะถูกเก็บ
+แยกตามรุ่นของหนังสือผ่าน header Vary การล้างจึงเป็นเพียงการเปลี่ยนรุ่น
+ไม่มีการอ่าน-แก้-เขียนรายการ URL ที่ใช้ร่วมกันระหว่าง worker
+"""
+import hashlib
+import time
+from urllib.parse import unquote
+
+from django.core.cache import caches
+from django.utils.cache import patch_vary_headers
+from wagtailcache.cache import _chop_querystring
+from wagtailcache.settings import wagtailcache_settings
+
+
+STAMP_HEADER = "X-Pandham-Stock"
+STAMP_META = "HTTP_X_PANDHAM_STOCK"
+
+
+def _generation_key(book_id):
+    return f"pandham:cache_tags:generation:{book_id}"
+
+
+def _page_key(uri):
+    digest = hashlib.md5(uri.encode(), usedforsecurity=False).hexdigest()
+    return f"pandham:cache_tags:page:{digest}"
+
+
+def _get_cache():
+    return caches[wagtailcache_settings.WAGTAIL_CACHE_BACKEND]
+
+
+def _get_uri(request):
+    # สร้างแบบเดียวกับ keyring ของ wagtail-cache
+    return unquote(_chop_querystring(request).build_absolute_uri())
+
+
+def tag_request(request, book_ids):
+    """
+    บันทึกว่าหน้าของ request นี้แสดงข้อมูลของหนังสือใน book_ids
+    """
+    tags = getattr(request, '_pandham_book_tags', None)
+    if tags is None:
+        tags = request._pandham_book_tags = set()
+    tags.update(int(book_id) for book_id in book_ids)
+
+
+def get_request_tags(request):
+    return getattr(request, '_pandham_book_tags', set())
+
+
+def stamp(book_ids):
+    """
+    คืนค่ารุ่นของหนังสือใน book_ids ในรูปข้อความ ใช้เป็นค่าของ header STAMP_HEADER
+    หนังสือที่ยังไม่มีรุ่น (หรือรุ่นหลุดจาก cache) จะได้รุ่นใหม่ที่ไม่เคยใช้มาก่อน
+    """
+    cache = _get_cache()
+    keys = {book_id: _generation_key(book_id) for book_id in sorted(book_ids)}
+    generations = cache.get_many(list(keys.values()))
+    missing = [key for key in keys.values() if key not in generations]
+    if missing:
+        now = time.time_ns()
+        for key in missing:
+            cache.add(key, now, None)
+        generations.update(cache.get_many(missing))
+    return ",".join(
+        f"{book_id}:{generations.get(key, 0)}" for book_id, key in keys.items()
+    )
+
+
+def purge(book_ids):
+    """
+    ล้างเฉพาะหน้าใน wagtail-cache ที่แสดงหนังสือใน book_ids
+    หน้าที่เก็บไว้ใต้รุ่นเดิมจะไม่ถูกเรียกอีกและหมดอายุไปเอง
+    """
+    if not wagtailcache_settings.WAGTAIL_CACHE or not book_ids:
+        return
+    now = time.time_ns()
+    _get_cache().set_many(
+        {_generation_key(book_id): now for book_id in set(book_ids)}, None)
+
+
+# ====================================
+# Middleware
+# ====================================
+class StockCacheTagMiddleware:
+    """
+    ใส่รุ่นของหนังสือที่หน้านี้แสดงลงใน request ก่อน wagtail-cache คำนวณ cache key
+    ต้องอยู่ระหว่าง wagtailcache.cache.UpdateCacheMiddleware และ FetchFromCacheMiddleware
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not wagtailcache_settings.WAGTAIL_CACHE:
+            return self.get_response(request)
+
+        cache = _get_cache()
+        page_key = _page_key(_get_uri(request))
+        # หนังสือของหน้านี้จากการแสดงครั้งก่อน เก็บหนึ่ง key ต่อหน้า
+        known = cache.get(page_key)
+        if known:
+            request.META[STAMP_META] = stamp(known)
+        response = self.get_response(request)
+
+        book_ids = get_request_tags(request)
+        if book_ids:
+            if set(known or ()) != book_ids:
+                cache.set(page_key, sorted(book_ids))
+                request.META[STAMP_META] = stamp(book_ids)
+            patch_vary_headers(response, [STAMP_HEADER])
+        return response
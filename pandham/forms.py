@@ -6,7 +6,109 @@ from utils.clean_phone_number import clean_phone_number
 
 from .models import Propagation, RequestPandham, InventoryTransaction
 
-class RequestPandhamForm(forms.ModelForm):
+
+# =============================
+# ฟิลด์ที่ดึงตัวเลือกผ่าน PandhamLoader ของ request
+# หากไม่ได้กำหนด loader จะทำงานเหมือน ModelChoiceField ปกติ
+# =============================
+class BookInventoryChoiceField(forms.ModelChoiceField):
+    loader = None
+
+    def to_python(self, value):
+        if self.loader is None or value in self.empty_values:
+            return super().to_python(value)
+        try:
+            book = self.loader.book(value)
+        except (TypeError, ValueError):
+            book = None
+        if book is None:
+            raise ValidationError(
+                self.error_messages["invalid_choice"],
+                code="invalid_choice",
+                params={"value": value},
+            )
+        return book
+
+
+class TargetGroupLoaderMixin:
+    loader = None
+
+    def set_loader(self, loader):
+        self.loader = loader
+        choices = [(group.pk, self.label_from_instance(group)) for group in loader.target_groups()]
+        if self.empty_label is not None:
+            choices.insert(0, ("", self.empty_label))
+        self.choices = choices
+
+    def groups_by_pk(self):
+        return {str(group.pk): group for group in self.loader.target_groups()}
+
+
+class TargetGroupChoiceField(TargetGroupLoaderMixin, forms.ModelChoiceField):
+    def to_python(self, value):
+        if self.loader is None or value in self.empty_values:
+            return super().to_python(value)
+        group = self.groups_by_pk().get(str(value))
+        if group is None:
+            raise ValidationError(
+                self.error_messages["invalid_choice"],
+                code="invalid_choice",
+                params={"value": value},
+            )
+        return group
+
+
+class TargetGroupMultipleChoiceField(TargetGroupLoaderMixin, forms.ModelMultipleChoiceField):
+    def _check_values(self, value):
+        if self.loader is None:
+            return super()._check_values(value)
+        groups = self.groups_by_pk()
+        selected = []
+        for pk in dict.fromkeys(str(pk) for pk in value):
+            if pk not in groups:
+                raise ValidationError(
+                    self.error_messages["invalid_choice"],
+                    code="invalid_choice",
+                    params={"value": pk},
+                )
+            selected.append(groups[pk])
+        return selected
+
+
+class LoaderFormMixin:
+    """
+    รับ loader (PandhamLoader) จาก view แล้วส่งต่อให้ฟิลด์ที่รองรับ
+    """
+    loader_fields = ()
+
+    def set_loader(self, loader):
+        if loader is None:
+            return
+        loader_fields = []
+        for name, field in self.fields.items():
+            if isinstance(field, TargetGroupLoaderMixin):
+                field.set_loader(loader)
+            elif isinstance(field, BookInventoryChoiceField):
+                field.loader = loader
+            else:
+                continue
+            loader_fields.append(name)
+        self.loader_fields = tuple(loader_fields)
+
+    def _get_validation_exclusions(self):
+        # ฟิลด์ที่ดึง object ผ่าน loader ตรวจสอบแล้วว่ามีอยู่จริง
+        # ไม่ต้องให้ model ตรวจ ForeignKey ซ้ำด้วย query อีกครั้ง
+        exclude = super()._get_validation_exclusions()
+        exclude.update(self.loader_fields)
+        return exclude
+
+
+class RequestPandhamForm(LoaderFormMixin, forms.ModelForm):
+    def __init__(self, *args, **kwargs):
+        loader = kwargs.pop('loader', None)
+        super().__init__(*args, **kwargs)
+        self.set_loader(loader)
+
     def clean_phone_number(self):
         phone_number = self.cleaned_data['phone_number']
         return clean_phone_number(phone_number)
@@ -18,6 +120,10 @@ class RequestPandhamForm(forms.ModelForm):
             widget=forms.Textarea,
             help_text=_("Enter the shipping address and receiver contact number.")
         )
+        field_classes = {
+            "book_inventory": BookInventoryChoiceField,
+            "recipient_category": TargetGroupChoiceField,
+        }
         fields = [
             "book_inventory",
             "accept_terms",
@@ -44,7 +150,7 @@ class RequestPandhamForm(forms.ModelForm):
         }
 
 
-class ContributeForm(forms.ModelForm):
+class ContributeForm(LoaderFormMixin, forms.ModelForm):
     def clean_phone_number(self):
         phone_number = self.cleaned_data['phone_number']
         return clean_phone_number(phone_number)
@@ -56,8 +162,10 @@ class ContributeForm(forms.ModelForm):
         step_contribute_value = kwargs.pop('step_contribute_value', 500)
         # เอาค่า max no_of_book ออกจาก kwargs
         max_number_of_book_value = kwargs.pop('max_number_of_book_value', 500)
+        loader = kwargs.pop('loader', None)
 
         super().__init__(*args, **kwargs)
+        self.set_loader(loader)
         # ตั้งค่า attributes ของวิดเจ็ต amount_contributed โดยใช้ค่า min_value และ max_value
         self.fields['amount_contributed'].widget = forms.NumberInput(attrs={
             "class": "form-range", "type": "range",
@@ -70,6 +178,10 @@ class ContributeForm(forms.ModelForm):
 
     class Meta:
         model = Propagation
+        field_classes = {
+            "book_inventory": BookInventoryChoiceField,
+            "target_groups": TargetGroupMultipleChoiceField,
+        }
         fields = [
             "book_inventory",
             "amount_contributed",
@@ -0,0 +1,277 @@
+"""
+การวัดเวลาและจำนวน query ของ pandham (เปิดใช้ด้วย settings.PANDHAM_INSTRUMENTATION)
+- PandhamInstrumentationMiddleware วัดทุก view ของ pandham
+- instrument() ใช้เป็น context manager หรือ decorator สำหรับ save() ของ model และการเรียกบริการภายนอก
+
+ผลการวัดเก็บใน ring buffer ของแต่ละ process และ thread เบื้องหลังส่งสำเนาขึ้น cache เป็นระยะ
+เพื่อให้หน้า report ใน Wagtail admin และคำสั่ง pandham_metrics เห็นข้อมูลของทุก worker
+"""
+import contextlib
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+
+logger = logging.getLogger(__name__)
+
+# ขอบบนของช่วง histogram เวลา (มิลลิวินาที) ช่องสุดท้ายคือเกินค่าสูงสุด
+LATENCY_BUCKETS_MS = (10, 25, 50, 100, 250, 500, 1000, 2500)
+# ระยะห่างระหว่างการส่งสำเนา ring buffer ขึ้น cache (วินาที)
+PUBLISH_INTERVAL = 10
+PUBLISH_TIMEOUT = 60 * 60
+
+PIDS_KEY = 'pandham:instrumentation:pids'
+PIDS_LOCK_KEY = 'pandham:instrumentation:pids:lock'
+PIDS_LOCK_TIMEOUT = 5
+
+
+def is_enabled():
+    return getattr(settings, 'PANDHAM_INSTRUMENTATION', False)
+
+
+def _samples_key(pid):
+    return f"pandham:instrumentation:{pid}"
+
+
+# ====================================
+# Ring buffer
+# ====================================
+class RingBuffer:
+    def __init__(self, size):
+        self._samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._publisher = None
+        self._pid = None
+
+    def append(self, sample):
+        with self._lock:
+            self._samples.append(sample)
+            self._dirty = True
+        self._ensure_publisher()
+
+    def snapshot(self):
+        with self._lock:
+            return list(self._samples)
+
+    def clear(self):
+        with self._lock:
+            self._samples.clear()
+
+    def _ensure_publisher(self):
+        # เริ่ม thread ใหม่เมื่อยังไม่มี หรือหลังจาก worker process ถูก fork มา
+        if self._publisher and self._publisher.is_alive() and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._publisher and self._publisher.is_alive() and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._publisher = threading.Thread(target=self._run, name='pandham-instrumentation', daemon=True)
+            self._publisher.start()
+
+    def _run(self):
+        # ส่งขึ้น cache จาก thread นี้เท่านั้น request ไม่ต้องรอการเขียน cache
+        while True:
+            time.sleep(PUBLISH_INTERVAL)
+            with self._lock:
+                dirty, self._dirty = self._dirty, False
+            if not dirty:
+                continue
+            try:
+                self.publish()
+            except Exception:
+                logger.exception("ส่งผลการวัดขึ้น cache ไม่สำเร็จ")
+
+    def publish(self):
+        """
+        ส่งสำเนาของ process นี้ขึ้น cache ใน key ของ pid เอง
+        และเพิ่ม pid ลงในดัชนีเมื่อยังไม่มี
+        """
+        pid = os.getpid()
+        cache.set(_samples_key(pid), self.snapshot(), PUBLISH_TIMEOUT)
+        if pid not in cache.get(PIDS_KEY, {}):
+            _register_pid(pid)
+
+
+def _register_pid(pid):
+    """
+    เพิ่ม pid ลงในดัชนีภายใต้ lock (cache.add) และตัด pid ที่ข้อมูลหมดอายุแล้วออก
+    ถ้าได้ lock ไม่ทันหรือการเขียนชนกันจน pid หายไป การ publish ครั้งถัดไปจะเพิ่มใหม่เอง
+    """
+    if not cache.add(PIDS_LOCK_KEY, pid, PIDS_LOCK_TIMEOUT):
+        return False
+    try:
+        pids = cache.get(PIDS_KEY, {})
+        published = cache.get_many([_samples_key(p) for p in pids])
+        pids = {p: seen for p, seen in pids.items() if _samples_key(p) in published}
+        pids[pid] = time.time()
+        cache.set(PIDS_KEY, pids, PUBLISH_TIMEOUT)
+    finally:
+        cache.delete(PIDS_LOCK_KEY)
+    return True
+
+
+buffer = RingBuffer(getattr(settings, 'PANDHAM_INSTRUMENTATION_BUFFER', 2000))
+
+
+# ====================================
+# การวัด
+# ====================================
+class Measurement:
+    """
+    จับเวลาและนับ query ที่ทำบนทุกฐานข้อมูลใน thread นี้ ระหว่าง with block
+    """
+
+    def __init__(self, count_queries=True):
+        self.count_queries = count_queries
+        self.queries = 0
+        self.query_time = 0.0
+        self.duration = 0.0
+        self._stack = None
+
+    def __call__(self, execute, sql, params, many, context):
+        # execute_wrapper ของ Django
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.query_time += time.perf_counter() - start
+
+    def __enter__(self):
+        self._stack = contextlib.ExitStack()
+        if self.count_queries:
+            for connection in connections.all():
+                self._stack.enter_context(connection.execute_wrapper(self))
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.duration = time.perf_counter() - self._start
+        self._stack.close()
+
+    def record(self, kind, name, **extra):
+        sample = {
+            'kind': kind,
+            'name': name,
+            'at': time.time(),
+            'ms': self.duration * 1000,
+            'queries': self.queries if self.count_queries else None,
+            'query_ms': self.query_time * 1000 if self.count_queries else None,
+        }
+        sample.update(extra)
+        buffer.append(sample)
+        return sample
+
+
+@contextlib.contextmanager
+def instrument(name, kind='call', count_queries=True):
+    """
+    วัด block หรือฟังก์ชัน (ใช้เป็น decorator ได้) แล้วบันทึกลง ring buffer
+    """
+    if not is_enabled():
+        yield
+        return
+    error = False
+    measurement = Measurement(count_queries)
+    try:
+        with measurement:
+            yield
+    except Exception:
+        error = True
+        raise
+    finally:
+        measurement.record(kind, name, error=error)
+
+
+# ====================================
+# Middleware
+# ====================================
+class PandhamInstrumentationMiddleware:
+    def __init__(self, get_response):
+        if not is_enabled():
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with Measurement() as measurement:
+            response = self.get_response(request)
+        match = getattr(request, 'resolver_match', None)
+        if match is not None and match.func.__module__.startswith('pandham.'):
+            measurement.record(
+                'view', match.view_name,
+                method=request.method, status=response.status_code, error=response.status_code >= 500,
+            )
+        return response
+
+
+# ====================================
+# รวบรวมผล
+# ====================================
+def collect():
+    """
+    คืน sample ของทุก worker ที่ส่งขึ้น cache (ของ process นี้ใช้ข้อมูลล่าสุดจาก buffer)
+    """
+    current = os.getpid()
+    samples = buffer.snapshot()
+    pids = [pid for pid in cache.get(PIDS_KEY, {}) if pid != current]
+    for published in cache.get_many([_samples_key(pid) for pid in pids]).values():
+        samples.extend(published)
+    return samples
+
+
+def reset():
+    buffer.clear()
+    pids = cache.get(PIDS_KEY, {})
+    cache.delete_many([_samples_key(pid) for pid in pids] + [PIDS_KEY])
+
+
+def _percentile(values, percent):
+    index = min(len(values) - 1, int(round(percent / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def summarize(samples):
+    """
+    สรุปผลแยกตาม (kind, name): จำนวน, percentile ของเวลา, histogram และจำนวน query
+    """
+    groups = {}
+    for sample in samples:
+        groups.setdefault((sample['kind'], sample['name']), []).append(sample)
+
+    rows = []
+    for (kind, name), group in sorted(groups.items()):
+        durations = sorted(sample['ms'] for sample in group)
+        histogram = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        for duration in durations:
+            histogram[sum(duration > bound for bound in LATENCY_BUCKETS_MS)] += 1
+        queries = [sample['queries'] for sample in group if sample['queries'] is not None]
+        query_ms = [sample['query_ms'] for sample in group if sample['query_ms'] is not None]
+        rows.append({
+            'kind': kind,
+            'name': name,
+            'count': len(group),
+            'errors': sum(1 for sample in group if sample.get('error')),
+            'p50_ms': _percentile(durations, 50),
+            'p95_ms': _percentile(durations, 95),
+            'p99_ms': _percentile(durations, 99),
+            'max_ms': durations[-1],
+            'avg_queries': sum(queries) / len(queries) if queries else None,
+            'max_queries': max(queries) if queries else None,
+            'avg_query_ms': sum(query_ms) / len(query_ms) if query_ms else None,
+            'histogram': histogram,
+        })
+    return rows
+
+
+def histogram_labels():
+    labels = [f"≤{bound}ms" for bound in LATENCY_BUCKETS_MS]
+    labels.append(f">{LATENCY_BUCKETS_MS[-1]}ms")
+    return labels
@@ -0,0 +1,184 @@
+"""
+ฟังก์ชันคำนวณยอดคงเหลือจากรายการ InventoryTransaction (ledger)
+"""
+import datetime
+
+from django.db.models import Max
+from django.db.models import Sum
+from django.utils import timezone
+
+from utils.db import write_atomic
+
+from .models import BookInventory
+from .models import InventoryTransaction
+from .models import InventoryTransactionSummary
+from .models import PandhamStock
+from .models import StockCheckpoint
+
+
+def ledger_totals(queryset=None):
+    """
+    รวมยอดสุทธิของ ledger ต่อหนังสือด้วย GROUP BY (book_inventory, transaction_type) query เดียว
+    คืนค่า dict {book_inventory_id: (ยอดคลังหลัก, ยอดคลังปันธรรม)}
+    """
+    if queryset is None:
+        queryset = InventoryTransaction.objects.all()
+    rows = queryset.order_by().values_list(
+        'book_inventory_id', 'transaction_type',
+    ).annotate(total=Sum('quantity'))
+    return _sum_by_type(rows)
+
+
+def _sum_by_type(rows):
+    # rows คือ (book_inventory_id, transaction_type, ยอดรวม)
+    totals = {}
+    for book_id, transaction_type, total in rows:
+        main, pandham = InventoryTransaction.STOCK_EFFECTS.get(transaction_type, (0, 0))
+        current_main, current_pandham = totals.get(book_id, (0, 0))
+        totals[book_id] = (current_main + main * total, current_pandham + pandham * total)
+    return totals
+
+
+def _merge_totals(totals, extra):
+    for book_id, (main, pandham) in extra.items():
+        current_main, current_pandham = totals.get(book_id, (0, 0))
+        totals[book_id] = (current_main + main, current_pandham + pandham)
+    return totals
+
+
+def archived_totals(after_id=0, at=None, book_ids=None):
+    """
+    ยอดสุทธิของรายการที่ archive ไปแล้ว (InventoryTransactionSummary) ที่มี id หลัง after_id
+    คำสั่ง archive_transactions ลบ checkpoint ที่นับรายการ archive ไม่ครบทิ้ง
+    checkpoint ที่เหลือจึงรวมรายการ archive ทั้งหมดแล้ว หรือไม่มี checkpoint เลย (after_id=0)
+    ถ้าระบุ at จะนับเฉพาะช่วงที่จบก่อน at (ยอดย้อนหลังในปีที่ archive แล้วละเอียดถึงระดับปี)
+    """
+    summaries = InventoryTransactionSummary.objects.filter(last_transaction_id__gt=after_id)
+    if at is not None:
+        summaries = summaries.filter(period_end__lte=at)
+    if book_ids is not None:
+        summaries = summaries.filter(book_inventory_id__in=book_ids)
+    rows = summaries.order_by().values_list(
+        'book_inventory_id', 'transaction_type',
+    ).annotate(total=Sum('quantity'))
+    return _sum_by_type(rows)
+
+
+def latest_checkpoint(at=None):
+    """
+    คืนค่า (last_transaction_id, {book_inventory_id: (ยอดคลังหลัก, ยอดคลังปันธรรม)})
+    ของ checkpoint ล่าสุด หรือของ checkpoint ล่าสุดก่อนเวลา at ถ้าระบุ
+    ถ้ายังไม่มี checkpoint คืนค่า (0, {})
+    """
+    checkpoints = StockCheckpoint.objects.all()
+    if at is not None:
+        checkpoints = checkpoints.filter(as_of__lte=at)
+    boundary = checkpoints.aggregate(boundary=Max('last_transaction_id'))['boundary']
+    if boundary is None:
+        return 0, {}
+    rows = StockCheckpoint.objects.filter(last_transaction_id=boundary).values_list(
+        'book_inventory_id', 'main_total', 'pandham_total',
+    )
+    return boundary, {book_id: (main, pandham) for book_id, main, pandham in rows}
+
+
+def stock_totals(at=None, use_checkpoints=True, book_ids=None):
+    """
+    ยอดสุทธิของ ledger ต่อหนังสือ ณ ปัจจุบันหรือ ณ เวลา at (เฉพาะหนังสือใน book_ids ถ้าระบุ)
+    เริ่มจาก checkpoint ล่าสุดแล้วรวมเฉพาะรายการหลังจากนั้น
+    จึงไม่ต้องรวมประวัติทั้งหมดของ ledger ทุกครั้ง
+    """
+    boundary, totals = latest_checkpoint(at) if use_checkpoints else (0, {})
+    queryset = InventoryTransaction.objects.filter(pk__gt=boundary)
+    if book_ids is not None:
+        totals = {book_id: total for book_id, total in totals.items() if book_id in book_ids}
+        queryset = queryset.filter(book_inventory_id__in=book_ids)
+    _merge_totals(totals, archived_totals(boundary, at, book_ids))
+    if at is not None:
+        queryset = queryset.filter(created_at__lte=at)
+    return _merge_totals(totals, ledger_totals(queryset))
+
+
+def stock_balances(at=None):
+    """
+    ยอดคงเหลือ (initial_stock + ยอดสุทธิของ ledger) ของคลังหลักและคลังปันธรรม ณ เวลา at
+    คืนค่า dict {book_inventory_id: (คลังหลัก, คลังปันธรรม)}
+    """
+    totals = stock_totals(at)
+    pandham_initial = dict(PandhamStock.objects.values_list('book_inventory_id', 'initial_stock'))
+    balances = {}
+    for book_id, initial_stock in BookInventory.objects.values_list('pk', 'initial_stock'):
+        main, pandham = totals.get(book_id, (0, 0))
+        balances[book_id] = (initial_stock + main, pandham_initial.get(book_id, 0) + pandham)
+    return balances
+
+
+def create_checkpoint(lag=datetime.timedelta(minutes=1)):
+    """
+    บันทึก checkpoint ใหม่ต่อหนังสือทุกเล่ม จาก checkpoint ก่อนหน้า + รายการที่เพิ่มมา
+    นับเฉพาะรายการที่เก่ากว่า lag เพื่อไม่ข้ามรายการที่ยัง commit ไม่เสร็จ
+    คืนค่า last_transaction_id ของ checkpoint ใหม่ หรือ None ถ้าไม่มีรายการใหม่
+    """
+    with write_atomic():
+        previous, totals = latest_checkpoint()
+        settled = InventoryTransaction.objects.filter(
+            pk__gt=previous, created_at__lte=timezone.now() - lag,
+        ).aggregate(boundary=Max('pk'), as_of=Max('created_at'))
+        if settled['boundary'] is None:
+            return None
+
+        new_transactions = InventoryTransaction.objects.filter(
+            pk__gt=previous, pk__lte=settled['boundary'],
+        )
+        _merge_totals(totals, archived_totals(previous))
+        _merge_totals(totals, ledger_totals(new_transactions))
+
+        StockCheckpoint.objects.bulk_create([
+            StockCheckpoint(
+                book_inventory_id=book_id,
+                last_transaction_id=settled['boundary'],
+                as_of=settled['as_of'],
+                main_total=main,
+                pandham_total=pandham,
+            )
+            for book_id, (main, pandham) in totals.items()
+        ])
+        return settled['boundary']
+
+
+def stock_discrepancies(totals=None, book_ids=None):
+    """
+    เปรียบเทียบ current_stock ของ BookInventory และ PandhamStock กับยอดที่คำนวณจาก ledger
+    (initial_stock + ยอดสุทธิของ ledger) โดยใช้ query เดียวต่อตาราง
+    yield (book_inventory_id, ชื่อคลัง 'main' หรือ 'pandham', ยอดที่บันทึก, ยอดที่ควรเป็น)
+    """
+    if totals is None:
+        totals = stock_totals(book_ids=book_ids)
+
+    books = BookInventory.objects.all()
+    stocks = PandhamStock.objects.all()
+    if book_ids is not None:
+        books = books.filter(pk__in=book_ids)
+        stocks = stocks.filter(book_inventory_id__in=book_ids)
+        totals = {book_id: total for book_id, total in totals.items() if book_id in book_ids}
+
+    books = books.order_by('pk').values_list('pk', 'initial_stock', 'current_stock')
+    for book_id, initial_stock, current_stock in books.iterator():
+        expected = initial_stock + totals.get(book_id, (0, 0))[0]
+        if current_stock != expected:
+            yield book_id, 'main', current_stock, expected
+
+    stocked = set()
+    stocks = stocks.order_by('book_inventory_id').values_list(
+        'book_inventory_id', 'initial_stock', 'current_stock',
+    )
+    for book_id, initial_stock, current_stock in stocks.iterator():
+        stocked.add(book_id)
+        expected = initial_stock + totals.get(book_id, (0, 0))[1]
+        if current_stock != expected:
+            yield book_id, 'pandham', current_stock, expected
+
+    # หนังสือที่มียอดปันธรรมใน ledger แต่ยังไม่มีแถว PandhamStock
+    for book_id, (_, pandham) in sorted(totals.items()):
+        if pandham and book_id not in stocked:
+            yield book_id, 'pandham', 0, pandham
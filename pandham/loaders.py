@@ -0,0 +1,95 @@
+"""
+ตัวโหลดข้อมูลที่จำค่าไว้ตลอดหนึ่ง request
+view และฟอร์มของ pandham ดึงหนังสือ กลุ่มเป้าหมาย และ reusable content ผ่านตัวโหลดนี้
+เพื่อให้แต่ละ object ถูก query ไม่เกินหนึ่งครั้งต่อ request
+"""
+from django.http import Http404
+
+from . import availability
+from . import cache_tags
+from . import reusable_content
+from .models import BookInventory
+from .models import PandhamTargetGroup
+
+
+class PandhamLoader:
+    def __init__(self, request=None):
+        self.request = request
+        self._books = {}
+        self._availability = {}
+        self._target_groups = None
+        self._reusable_contents = {}
+
+    def _tag(self, book_id):
+        # หน้าที่แสดงหนังสือเล่มนี้จะถูกล้างจาก wagtail-cache เมื่อสต็อกเปลี่ยน (ดู pandham.cache_tags)
+        if self.request is not None:
+            cache_tags.tag_request(self.request, [book_id])
+
+    def book(self, book_id):
+        """
+        คืน BookInventory (พร้อม stock และ cover_image) หรือ None หากไม่พบ
+        """
+        book_id = int(book_id)
+        self._tag(book_id)
+        if book_id not in self._books:
+            self._books[book_id] = BookInventory.objects.select_related(
+                'stock', 'cover_image',
+            ).filter(pk=book_id).first()
+        return self._books[book_id]
+
+    def book_or_404(self, book_id):
+        try:
+            book = self.book(book_id)
+        except (TypeError, ValueError):
+            book = None
+        if book is None:
+            raise Http404("ไม่พบหนังสือ")
+        return book
+
+    def availability(self, book_id):
+        """
+        คืน availability ของหนังสือจาก cache (ดู pandham.availability) หรือ None หากไม่พบ
+        """
+        book_id = int(book_id)
+        self._tag(book_id)
+        if book_id not in self._availability:
+            self._availability[book_id] = availability.get(book_id)
+        return self._availability[book_id]
+
+    def availability_or_404(self, book_id):
+        try:
+            book = self.availability(book_id)
+        except (TypeError, ValueError):
+            book = None
+        if book is None:
+            raise Http404("ไม่พบหนังสือ")
+        return book
+
+    def target_groups(self):
+        if self._target_groups is None:
+            self._target_groups = list(PandhamTargetGroup.objects.all())
+        return self._target_groups
+
+    def reusable_contents(self, *names):
+        """
+        คืน dict {name: HTML} ของ ReusableContent ที่พบ (ดู pandham.reusable_content)
+        """
+        missing = [name for name in names if name not in self._reusable_contents]
+        if missing:
+            rendered = reusable_content.get_rendered(*missing)
+            for name in missing:
+                self._reusable_contents[name] = rendered.get(name)
+        return {
+            name: self._reusable_contents[name]
+            for name in names if self._reusable_contents[name] is not None
+        }
+
+
+def get_loader(request):
+    """
+    คืน PandhamLoader ของ request (สร้างครั้งแรกที่เรียก)
+    """
+    loader = getattr(request, '_pandham_loader', None)
+    if loader is None:
+        loader = request._pandham_loader = PandhamLoader(request)
+    return loader
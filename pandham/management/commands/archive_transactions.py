@@ -0,0 +1,58 @@
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+from django.utils import timezone
+
+from pandham.archive import archivable
+from pandham.archive import archive_year
+from pandham.archive import year_bounds
+
+
+class Command(BaseCommand):
+    help = (
+        "Move inventory transactions of closed years into gzip-compressed JSONL "
+        "files under media/ledger-archive/, leaving per-book, per-type yearly "
+        "summaries behind so balances and reconciliation stay exact."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--keep-years",
+            type=int,
+            default=2,
+            help="Number of most recent calendar years (including the current one) to keep in the ledger.",
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=1000,
+            help="Number of rows summarized and deleted per transaction.",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Only report how many transactions would be archived.",
+        )
+
+    def handle(self, *args, **options):
+        if options["keep_years"] < 1:
+            raise CommandError("--keep-years must be at least 1.")
+        cutoff, _ = year_bounds(timezone.localdate().year - options["keep_years"] + 1)
+
+        queryset, years = archivable(cutoff, checkpoint=not options["dry_run"])
+        if not years:
+            self.stdout.write(f"No transactions before {cutoff:%Y-%m-%d} to archive.")
+            return
+
+        total = 0
+        for year in years:
+            if options["dry_run"]:
+                start, end = year_bounds(year)
+                count = queryset.filter(created_at__gte=start, created_at__lt=end).count()
+                self.stdout.write(f"{year}: {count} transactions")
+            else:
+                count, path = archive_year(queryset, year, chunk_size=options["chunk_size"])
+                self.stdout.write(f"{year}: {count} transactions archived to {path}")
+            total += count
+
+        action = "Would archive" if options["dry_run"] else "Archived"
+        self.stdout.write(self.style.SUCCESS(f"{action} {total} transactions."))
@@ -0,0 +1,132 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+from django.core.management.color import no_style
+from django.core.management.sql import sql_flush
+from django.db import DEFAULT_DB_ALIAS
+from django.db import connections
+
+from utils.db import write_atomic
+
+
+SOURCE_ALIAS = "sqlite_source"
+
+
+class Command(BaseCommand):
+    help = (
+        "Copy every table from an SQLite database file into the target database "
+        "(e.g. PostgreSQL) in chunks. Run migrate on the target first; the source "
+        "must be migrated to the same state."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--source",
+            default="db.sqlite3",
+            help="Path to the SQLite database file to copy from.",
+        )
+        parser.add_argument(
+            "--database",
+            default=DEFAULT_DB_ALIAS,
+            help="Target database alias.",
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=1000,
+            help="Number of rows read and inserted at a time.",
+        )
+        parser.add_argument(
+            "--flush",
+            action="store_true",
+            help="Empty the target tables first (rows created by migrate, such as content types).",
+        )
+
+    def handle(self, *args, **options):
+        target_alias = options["database"]
+        connections.settings[SOURCE_ALIAS] = connections.configure_settings({
+            DEFAULT_DB_ALIAS: {"ENGINE": "django.db.backends.dummy"},
+            SOURCE_ALIAS: {"ENGINE": "django.db.backends.sqlite3", "NAME": options["source"]},
+        })[SOURCE_ALIAS]
+        source = connections[SOURCE_ALIAS]
+        target = connections[target_alias]
+
+        # ตารางละหนึ่ง model (รวมตาราง many-to-many และตารางลูกของ multi-table inheritance)
+        models, tables = [], set()
+        for model in apps.get_models(include_auto_created=True):
+            if not model._meta.managed or model._meta.proxy or model._meta.db_table in tables:
+                continue
+            tables.add(model._meta.db_table)
+            models.append(model)
+
+        source_tables = set(source.introspection.table_names())
+        missing = sorted(model._meta.db_table for model in models if model._meta.db_table not in source_tables)
+        for table in missing:
+            self.stdout.write(self.style.WARNING(f"{table}: not in the source database, skipped."))
+        models = [model for model in models if model._meta.db_table in source_tables]
+
+        try:
+            # FK ของ Django เป็นแบบ DEFERRABLE INITIALLY DEFERRED ตรวจเมื่อ commit จึงคัดลอกตามลำดับใดก็ได้
+            with write_atomic(using=target_alias):
+                if options["flush"]:
+                    target.ops.execute_sql_flush(sql_flush(no_style(), target, allow_cascade=True))
+                else:
+                    self.check_empty(models, target_alias)
+
+                total = 0
+                for model in models:
+                    count = self.copy_table(model, source, target, options["chunk_size"])
+                    self.stdout.write(f"{model._meta.db_table}: {count} rows")
+                    total += count
+
+                # ให้ sequence ของ primary key เริ่มต่อจาก id ที่คัดลอกมา
+                with target.cursor() as cursor:
+                    for sql in target.ops.sequence_reset_sql(no_style(), models):
+                        cursor.execute(sql)
+        finally:
+            source.close()
+
+        self.stdout.write(self.style.SUCCESS(f"Copied {total} rows from {len(models)} tables."))
+
+    def check_empty(self, models, target_alias):
+        for model in models:
+            if model._base_manager.using(target_alias).exists():
+                raise CommandError(
+                    f"{model._meta.db_table} in the target database is not empty. "
+                    "Use --flush to empty the target tables first."
+                )
+
+    def copy_table(self, model, source, target, chunk_size):
+        table = model._meta.db_table
+        fields = model._meta.local_concrete_fields
+        source_columns = {column.name for column in source.introspection.get_table_description(source.cursor(), table)}
+        missing = [field.column for field in fields if field.column not in source_columns]
+        if missing:
+            raise CommandError(f"{table} in the source database has no column(s) {', '.join(missing)}; migrate it first.")
+
+        quote = target.ops.quote_name
+        sql = "INSERT INTO {} ({}) VALUES ({})".format(
+            quote(table),
+            ", ".join(quote(field.column) for field in fields),
+            ", ".join(["%s"] * len(fields)),
+        )
+        pk_name = model._meta.pk.attname
+        queryset = model._base_manager.using(SOURCE_ALIAS).order_by("pk").values_list(
+            *[field.attname for field in fields],
+        )
+        pk_index = [field.attname for field in fields].index(pk_name)
+
+        # อ่านทีละช่วงของ primary key จึงไม่ต้องโหลดทั้งตารางเข้าหน่วยความจำ
+        count, last_pk = 0, None
+        while True:
+            chunk = queryset if last_pk is None else queryset.filter(pk__gt=last_pk)
+            rows = list(chunk[:chunk_size])
+            if not rows:
+                return count
+            with target.cursor() as cursor:
+                cursor.executemany(sql, [
+                    [field.get_db_prep_save(value, connection=target) for field, value in zip(fields, row)]
+                    for row in rows
+                ])
+            count += len(rows)
+            last_pk = rows[-1][pk_index]
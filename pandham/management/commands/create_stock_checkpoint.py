@@ -0,0 +1,30 @@
+import datetime
+
+from django.core.management.base import BaseCommand
+
+from pandham.ledger import create_checkpoint
+
+
+class Command(BaseCommand):
+    help = (
+        "Write a stock checkpoint with the per-book ledger balances so "
+        "later balance queries only sum the transactions after it. "
+        "Meant to be run periodically (e.g. nightly from cron)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--lag",
+            type=int,
+            default=60,
+            help="Only include transactions older than this many seconds.",
+        )
+
+    def handle(self, *args, **options):
+        boundary = create_checkpoint(lag=datetime.timedelta(seconds=options["lag"]))
+        if boundary is None:
+            self.stdout.write("No new transactions since the last checkpoint.")
+        else:
+            self.stdout.write(self.style.SUCCESS(
+                f"Checkpoint written at transaction {boundary}."
+            ))
@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+
+from pandham.models import RequestPandham
+from pandham.waiting_list import DRAIN_BATCH_SIZE
+from pandham.waiting_list import drain_waiting_list
+
+
+class Command(BaseCommand):
+    help = (
+        "Allocate pandham stock to waiting requests in FIFO order, "
+        "in set-based batches."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--book",
+            type=int,
+            action="append",
+            help="BookInventory id to drain (repeatable). Defaults to every book with waiting requests.",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=DRAIN_BATCH_SIZE,
+            help="Number of waiting requests allocated per batch.",
+        )
+
+    def handle(self, *args, **options):
+        book_ids = options["book"] or RequestPandham.objects.filter(
+            is_waiting=True,
+        ).order_by().values_list("book_inventory_id", flat=True).distinct()
+
+        total = 0
+        for book_id in book_ids:
+            allocated = drain_waiting_list(book_id, batch_size=options["batch_size"])
+            if allocated:
+                self.stdout.write(f"Book {book_id}: allocated {allocated} requests.")
+            total += allocated
+        self.stdout.write(self.style.SUCCESS(f"Allocated {total} waiting requests."))
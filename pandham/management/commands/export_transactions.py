@@ -0,0 +1,65 @@
+import csv
+
+from django.core.management.base import BaseCommand
+
+from pandham.models import InventoryTransaction
+from utils.db import read_only_db
+
+
+class Command(BaseCommand):
+    help = (
+        "Export inventory transactions as CSV with the columns id, created_at, "
+        "book_inventory, book_name, transaction_type, quantity and details. "
+        "Rows are streamed, through a server-side cursor on PostgreSQL, and read "
+        "from the read_only database alias by default."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--output",
+            "-o",
+            help="Path to the CSV file (default: standard output).",
+        )
+        parser.add_argument(
+            "--since-id",
+            type=int,
+            default=0,
+            help="Only export transactions with a larger id.",
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=2000,
+            help="Number of rows fetched from the database at a time.",
+        )
+        parser.add_argument(
+            "--database",
+            default=read_only_db(),
+            help="Database alias to read from (default: read_only).",
+        )
+
+    def handle(self, *args, **options):
+        rows = InventoryTransaction.objects.using(options["database"]).filter(
+            pk__gt=options["since_id"],
+        ).order_by("pk").values_list(
+            "pk", "created_at", "book_inventory_id", "book_inventory__book_name",
+            "transaction_type", "quantity", "details",
+        )
+
+        output = open(options["output"], "w", newline="", encoding="utf-8") if options["output"] else self.stdout
+        try:
+            writer = csv.writer(output)
+            writer.writerow([
+                "id", "created_at", "book_inventory", "book_name", "transaction_type", "quantity", "details",
+            ])
+            count = 0
+            # iterator() ไม่เก็บผลทั้งหมดไว้ในหน่วยความจำ และใช้ server-side cursor บน PostgreSQL
+            for row in rows.iterator(chunk_size=options["chunk_size"]):
+                writer.writerow(row)
+                count += 1
+        finally:
+            if output is not self.stdout:
+                output.close()
+
+        if options["output"]:
+            self.stdout.write(self.style.SUCCESS(f"Exported {count} transactions."))
@@ -0,0 +1,80 @@
+import csv
+
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+from django.db import transaction
+
+from pandham.models import BookInventory
+from pandham.models import InventoryTransaction
+from utils.db import write_atomic
+
+
+class Command(BaseCommand):
+    help = (
+        "Import inventory transactions from a CSV file with the columns "
+        "book_inventory (id) or book_name, transaction_type, quantity and "
+        "details, posting the whole file as one batch."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("csv_file", help="Path to the CSV file.")
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=500,
+            help="Number of ledger rows per INSERT.",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Validate and post the batch, then roll it back.",
+        )
+
+    def handle(self, *args, **options):
+        with open(options["csv_file"], newline="", encoding="utf-8-sig") as f:
+            rows = list(csv.DictReader(f))
+        if not rows:
+            raise CommandError("CSV file has no rows.")
+
+        # แปลงชื่อหนังสือเป็น id ด้วย query เดียว
+        names = {row.get("book_name") for row in rows if not row.get("book_inventory")}
+        book_ids = dict(
+            BookInventory.objects.filter(book_name__in=names).values_list("book_name", "pk")
+        )
+
+        transactions = []
+        for line, row in enumerate(rows, start=2):
+            book_id = row.get("book_inventory")
+            if book_id:
+                try:
+                    book_id = int(book_id)
+                except ValueError:
+                    raise CommandError(f"Line {line}: invalid book_inventory {book_id!r}.")
+            else:
+                book_id = book_ids.get(row.get("book_name"))
+                if not book_id:
+                    raise CommandError(f"Line {line}: unknown book {row.get('book_name')!r}.")
+            try:
+                quantity = int(row["quantity"])
+            except (KeyError, ValueError):
+                raise CommandError(f"Line {line}: invalid quantity {row.get('quantity')!r}.")
+            transactions.append(InventoryTransaction(
+                book_inventory_id=book_id,
+                transaction_type=row.get("transaction_type", "").strip(),
+                quantity=quantity,
+                details=row.get("details", ""),
+            ))
+
+        try:
+            with write_atomic():
+                created = InventoryTransaction.bulk_post(
+                    transactions, batch_size=options["batch_size"]
+                )
+                if options["dry_run"]:
+                    transaction.set_rollback(True)
+        except ValidationError as e:
+            raise CommandError("\n".join(e.messages))
+
+        action = "Validated" if options["dry_run"] else "Imported"
+        self.stdout.write(self.style.SUCCESS(f"{action} {len(created)} transactions."))
@@ -0,0 +1,56 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from pandham import instrumentation
+
+
+class Command(BaseCommand):
+    help = (
+        "Dump the pandham view, save() and external-call timings recorded by "
+        "PANDHAM_INSTRUMENTATION across all workers."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--json",
+            action="store_true",
+            help="Print the summary as JSON.",
+        )
+        parser.add_argument(
+            "--raw",
+            action="store_true",
+            help="Print every recorded sample as JSON lines instead of the summary.",
+        )
+        parser.add_argument(
+            "--reset",
+            action="store_true",
+            help="Discard the recorded samples after dumping them.",
+        )
+
+    def handle(self, *args, **options):
+        samples = instrumentation.collect()
+
+        if options["raw"]:
+            for sample in sorted(samples, key=lambda sample: sample["at"]):
+                self.stdout.write(json.dumps(sample, ensure_ascii=False))
+        elif options["json"]:
+            self.stdout.write(json.dumps(instrumentation.summarize(samples), ensure_ascii=False, indent=2))
+        else:
+            self.stdout.write(
+                "kind\tname\tcount\terrors\tp50_ms\tp95_ms\tp99_ms\tmax_ms\tavg_queries\tmax_queries\tavg_query_ms"
+            )
+            for row in instrumentation.summarize(samples):
+                self.stdout.write("\t".join(str(value) for value in [
+                    row["kind"], row["name"], row["count"], row["errors"],
+                    f"{row['p50_ms']:.1f}", f"{row['p95_ms']:.1f}", f"{row['p99_ms']:.1f}", f"{row['max_ms']:.1f}",
+                    "-" if row["avg_queries"] is None else f"{row['avg_queries']:.1f}",
+                    "-" if row["max_queries"] is None else row["max_queries"],
+                    "-" if row["avg_query_ms"] is None else f"{row['avg_query_ms']:.1f}",
+                ]))
+
+        if options["reset"]:
+            instrumentation.reset()
+            self.stdout.write(self.style.SUCCESS(f"Discarded {len(samples)} samples."))
+        elif not samples:
+            self.stdout.write(self.style.WARNING("No samples recorded. Is PANDHAM_INSTRUMENTATION enabled?"))
@@ -0,0 +1,72 @@
+import json
+import random
+import time
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+from urllib.parse import parse_qs
+from urllib.parse import urlparse
+
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = (
+        "Run a local stub SMS gateway for testing OTP delivery. "
+        "Point SEND_SMS_URL at http://<addr>:<port>/send."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--addr", default="127.0.0.1")
+        parser.add_argument("--port", type=int, default=8025)
+        parser.add_argument(
+            "--delay",
+            type=float,
+            default=0,
+            help="Seconds to wait before answering each request.",
+        )
+        parser.add_argument(
+            "--fail-rate",
+            type=float,
+            default=0,
+            help="Fraction (0-1) of requests answered with HTTP 503.",
+        )
+
+    def handle(self, *args, **options):
+        stdout = self.stdout
+        delay = options["delay"]
+        fail_rate = options["fail_rate"]
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                params = {k: v[0] for k, v in parse_qs(urlparse(self.path).query).items()}
+                if delay:
+                    time.sleep(delay)
+                if random.random() < fail_rate:
+                    self.send_response(503)
+                    self.end_headers()
+                    stdout.write(f"503 -> {params.get('MobileNumbers')}")
+                    return
+                # จำลองรูปแบบคำตอบของ gateway จริง
+                body = json.dumps({
+                    "ErrorCode": 0,
+                    "ErrorDescription": "Success",
+                    "Data": [{"MobileNumber": params.get("MobileNumbers"), "MessageId": str(time.time_ns())}],
+                }).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+                stdout.write(f"SMS -> {params.get('MobileNumbers')}: {params.get('Message', '').strip()}")
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((options["addr"], options["port"]), Handler)
+        self.stdout.write(f"Stub SMS gateway listening on http://{options['addr']}:{options['port']}/send")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
@@ -0,0 +1,34 @@
+# Generated by Django 5.0.14 on 2026-10-18 08:10
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pandham', '0032_alter_requestpandham_accept_terms'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_transaction_id', models.BigIntegerField(db_index=True, verbose_name='รายการล่าสุดที่นับรวม')),
+                ('as_of', models.DateTimeField(verbose_name='ยอด ณ วันที่')),
+                ('main_total', models.IntegerField(default=0, verbose_name='ยอดสุทธิคลังหลัก')),
+                ('pandham_total', models.IntegerField(default=0, verbose_name='ยอดสุทธิคลังปันธรรม')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('book_inventory', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='checkpoints', to='pandham.bookinventory', verbose_name='หนังสือ')),
+            ],
+            options={
+                'verbose_name': 'Stock Checkpoint',
+                'verbose_name_plural': 'Stock Checkpoints',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='stockcheckpoint',
+            constraint=models.UniqueConstraint(fields=('book_inventory', 'last_transaction_id'), name='unique_stock_checkpoint'),
+        ),
+    ]
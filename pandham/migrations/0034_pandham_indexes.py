@@ -0,0 +1,37 @@
+# Generated by Django 5.0.14 on 2026-10-18 08:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pandham', '0033_stockcheckpoint'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='inventorytransaction',
+            index=models.Index(fields=['-created_at'], name='pandham_txn_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='inventorytransaction',
+            index=models.Index(fields=['book_inventory', '-created_at'], name='pandham_txn_book_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='inventorytransaction',
+            index=models.Index(fields=['transaction_type', '-created_at'], name='pandham_txn_type_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='propagation',
+            index=models.Index(fields=['book_inventory', 'created_at'], name='pandham_prop_book_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='requestpandham',
+            index=models.Index(fields=['phone_number', 'book_inventory'], name='pandham_req_phone_book_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='requestpandham',
+            index=models.Index(condition=models.Q(('is_waiting', True)), fields=['book_inventory', 'created_at'], name='pandham_req_waiting_idx'),
+        ),
+    ]
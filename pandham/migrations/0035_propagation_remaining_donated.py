@@ -0,0 +1,34 @@
+# Generated by Django 5.0.14 on 2026-10-18 08:13
+
+from django.db import migrations, models
+
+
+def populate_remaining_donated(apps, schema_editor):
+    Propagation = apps.get_model('pandham', 'Propagation')
+    Propagation.objects.filter(donate_books__gt=models.F('requested')).update(
+        remaining_donated=models.F('donate_books') - models.F('requested'),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pandham', '0034_pandham_indexes'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='propagation',
+            name='pandham_prop_book_created_idx',
+        ),
+        migrations.AddField(
+            model_name='propagation',
+            name='remaining_donated',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='จำนวนเล่มที่เหลือให้ปันธรรม'),
+        ),
+        migrations.RunPython(populate_remaining_donated, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='propagation',
+            index=models.Index(condition=models.Q(('remaining_donated__gt', 0)), fields=['book_inventory', 'created_at'], name='pandham_prop_remaining_idx'),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.0.14 on 2026-10-18 08:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pandham', '0035_propagation_remaining_donated'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReferenceCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('prefix', models.CharField(max_length=10, verbose_name='คำนำหน้า')),
+                ('period', models.CharField(max_length=8, verbose_name='วันที่')),
+                ('value', models.PositiveBigIntegerField(default=0, verbose_name='เลขล่าสุด')),
+            ],
+            options={
+                'verbose_name': 'Reference Counter',
+                'verbose_name_plural': 'Reference Counters',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='referencecounter',
+            constraint=models.UniqueConstraint(fields=('prefix', 'period'), name='unique_reference_counter'),
+        ),
+    ]
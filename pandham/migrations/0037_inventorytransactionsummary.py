@@ -0,0 +1,35 @@
+# Generated by Django 5.0.14 on 2026-10-18 08:42
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pandham', '0036_referencecounter'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InventoryTransactionSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('transaction_type', models.CharField(choices=[('in', 'นำเข้าคลัง'), ('pandham', 'เพิ่มคลังปันธรรม'), ('support', 'สนับสนุนการพิมพ์'), ('request', 'ขอรับปันธรรม'), ('donate', 'ปันธรรมโดยมูลนิธิฯ'), ('adjustment', 'ปรับปรุงยอด')], max_length=255, verbose_name='ประเภทธุรกรรม')),
+                ('period_start', models.DateTimeField(verbose_name='ตั้งแต่')),
+                ('period_end', models.DateTimeField(verbose_name='ถึง (ไม่รวม)')),
+                ('quantity', models.IntegerField(verbose_name='จำนวนรวม')),
+                ('transaction_count', models.PositiveIntegerField(verbose_name='จำนวนรายการ')),
+                ('first_transaction_id', models.BigIntegerField(verbose_name='รายการแรก')),
+                ('last_transaction_id', models.BigIntegerField(db_index=True, verbose_name='รายการสุดท้าย')),
+                ('archive_file', models.CharField(max_length=255, verbose_name='ไฟล์ archive')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('book_inventory', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='transaction_summaries', to='pandham.bookinventory', verbose_name='หนังสือ')),
+            ],
+            options={
+                'verbose_name': 'Transaction Summary',
+                'verbose_name_plural': 'Transaction Summaries',
+                'ordering': ['-period_start', 'book_inventory', 'transaction_type'],
+            },
+        ),
+    ]
@@ -1,6 +1,8 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Case, F, IntegerField, Q, Value, When
 from django.conf import settings
 from django.core.exceptions import ValidationError
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
 from wagtail.admin.panels import FieldPanel
@@ -9,7 +11,11 @@ from wagtail.images.models import Image
 from coderedcms.fields import CoderedStreamField
 from coderedcms.blocks import LAYOUT_STREAMBLOCKS
 
-from datetime import datetime
+from utils.db import write_atomic
+
+from .instrumentation import instrument
+from .reference import next_reference_number
+from .signals import stock_changed
 
 
 # ====================================
@@ -210,6 +216,18 @@ class InventoryTransaction(models.Model):
         ('donate', "ปันธรรมโดยมูลนิธิฯ"),
         ('adjustment', "ปรับปรุงยอด"),
     ]
+    # ผลของธุรกรรมแต่ละประเภทต่อ (คลังหลัก, คลังปันธรรม) ต่อหนังสือ 1 เล่ม
+    # 'adjustment' เป็นได้ทั้งเพิ่มหรือลดขึ้นอยู่กับค่า quantity
+    STOCK_EFFECTS = {
+        'in': (1, 0),
+        'adjustment': (1, 0),
+        'pandham': (-1, 1),
+        'support': (-1, 0),
+        'donate': (-1, 0),
+        'request': (0, -1),
+    }
+    # ประเภทธุรกรรมที่ต้องมีหนังสือคงเหลือเพียงพอก่อนตัดสต็อก
+    GUARDED_TYPES = ['pandham', 'support', 'donate', 'request']
     book_inventory = models.ForeignKey(
         BookInventory,
         on_delete=models.CASCADE,
@@ -236,6 +254,12 @@ class InventoryTransaction(models.Model):
     class Meta:
         verbose_name = _("Transaction")
         verbose_name_plural = _("Transactions")
+        indexes = [
+            # รายการใน admin เรียงตาม -created_at และกรองตามหนังสือหรือประเภท
+            models.Index(fields=['-created_at'], name='pandham_txn_created_idx'),
+            models.Index(fields=['book_inventory', '-created_at'], name='pandham_txn_book_created_idx'),
+            models.Index(fields=['transaction_type', '-created_at'], name='pandham_txn_type_created_idx'),
+        ]
 
     def __str__(self):
         return f"{self.get_transaction_type_display()} - {self.quantity} - {self.book_inventory.book_name}"
@@ -247,31 +271,282 @@ class InventoryTransaction(models.Model):
                     'quantity': _('มีหนังสือไม่เพียงพอในคลังหลัก')
                 })
 
+    def stock_deltas(self):
+        # คืนค่า (ยอดเปลี่ยนแปลงคลังหลัก, ยอดเปลี่ยนแปลงคลังปันธรรม) ของธุรกรรมนี้
+        main, pandham = self.STOCK_EFFECTS.get(self.transaction_type, (0, 0))
+        return main * self.quantity, pandham * self.quantity
+
     def save(self, *args, **kwargs):
-        self.full_clean()
+        # ตรวจสอบเฉพาะค่าของฟิลด์ ส่วนการตรวจสอบจำนวนคงเหลือให้ UPDATE แบบมีเงื่อนไขเป็นผู้ตัดสิน
+        # เพื่อไม่ให้คำขอที่เข้ามาพร้อมกันผ่าน clean() ด้วยยอดเดิมแล้วตัดสต็อกเกิน
+        self.clean_fields(exclude=['book_inventory'])
+
+        main_deltas, pandham_deltas = {}, {}
+
+        def add_deltas(book_id, deltas):
+            main_deltas[book_id] = main_deltas.get(book_id, 0) + deltas[0]
+            pandham_deltas[book_id] = pandham_deltas.get(book_id, 0) + deltas[1]
+
+        with write_atomic():
+            previous = None
+            if not self._state.adding:
+                # แก้ไขรายการเดิม: กลับรายการยอดเดิมแล้วลงยอดใหม่
+                previous = InventoryTransaction.objects.filter(pk=self.pk).first()
+                if previous:
+                    main, pandham = previous.stock_deltas()
+                    add_deltas(previous.book_inventory_id, (-main, -pandham))
+                    # checkpoint ที่รวมรายการนี้ไว้แล้วใช้ไม่ได้อีกต่อไป
+                    StockCheckpoint.objects.filter(last_transaction_id__gte=self.pk).delete()
+            add_deltas(self.book_inventory_id, self.stock_deltas())
+
+            # การแก้ไขหรือเปลี่ยนประเภทรายการเดิม (เช่น ลดจำนวนของรายการ 'in') ทำให้ยอดลดลงได้
+            # จึงตรวจสอบยอดคงเหลือเสมอ ไม่ตรวจเฉพาะรายการใหม่ที่เป็นการปรับปรุงยอดหรือนำเข้าคลัง
+            guarded = previous is not None or self.transaction_type in self.GUARDED_TYPES
+            post_stock_deltas(main_deltas, pandham_deltas, guarded=guarded)
+            super().save(*args, **kwargs)
+
+    @classmethod
+    def bulk_post(cls, transactions, batch_size=500):
+        """
+        ลงรายการธุรกรรมจำนวนมากในครั้งเดียว (เช่น นำเข้าหนังสือหลังพิมพ์เสร็จ)
+        ตรวจสอบทั้งชุดก่อน แล้วรวมยอดเปลี่ยนแปลงต่อหนังสือเป็น UPDATE ไม่กี่คำสั่ง
+        และบันทึกรายการด้วย bulk_create ภายใน transaction เดียว
+        การตรวจสอบสต็อกใช้ยอดสุทธิของทั้งชุดต่อหนังสือ
+        """
+        transactions = list(transactions)
+        errors = []
+        for index, txn in enumerate(transactions, start=1):
+            try:
+                txn.clean_fields(exclude=['book_inventory'])
+            except ValidationError as e:
+                for field, messages in e.message_dict.items():
+                    errors.extend(f"รายการที่ {index} {field}: {message}" for message in messages)
+
+        book_ids = {txn.book_inventory_id for txn in transactions}
+        existing = set(BookInventory.objects.filter(pk__in=book_ids).values_list('pk', flat=True))
+        for index, txn in enumerate(transactions, start=1):
+            if txn.book_inventory_id not in existing:
+                errors.append(f"รายการที่ {index}: ไม่พบหนังสือ {txn.book_inventory_id}")
+        if errors:
+            raise ValidationError(errors)
+
+        # 'adjustment' ไม่ต้องตรวจสอบยอดคงเหลือ จึงแยกลงยอดก่อนรายการอื่น
+        deltas = {True: ({}, {}), False: ({}, {})}
+        for txn in transactions:
+            main_deltas, pandham_deltas = deltas[txn.transaction_type != 'adjustment']
+            main, pandham = txn.stock_deltas()
+            main_deltas[txn.book_inventory_id] = main_deltas.get(txn.book_inventory_id, 0) + main
+            pandham_deltas[txn.book_inventory_id] = pandham_deltas.get(txn.book_inventory_id, 0) + pandham
+
+        with write_atomic():
+            post_stock_deltas(*deltas[False], guarded=False)
+            post_stock_deltas(*deltas[True], guarded=True)
+            return cls.objects.bulk_create(transactions, batch_size=batch_size)
+
+
+# จำนวนหนังสือสูงสุดต่อ UPDATE หนึ่งคำสั่ง
+STOCK_UPDATE_CHUNK_SIZE = 200
+
+# จำนวนครั้งที่ลองจอง Propagation ใหม่เมื่อถูกจองตัดหน้า
+CLAIM_ATTEMPTS = 3
+
+
+def _update_stock(model, key, deltas, guarded):
+    """
+    ปรับ current_stock ของหลายแถวด้วย UPDATE คำสั่งเดียว
+    (UPDATE ... SET current_stock = current_stock + n WHERE current_stock >= -n)
+    คืนค่าเป็นจำนวนแถวที่ถูกปรับ
+    """
+    updated = 0
+    items = list(deltas.items())
+    # แบ่งเป็นชุดเพื่อไม่ให้เกินขีดจำกัดจำนวนพารามิเตอร์ของ SQLite
+    for start in range(0, len(items), STOCK_UPDATE_CHUNK_SIZE):
+        condition = Q()
+        whens = []
+        for book_id, delta in items[start:start + STOCK_UPDATE_CHUNK_SIZE]:
+            match = Q(**{key: book_id})
+            whens.append(When(match, then=Value(delta)))
+            if guarded and delta < 0:
+                match &= Q(current_stock__gte=-delta)
+            condition |= match
+        updated += model.objects.filter(condition).update(
+            current_stock=F('current_stock') + Case(*whens, output_field=IntegerField()),
+            updated_at=timezone.now(),
+        )
+    return updated
+
+
+def post_stock_deltas(main_deltas, pandham_deltas, guarded=True):
+    """
+    ลงยอดสต็อกของ BookInventory และ PandhamStock จาก dict {book_inventory_id: ยอดเปลี่ยนแปลง}
+    ยอดที่ลดลงจะถูกตัดก็ต่อเมื่อมีหนังสือเพียงพอ (เว้นแต่ guarded=False เช่น ปรับปรุงยอด)
+    ถ้าหนังสือไม่พอจะ raise ValidationError และยกเลิกการลงยอดทั้งหมด
+    """
+    main_deltas = {k: v for k, v in main_deltas.items() if v}
+    pandham_deltas = {k: v for k, v in pandham_deltas.items() if v}
+
+    with write_atomic(savepoint=False):
+        if main_deltas:
+            if _update_stock(BookInventory, 'pk', main_deltas, guarded) != len(main_deltas):
+                raise ValidationError({
+                    'quantity': _('มีหนังสือไม่เพียงพอในคลังหลัก')
+                })
+
+        decreases = {k: v for k, v in pandham_deltas.items() if v < 0}
+        if decreases:
+            if _update_stock(PandhamStock, 'book_inventory_id', decreases, guarded) != len(decreases):
+                raise ValidationError({
+                    'quantity': _('มีหนังสือไม่เพียงพอในคลังปันธรรม')
+                })
+
+        increases = {k: v for k, v in pandham_deltas.items() if v > 0}
+        if increases:
+            if _update_stock(PandhamStock, 'book_inventory_id', increases, False) != len(increases):
+                # หนังสือที่ยังไม่มีคลังปันธรรมให้สร้างก่อนแล้วลงยอดอีกครั้ง
+                existing = set(PandhamStock.objects.filter(
+                    book_inventory_id__in=increases,
+                ).values_list('book_inventory_id', flat=True))
+                missing = {k: v for k, v in increases.items() if k not in existing}
+                PandhamStock.objects.bulk_create(
+                    [PandhamStock(book_inventory_id=book_id) for book_id in missing],
+                    ignore_conflicts=True,
+                )
+                _update_stock(PandhamStock, 'book_inventory_id', missing, False)
+
+        book_ids = set(main_deltas) | set(pandham_deltas)
+        if book_ids:
+            # send_robust: receiver ที่ผิดพลาดถูกบันทึก log (django.dispatch) ไม่ส่งต่อถึงผู้ใช้ที่ข้อมูล commit แล้ว
+            transaction.on_commit(lambda: stock_changed.send_robust(
+                sender=InventoryTransaction,
+                book_ids=book_ids,
+                pandham_increased=set(increases),
+            ))
 
-        if self.transaction_type == 'in' or self.transaction_type == 'adjustment':
-            # สำหรับ 'in' เพิ่มสต็อก, สำหรับ 'adjustment' สามารถเป็นการเพิ่มหรือลดขึ้นอยู่กับค่า quantity
-            self.book_inventory.current_stock += self.quantity
 
-        elif self.transaction_type in ['pandham', 'support', 'donate']:
-            # ลดสต็อกสำหรับ 'pandham', 'support', 'donate'
-            self.book_inventory.current_stock -= self.quantity
-            # สำหรับ 'pandham'ให้เพิ่มเข้าสต็อกปันธรรม
-            if self.transaction_type == 'pandham':
-                pandham_stock, created = PandhamStock.objects.get_or_create(book_inventory=self.book_inventory, defaults={'current_stock': 0})
-                pandham_stock.current_stock += self.quantity
-                pandham_stock.save()
+# ====================================
+# ยอดคงเหลือ ณ จุดตรวจสอบ (checkpoint)
+# ====================================
+class StockCheckpoint(models.Model):
+    # ยอดสุทธิของ ledger ต่อหนังสือ นับรวมถึงรายการ last_transaction_id
+    # ยอดคงเหลือจริง = initial_stock + ยอดใน checkpoint + รายการหลัง last_transaction_id
+    book_inventory = models.ForeignKey(
+        BookInventory,
+        on_delete=models.CASCADE,
+        verbose_name="หนังสือ",
+        related_name="checkpoints"
+    )
+    last_transaction_id = models.BigIntegerField(
+        db_index=True,
+        verbose_name="รายการล่าสุดที่นับรวม",
+    )
+    as_of = models.DateTimeField(
+        verbose_name="ยอด ณ วันที่",
+    )
+    main_total = models.IntegerField(
+        default=0,
+        verbose_name="ยอดสุทธิคลังหลัก",
+    )
+    pandham_total = models.IntegerField(
+        default=0,
+        verbose_name="ยอดสุทธิคลังปันธรรม",
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
 
-        elif self.transaction_type == 'request':
-            pandham_stock = PandhamStock.objects.get(book_inventory=self.book_inventory)
-            if self.quantity > pandham_stock.current_stock:
-                raise ValidationError('มีหนังสือไม่เพียงพอในคลังปันธรรม')
-            pandham_stock.current_stock -= self.quantity
-            pandham_stock.save()
+    class Meta:
+        verbose_name = _("Stock Checkpoint")
+        verbose_name_plural = _("Stock Checkpoints")
+        constraints = [
+            models.UniqueConstraint(
+                fields=['book_inventory', 'last_transaction_id'],
+                name='unique_stock_checkpoint',
+            ),
+        ]
 
-        self.book_inventory.save()
-        super().save(*args, **kwargs)
+    def __str__(self):
+        return f"{self.book_inventory_id} @ {self.last_transaction_id}"
+
+
+# ====================================
+# ยอดสรุปของรายการ ledger ที่ archive แล้ว
+# ====================================
+class InventoryTransactionSummary(models.Model):
+    # ยอดรวมของรายการ InventoryTransaction ที่ถูกย้ายไปไฟล์ archive ต่อหนังสือ ประเภท และปี
+    # นับรวมในยอด ledger แทนรายการที่ถูกลบ (ดู pandham.ledger และคำสั่ง archive_transactions)
+    book_inventory = models.ForeignKey(
+        BookInventory,
+        on_delete=models.CASCADE,
+        verbose_name="หนังสือ",
+        related_name="transaction_summaries"
+    )
+    transaction_type = models.CharField(
+        max_length=255,
+        choices=InventoryTransaction.TRANSACTION_CHOICES,
+        verbose_name="ประเภทธุรกรรม"
+    )
+    period_start = models.DateTimeField(
+        verbose_name="ตั้งแต่",
+    )
+    period_end = models.DateTimeField(
+        verbose_name="ถึง (ไม่รวม)",
+    )
+    quantity = models.IntegerField(
+        verbose_name="จำนวนรวม",
+    )
+    transaction_count = models.PositiveIntegerField(
+        verbose_name="จำนวนรายการ",
+    )
+    first_transaction_id = models.BigIntegerField(
+        verbose_name="รายการแรก",
+    )
+    last_transaction_id = models.BigIntegerField(
+        db_index=True,
+        verbose_name="รายการสุดท้าย",
+    )
+    archive_file = models.CharField(
+        max_length=255,
+        verbose_name="ไฟล์ archive",
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = _("Transaction Summary")
+        verbose_name_plural = _("Transaction Summaries")
+        ordering = ['-period_start', 'book_inventory', 'transaction_type']
+
+    def __str__(self):
+        return f"{self.book_inventory_id} {self.transaction_type} {self.period_start:%Y}: {self.quantity}"
+
+
+# ====================================
+# ตัวนับหมายเลขอ้างอิง
+# ====================================
+class ReferenceCounter(models.Model):
+    # เลขล่าสุดที่ถูกจองไปแล้วของแต่ละ prefix (PROP, REQP) ต่อวัน
+    prefix = models.CharField(
+        max_length=10,
+        verbose_name="คำนำหน้า",
+    )
+    period = models.CharField(
+        max_length=8,
+        verbose_name="วันที่",
+    )
+    value = models.PositiveBigIntegerField(
+        default=0,
+        verbose_name="เลขล่าสุด",
+    )
+
+    class Meta:
+        verbose_name = _("Reference Counter")
+        verbose_name_plural = _("Reference Counters")
+        constraints = [
+            models.UniqueConstraint(
+                fields=['prefix', 'period'],
+                name='unique_reference_counter',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.prefix}{self.period}: {self.value}"
 
 
 # ====================================
@@ -327,6 +602,12 @@ class Propagation(models.Model):
         default=0,
         verbose_name="จำนวนเล่มที่ปันธรรมแล้ว",
     )
+    # จำนวนเล่มที่ยังเหลือให้ปันธรรม (donate_books - requested)
+    remaining_donated = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name="จำนวนเล่มที่เหลือให้ปันธรรม",
+    )
     # ชื่อ ที่อยู่ หมายเลขโทรศัพท์
     name = models.CharField(
         max_length=255,
@@ -376,40 +657,89 @@ class Propagation(models.Model):
     class Meta:
         verbose_name = "Propagation"
         verbose_name_plural = "Propagation"
+        indexes = [
+            # รายการที่ยังเหลือให้ปันธรรมของหนังสือ เรียงตามลำดับก่อนหลังสำหรับ Propagation.claim()
+            models.Index(
+                fields=['book_inventory', 'created_at'],
+                condition=Q(remaining_donated__gt=0),
+                name='pandham_prop_remaining_idx',
+            ),
+        ]
 
     def __str__(self):
         return f"{self.reference_number} {self.name} {self.book_inventory.book_name}"
 
 
+    @classmethod
+    def claim_candidates(cls, book_inventory_id, target_group_id, number_of_books):
+        # remaining_donated > 0 ตรงกับเงื่อนไขของ partial index pandham_prop_remaining_idx
+        # SQLite ใช้ index นั้นได้ก็ต่อเมื่อ query มีเงื่อนไขนี้ตรง ๆ (จาก >= %s พิสูจน์ไม่ได้)
+        return cls.objects.filter(
+            book_inventory_id=book_inventory_id,
+            target_groups__id=target_group_id,
+            remaining_donated__gt=0,
+            remaining_donated__gte=number_of_books,
+        ).order_by('created_at', 'pk')
+
+    @classmethod
+    def claim(cls, book_inventory_id, target_group_id, number_of_books):
+        """
+        จองหนังสือปันธรรมจากรายการที่เก่าที่สุดที่ยังเหลือพอ ด้วย UPDATE แบบมีเงื่อนไข
+        (remaining_donated >= จำนวนที่ขอ) ใช้จำนวน query คงที่ไม่ว่าหนังสือจะมีผู้ปันธรรมกี่ราย
+        คืนค่า id ของ Propagation ที่จองได้ หรือ None ถ้าไม่มีรายการที่เหลือพอ
+        """
+        candidates = cls.claim_candidates(
+            book_inventory_id, target_group_id, number_of_books,
+        ).values_list('pk', flat=True)
+
+        # ถ้ารายการถูกจองตัดหน้าไประหว่าง SELECT กับ UPDATE ให้ลองรายการถัดไป
+        for attempt in range(CLAIM_ATTEMPTS):
+            propagation_id = candidates.first()
+            if propagation_id is None:
+                return None
+            claimed = cls.objects.filter(
+                pk=propagation_id,
+                remaining_donated__gt=0,
+                remaining_donated__gte=number_of_books,
+            ).update(
+                remaining_donated=F('remaining_donated') - number_of_books,
+                requested=F('requested') + number_of_books,
+                updated_at=timezone.now(),
+            )
+            if claimed:
+                return propagation_id
+        return None
+
+    @instrument('Propagation.save', kind='save')
     def save(self, *args, **kwargs):
         # สร้างตัวเลขอ้างอิง (Reference Number)
         if self.reference_number == '':
-            self.reference_number = f"PROP{datetime.now().strftime('%Y%m%d%H%M%S')}"
+            self.reference_number = next_reference_number('PROP')
+
+        # จำนวนเล่มที่ยังเหลือให้ปันธรรม
+        self.remaining_donated = max(self.donate_books - self.requested, 0)
 
-        if self._state.adding:
-            if self.receive_books > 0:
-                try:
+        # ลงรายการสต็อกและบันทึกใน transaction เดียว เพื่อให้งานหลัง commit (เช่น จัดสรรผู้รอรับ) เห็นรายการนี้แล้ว
+        # ถ้าหนังสือไม่พอ ValidationError จะยกเลิกทั้ง transaction (ไม่บันทึก Propagation ที่ไม่ได้ตัดสต็อก)
+        with write_atomic():
+            if self._state.adding:
+                if self.receive_books > 0:
                     InventoryTransaction.objects.create(
                         book_inventory=self.book_inventory,
                         transaction_type='support',
                         quantity=self.receive_books,
                         details='support propagation : ' + self.reference_number,
                     )
-                except Exception as e:
-                    print(f"Failed to create InventoryTransaction: {e}")
 
-            if self.donate_books > 0:
-                try:
+                if self.donate_books > 0:
                     InventoryTransaction.objects.create(
                         book_inventory=self.book_inventory,
                         transaction_type='pandham',
                         quantity=self.donate_books,
                         details='donate propagation : ' + self.reference_number,
                     )
-                except Exception as e:
-                    print(f"Failed to create InventoryTransaction: {e}")
 
-        super().save(*args, **kwargs)
+            super().save(*args, **kwargs)
 
 # ====================================
 # แบบฟอร์มสำหรับการขอรับปันธรรม
@@ -496,6 +826,16 @@ class RequestPandham(models.Model):
     class Meta:
         verbose_name = _("Request Pandham")
         verbose_name_plural = _("Request Pandham")
+        indexes = [
+            # ตรวจสอบการขอซ้ำใน RequestPandhamView.form_valid
+            models.Index(fields=['phone_number', 'book_inventory'], name='pandham_req_phone_book_idx'),
+            # รายชื่อผู้รอรับปันธรรมของหนังสือ เรียงตามลำดับก่อนหลัง
+            models.Index(
+                fields=['book_inventory', 'created_at'],
+                condition=Q(is_waiting=True),
+                name='pandham_req_waiting_idx',
+            ),
+        ]
 
     def __str__(self):
         return f"{self.reference_number} {self.name} {self.book_inventory.book_name}"
@@ -506,10 +846,38 @@ class RequestPandham(models.Model):
                 'accept_terms': "กรุณายอมรับเงื่อนไขการรับหนังสือ"
             })
 
+    def allocate(self):
+        """
+        จัดสรรหนังสือปันธรรมให้คำขอนี้: จองจาก Propagation ที่ตรงกับกลุ่มของผู้ขอ
+        แล้วทำรายการ InventoryTransaction transaction_type=request เพื่อตัดคลังปันธรรม
+        ถ้าจองไม่ได้หรือคลังปันธรรมไม่พอจะยกเลิกทั้งหมดและคืนค่า False
+        """
+        if not self.recipient_category_id:
+            return False
+        try:
+            with write_atomic():
+                propagation_id = Propagation.claim(
+                    self.book_inventory_id, self.recipient_category_id, self.number_of_books,
+                )
+                if propagation_id is None:
+                    return False
+                InventoryTransaction.objects.create(
+                    book_inventory_id=self.book_inventory_id,
+                    transaction_type='request',
+                    quantity=self.number_of_books,
+                    details='request pandham : ' + self.reference_number,
+                )
+        except ValidationError:
+            # คลังปันธรรมไม่พอ การจอง Propagation ถูกยกเลิกไปพร้อมกัน
+            return False
+        self.propagation_id = propagation_id
+        return True
+
+    @instrument('RequestPandham.save', kind='save')
     def save(self, *args, **kwargs):
         # สร้างตัวเลขอ้างอิง (Reference Number)
         if self.reference_number == '':
-            self.reference_number = f"REQP{datetime.now().strftime('%Y%m%d%H%M%S')}"
+            self.reference_number = next_reference_number('REQP')
 
         def set_waiting_status():
             self.propagation = None
@@ -520,51 +888,14 @@ class RequestPandham(models.Model):
         # เงื่อนไขในโค้ดนี้มีสองส่วน:
         # self._state.adding and not self.is_waiting:
             # หมายความว่า ถ้าเป็นการสร้าง instance ใหม่และ is_waiting ไม่เป็น True (หรือเป็น False)
-        # not self._state.adding and self.__class__.objects.get(id=self.id).is_waiting and not self.is_waiting:
+        # not self._state.adding and self.__class__.objects.filter(id=self.id, is_waiting=True).exists() and not self.is_waiting:
             # หมายความว่า ถ้าไม่ใช่การสร้าง instance ใหม่ (หรือ instance นี้มีอยู่แล้ว)
             # และ is_waiting ถูกเปลี่ยนจาก True เป็น False
-        # ถ้าเงื่อนไขใดเงื่อนไขหนึ่งเป็น True, โค้ดที่อยู่ในบล็อก if จะถูกดำเนินการ.
-
-        if (self._state.adding and not self.is_waiting) or (not self._state.adding and self.__class__.objects.get(id=self.id).is_waiting and not self.is_waiting):
-            # ตรวจสอบว่ามีหนังสืออยู่ในคลังหนังสือปันธรรมหรือไม่
-            pandham_stock = PandhamStock.objects.get(book_inventory=self.book_inventory)
-            still_in_pandham_stock = pandham_stock.current_stock >= self.number_of_books
-            # ถ้ามีหนังสืออยู่ในคลังหนังสือปันธรรมให้ทำรายการ InventoryTransaction transaction_type=request
-            if still_in_pandham_stock:
-                # ตรวจสอบว่า recipient_category นั้นสอดคล้องข้อใดข้อหนึ่งกับรายการ target_group ใน Propagation หรือไม่
-                recipient_category = self.recipient_category
-                if recipient_category:
-                    propagation = None
-                    propagations = Propagation.objects.filter(
-                        book_inventory=self.book_inventory,
-                        target_groups__id=recipient_category.id
-                    )
-                    if propagations.exists():
-                        for each_propagation in propagations:
-                            if each_propagation.requested < each_propagation.donate_books:
-                                propagation = each_propagation
-                                break
-                        if propagation:
-                            propagation.requested += self.number_of_books
-                            propagation.save()
-                            self.propagation = propagation
-
-                            # ทำรายการ InventoryTransaction transaction_type=request
-                            try:
-                                new_inv = InventoryTransaction.objects.create(
-                                    book_inventory=self.book_inventory,
-                                    transaction_type='request',
-                                    quantity=self.number_of_books,
-                                    details='request pandham : ' + self.reference_number,
-                                )
-                                new_inv.details='request pandham : ' + new_inv.pk,
-                                new_inv.save()
-                            except Exception as e:
-                                print(f"Failed to create InventoryTransaction: {e}")
-                    else:
-                        set_waiting_status()
-            else:
-                set_waiting_status()
+        # ถ้าเงื่อนไขใดเงื่อนไขหนึ่งเป็น True, จะจัดสรรหนังสือด้วย allocate() ถ้าไม่สำเร็จให้รอปันธรรม
+        allocating = (self._state.adding and not self.is_waiting) or (not self._state.adding and self.__class__.objects.filter(id=self.id, is_waiting=True).exists() and not self.is_waiting)
 
-        # บันทึกข้อมูล
-        super().save(*args, **kwargs)
+        with write_atomic():
+            if allocating and not self.allocate():
+                set_waiting_status()
+            # บันทึกข้อมูล
+            super().save(*args, **kwargs)
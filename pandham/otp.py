@@ -0,0 +1,108 @@
+"""
+ที่เก็บ OTP แบบใช้ cache แทนการเขียนลง session
+session เก็บเพียง flow id ส่วนรหัส OTP และข้อมูลฟอร์มที่รอยืนยันอยู่ใน cache
+และหมดอายุด้วย TTL ของ cache เอง
+"""
+import uuid
+
+import pyotp
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.module_loading import import_string
+
+
+# อายุของรหัส OTP (วินาที)
+OTP_INTERVAL = 180
+# อายุของข้อมูลฟอร์มที่รอการยืนยัน OTP (วินาที) ยาวกว่ารหัส OTP เพื่อให้ขอรหัสใหม่ได้
+OTP_FLOW_TIMEOUT = 1800
+
+
+class OtpError(Exception):
+    pass
+
+
+class OtpMissing(OtpError):
+    def __init__(self):
+        super().__init__("พบปัญหาการยืนยัน OTP, ติดต่อเจ้าหน้าที่")
+
+
+class OtpExpired(OtpError):
+    def __init__(self):
+        super().__init__("รหัส OTP หมดอายุ")
+
+
+class OtpInvalid(OtpError):
+    def __init__(self):
+        super().__init__("รหัส OTP ไม่ถูกต้อง")
+
+
+# ====================================
+# ที่เก็บ OTP ใน cache
+# ====================================
+class CacheOtpStore:
+    """
+    เก็บข้อมูลของแต่ละ flow ไว้ 2 key
+    - flow: ข้อมูลฟอร์มที่รอการยืนยัน (อายุ OTP_FLOW_TIMEOUT)
+    - code: secret ของ OTP ที่ส่งล่าสุด (อายุ OTP_INTERVAL)
+    """
+
+    def __init__(self, cache_alias='default'):
+        self.cache = caches[cache_alias]
+
+    def _flow_key(self, flow_id):
+        return f"pandham:otp:flow:{flow_id}"
+
+    def _code_key(self, flow_id):
+        return f"pandham:otp:code:{flow_id}"
+
+    def create_flow(self, form_data):
+        flow_id = uuid.uuid4().hex
+        self.cache.set(self._flow_key(flow_id), form_data, OTP_FLOW_TIMEOUT)
+        return flow_id
+
+    def get_flow(self, flow_id):
+        if not flow_id:
+            return None
+        return self.cache.get(self._flow_key(flow_id))
+
+    def set_code(self, flow_id, secret, sms_job=None):
+        self.cache.set(
+            self._code_key(flow_id),
+            {'secret': secret, 'sms_job': sms_job},
+            OTP_INTERVAL,
+        )
+
+    def get_code(self, flow_id):
+        if not flow_id:
+            return None
+        return self.cache.get(self._code_key(flow_id))
+
+    def consume(self, flow_id, otp_entered):
+        """
+        ตรวจสอบรหัส OTP หากถูกต้องจะลบรหัสและ flow ทิ้ง แล้วคืนข้อมูลฟอร์ม
+        การลบรหัสด้วย cache.delete ทำให้มีเพียงคำขอเดียวที่ยืนยันสำเร็จ
+        """
+        form_data = self.get_flow(flow_id)
+        if form_data is None:
+            raise OtpMissing()
+        code = self.get_code(flow_id)
+        if code is None:
+            raise OtpExpired()
+        if not pyotp.TOTP(code['secret'], interval=OTP_INTERVAL).verify(otp_entered):
+            raise OtpInvalid()
+        if not self.cache.delete(self._code_key(flow_id)):
+            # มีคำขออื่นใช้รหัสนี้ไปแล้ว
+            raise OtpExpired()
+        self.cache.delete(self._flow_key(flow_id))
+        return form_data
+
+    def discard(self, flow_id):
+        self.cache.delete_many([self._flow_key(flow_id), self._code_key(flow_id)])
+
+
+def get_otp_store():
+    """
+    คืน OTP store ตาม settings.PANDHAM_OTP_STORE (ค่าเริ่มต้นคือ CacheOtpStore)
+    """
+    store_class = import_string(getattr(settings, 'PANDHAM_OTP_STORE', 'pandham.otp.CacheOtpStore'))
+    return store_class(getattr(settings, 'PANDHAM_OTP_CACHE', 'default'))
@@ -0,0 +1,112 @@
+import logging
+
+from coderedcms.models import ReusableContent
+from django.db import transaction
+from django.db.models.signals import m2m_changed
+from django.db.models.signals import post_delete
+from django.db.models.signals import post_save
+from django.db.models.signals import pre_save
+from django.dispatch import receiver
+from wagtail.models import Page
+from wagtail.signals import page_published
+from wagtail.signals import page_unpublished
+from wagtail.signals import post_page_move
+
+from utils.page_url import invalidate_page_urls
+
+from . import availability
+from . import cache_tags
+from . import reusable_content
+from .models import BookInventory
+from .models import PandhamStock
+from .models import Propagation
+from .models import RequestPandham
+from .signals import stock_changed
+from .waiting_list import drain_waiting_list
+
+
+logger = logging.getLogger(__name__)
+
+
+@receiver(stock_changed)
+def invalidate_availability(sender, book_ids, **kwargs):
+    # ยอดสต็อกเปลี่ยนแล้ว (หลัง commit) ล้าง cache ความพร้อมของหนังสือที่เกี่ยวข้อง
+    availability.invalidate(book_ids)
+
+
+@receiver(stock_changed)
+def purge_cached_pages(sender, book_ids, **kwargs):
+    # ล้างเฉพาะหน้าใน wagtail-cache ที่แสดงสต็อกของหนังสือที่เปลี่ยน
+    cache_tags.purge(book_ids)
+
+
+@receiver(post_save, sender=BookInventory)
+@receiver(post_delete, sender=BookInventory)
+def invalidate_availability_on_book_change(sender, instance, **kwargs):
+    # ราคา, สถานะพร้อมใช้งาน หรือสต็อกอาจถูกแก้ไขผ่านหน้า admin
+    transaction.on_commit(lambda: availability.invalidate([instance.pk]))
+    transaction.on_commit(lambda: cache_tags.purge([instance.pk]))
+
+
+@receiver(post_save, sender=PandhamStock)
+@receiver(post_delete, sender=PandhamStock)
+def invalidate_availability_on_pandham_stock_change(sender, instance, **kwargs):
+    transaction.on_commit(lambda: availability.invalidate([instance.book_inventory_id]))
+    transaction.on_commit(lambda: cache_tags.purge([instance.book_inventory_id]))
+
+
+def drain_books(book_ids):
+    # ทำงานหลัง commit ข้อมูลของผู้ใช้บันทึกแล้ว ข้อผิดพลาดจึงบันทึกลง log แทนการส่งต่อถึงผู้ใช้
+    # ผู้รอรับที่ค้างอยู่จะถูกจัดสรรเมื่อสต็อกเพิ่มครั้งถัดไป หรือด้วยคำสั่ง drain_waiting_list
+    for book_id in book_ids:
+        try:
+            # ตรวจด้วย query อ่านก่อน เพื่อไม่ต้องจองสิทธิ์เขียนเมื่อไม่มีผู้รอรับ
+            if not RequestPandham.objects.filter(book_inventory_id=book_id, is_waiting=True).exists():
+                continue
+            drain_waiting_list(book_id)
+        except Exception:
+            logger.exception("จัดสรรผู้รอรับของหนังสือ %s ไม่สำเร็จ", book_id)
+
+
+@receiver(stock_changed)
+def drain_on_pandham_increase(sender, pandham_increased, **kwargs):
+    # คลังปันธรรมเพิ่มขึ้น จัดสรรให้ผู้รอรับของหนังสือนั้น
+    drain_books(pandham_increased)
+
+
+@receiver(m2m_changed, sender=Propagation.target_groups.through)
+def drain_on_target_groups_added(sender, instance, action, reverse, pk_set, **kwargs):
+    # กลุ่มเป้าหมายของ Propagation ถูกกำหนดหลังบันทึก จึงอาจมีผู้รอรับที่จัดสรรได้เพิ่ม
+    if action != 'post_add':
+        return
+    if reverse:
+        book_ids = set(Propagation.objects.filter(
+            pk__in=pk_set, remaining_donated__gt=0,
+        ).values_list('book_inventory_id', flat=True))
+    elif instance.remaining_donated > 0:
+        book_ids = {instance.book_inventory_id}
+    else:
+        return
+    transaction.on_commit(lambda: drain_books(book_ids))
+
+
+@receiver(pre_save, sender=ReusableContent)
+def invalidate_renamed_reusable_content(sender, instance, **kwargs):
+    # hook ของ wagtail ล้าง cache ด้วยชื่อใหม่ ชื่อเดิมของ snippet ที่ถูกเปลี่ยนชื่อต้องล้างที่นี่
+    if instance.pk is None:
+        return
+    old_name = sender.objects.filter(pk=instance.pk).values_list('name', flat=True).first()
+    if old_name is not None and old_name != instance.name:
+        transaction.on_commit(lambda: reusable_content.invalidate([old_name]))
+
+
+# URL ของหน้า CMS ที่ pandham ใช้ redirect (ดู utils.page_url)
+page_published.connect(invalidate_page_urls, dispatch_uid='pandham_page_url_published')
+page_unpublished.connect(invalidate_page_urls, dispatch_uid='pandham_page_url_unpublished')
+post_page_move.connect(invalidate_page_urls, dispatch_uid='pandham_page_url_moved')
+
+
+@receiver(post_delete)
+def invalidate_page_urls_on_delete(sender, instance, **kwargs):
+    if isinstance(instance, Page):
+        invalidate_page_urls()
@@ -0,0 +1,77 @@
+"""
+ตัวแจกหมายเลขอ้างอิง (reference_number) ของ Propagation และ RequestPandham
+"""
+import threading
+
+from django.apps import apps
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from utils.db import write_atomic
+
+
+# จำนวนหมายเลขที่จองจากฐานข้อมูลต่อครั้ง
+REFERENCE_BLOCK_SIZE = 50
+
+
+class ReferenceNumberAllocator:
+    """
+    แจกหมายเลขอ้างอิงรูปแบบ {prefix}{YYYYMMDD}-{ลำดับ 6 หลัก} ที่ไม่ซ้ำกันข้ามโปรเซส
+    จองเลขจากตาราง ReferenceCounter ทีละช่วง (UPDATE value = value + block_size)
+    แล้วแจกเลขในช่วงนั้นภายในโปรเซสโดยไม่ต้องแตะฐานข้อมูล
+    """
+
+    def __init__(self, block_size=REFERENCE_BLOCK_SIZE):
+        self.block_size = block_size
+        self._lock = threading.Lock()
+        # prefix -> [[period, เลขถัดไป, เลขสุดท้ายของช่วง + 1], ...]
+        # เฉพาะช่วงที่การจอง commit แล้ว จึงใช้ร่วมกันได้ทุก thread
+        self._blocks = {}
+
+    def next(self, prefix):
+        period = timezone.localdate().strftime('%Y%m%d')
+        with self._lock:
+            number = self._take(prefix, period)
+        if number is None:
+            number = self._reserve(prefix, period)
+        return f"{prefix}{period}-{number:06d}"
+
+    def _take(self, prefix, period):
+        blocks = self._blocks.get(prefix, [])
+        while blocks:
+            block = blocks[0]
+            if block[0] == period and block[1] < block[2]:
+                number = block[1]
+                block[1] += 1
+                return number
+            # ใช้หมดแล้วหรือเป็นของวันก่อน
+            blocks.pop(0)
+        return None
+
+    def _reserve(self, prefix, period):
+        ReferenceCounter = apps.get_model('pandham', 'ReferenceCounter')
+        with write_atomic():
+            ReferenceCounter.objects.get_or_create(prefix=prefix, period=period)
+            counter = ReferenceCounter.objects.filter(prefix=prefix, period=period)
+            counter.update(value=F('value') + self.block_size)
+            end = counter.values_list('value', flat=True).get() + 1
+        start = end - self.block_size
+
+        # เลขที่เหลือใช้ร่วมกันได้เมื่อการจอง commit แล้วเท่านั้น (นอก transaction on_commit ทำงานทันที)
+        # ถ้า transaction ภายนอกถูก rollback การจองก็ถูกยกเลิก และช่วงนี้ไม่ถูกนำไปใช้
+        # การเรียกซ้ำภายใน transaction เดียวกันก่อน commit จึงจองช่วงใหม่ แต่เลขที่เหลือทุกช่วงได้ใช้หลัง commit
+        remainder = [period, start + 1, end]
+        transaction.on_commit(lambda: self._release(prefix, remainder))
+        return start
+
+    def _release(self, prefix, remainder):
+        with self._lock:
+            self._blocks.setdefault(prefix, []).append(remainder)
+
+
+allocator = ReferenceNumberAllocator()
+
+
+def next_reference_number(prefix):
+    return allocator.next(prefix)
@@ -0,0 +1,49 @@
+"""
+cache ของ ReusableContent (snippet ของ coderedcms) ที่ render เป็น HTML แล้ว
+ถูกล้างเมื่อมีการสร้าง แก้ไข หรือลบ snippet (ดู wagtail_hooks.py และ receivers.py)
+"""
+from urllib.parse import quote
+
+from coderedcms.models import ReusableContent
+from django.core.cache import cache
+from django.utils.safestring import mark_safe
+
+
+REUSABLE_CONTENT_TIMEOUT = 60 * 60 * 24
+
+
+def _reusable_content_key(name):
+    return f"pandham:reusable_content:{quote(name)}"
+
+
+def get_rendered(*names):
+    """
+    คืน dict {name: HTML} ของ ReusableContent ที่พบ
+    อ่านจาก cache ก่อน แล้ว render ชื่อที่ไม่มีใน cache โดยใช้ query เดียว
+    """
+    keys = {name: _reusable_content_key(name) for name in names}
+    cached = cache.get_many(keys.values())
+    rendered = {name: cached[key] for name, key in keys.items() if key in cached}
+
+    missing = [name for name in names if name not in rendered]
+    if missing:
+        found = {}
+        for content in ReusableContent.objects.filter(name__in=missing).order_by('pk'):
+            # ชื่อซ้ำกันได้ ให้ใช้รายการแรกเหมือนกับ .first()
+            found.setdefault(content.name, content)
+        fresh = {}
+        for name in missing:
+            content = found.get(name)
+            # เก็บค่าว่างไว้ด้วย เพื่อไม่ต้อง query ชื่อที่ไม่มีอยู่ซ้ำทุกครั้ง
+            fresh[name] = str(content.content.render_as_block()) if content else ''
+        cache.set_many(
+            {keys[name]: html for name, html in fresh.items()},
+            REUSABLE_CONTENT_TIMEOUT,
+        )
+        rendered.update(fresh)
+
+    return {name: mark_safe(html) for name, html in rendered.items() if html}
+
+
+def invalidate(names):
+    cache.delete_many([_reusable_content_key(name) for name in names])
@@ -0,0 +1,7 @@
+from django.dispatch import Signal
+
+
+# ส่งหลัง commit ทุกครั้งที่มีการลงยอดสต็อก
+# book_ids: set ของ book_inventory_id ที่ยอดคลังหลักหรือคลังปันธรรมเปลี่ยน
+# pandham_increased: set ของ book_inventory_id ที่คลังปันธรรมเพิ่มขึ้น
+stock_changed = Signal()
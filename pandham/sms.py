@@ -0,0 +1,155 @@
+"""
+การส่ง SMS แบบเบื้องหลัง
+view เพียงแค่เข้าคิวข้อความแล้วตอบกลับทันที ส่วนการเรียก SMS gateway
+ทำใน thread เบื้องหลังที่ใช้ HTTP session เดียว (keep-alive) พร้อม timeout
+และ retry เฉพาะกรณีเชื่อมต่อไม่สำเร็จ (ข้อความยังไม่ถึง gateway จึงไม่ส่งซ้ำ)
+"""
+import logging
+import os
+import queue
+import threading
+import uuid
+
+import requests
+from django.core.cache import cache
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from .instrumentation import instrument
+
+
+logger = logging.getLogger(__name__)
+
+# timeout (connect, read) เป็นวินาที
+SMS_TIMEOUT = (3.05, 10)
+SMS_RETRIES = 3
+# ระยะเวลาที่เก็บสถานะงานส่ง SMS ไว้ให้หน้า OTP ตรวจสอบ
+SMS_STATUS_TIMEOUT = 600
+
+SMS_SENDING = 'sending'
+SMS_SENT = 'sent'
+SMS_FAILED = 'failed'
+
+
+def _status_key(job_id):
+    return f"pandham:sms:{job_id}"
+
+
+def mask_phone_number(phone_number):
+    """
+    ปิดเบอร์โทรศัพท์ให้เหลือ 4 หลักท้ายสำหรับเขียน log
+    """
+    digits = str(phone_number or '')
+    return '*' * max(len(digits) - 4, 0) + digits[-4:]
+
+
+def sms_status(job_id):
+    """
+    คืนสถานะของงานส่ง SMS (sending, sent, failed) หรือ None หากไม่พบงาน
+    """
+    if not job_id:
+        return None
+    return cache.get(_status_key(job_id))
+
+
+# ====================================
+# ตัวส่ง SMS เบื้องหลัง
+# ====================================
+class SmsSender:
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._session = None
+
+    def _build_session(self):
+        # การส่ง SMS ไม่ idempotent: ถ้า gateway ได้รับคำขอแล้ว (read timeout หรือ 5xx)
+        # การส่งซ้ำอาจทำให้ผู้ใช้ได้ OTP สองข้อความ จึง retry เฉพาะตอนเชื่อมต่อ
+        retry = Retry(
+            total=SMS_RETRIES,
+            connect=SMS_RETRIES,
+            read=0,
+            status=0,
+            other=0,
+            backoff_factor=0.5,
+            allowed_methods=['GET'],
+        )
+        adapter = HTTPAdapter(max_retries=retry, pool_connections=1, pool_maxsize=4)
+        session = requests.Session()
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def _ensure_worker(self):
+        # เริ่ม thread ใหม่เมื่อยังไม่มี หรือหลังจาก worker process ถูก fork มา
+        with self._lock:
+            if self._thread and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._queue = queue.Queue()
+            self._session = self._build_session()
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='pandham-sms', daemon=True)
+            self._thread.start()
+
+    def enqueue(self, phone_number, message):
+        """
+        เข้าคิวข้อความ SMS และคืน job_id สำหรับตรวจสอบสถานะ
+        """
+        job_id = uuid.uuid4().hex
+        cache.set(_status_key(job_id), SMS_SENDING, SMS_STATUS_TIMEOUT)
+        self._ensure_worker()
+        self._queue.put((job_id, phone_number, message))
+        return job_id
+
+    def _run(self):
+        while True:
+            job_id, phone_number, message = self._queue.get()
+            try:
+                with instrument('SmsSender.send', count_queries=False):
+                    self.send(phone_number, message)
+                status = SMS_SENT
+            except Exception as e:
+                # ไม่ใช้ logger.exception เพราะข้อความของ exception มี URL พร้อมเบอร์โทรและ apiKey
+                logger.error(
+                    "ส่ง SMS งาน %s ไปที่ %s ไม่สำเร็จ: %s",
+                    job_id, mask_phone_number(phone_number), type(e).__name__,
+                )
+                status = SMS_FAILED
+            cache.set(_status_key(job_id), status, SMS_STATUS_TIMEOUT)
+            self._queue.task_done()
+
+    def send(self, phone_number, message):
+        """
+        เรียก SMS gateway โดยตรง (ใช้ภายใน thread เบื้องหลัง)
+        """
+        params = {
+            "SenderId": "PTF",
+            "Is_Unicode": "true",
+            "Is_Flash": "false",
+            "Message": message,
+            "MobileNumbers": phone_number,
+            "apiKey": os.getenv("API_KEY"),
+            "clientId": os.getenv("CLIENT_ID"),
+        }
+        session = self._session or self._build_session()
+        response = session.get(os.getenv("SEND_SMS_URL"), params=params, timeout=SMS_TIMEOUT)
+        response.raise_for_status()
+        logger.info(
+            "SMS gateway ตอบกลับ %s สำหรับ %s",
+            response.status_code, mask_phone_number(phone_number),
+        )
+        return response
+
+    def join(self):
+        """
+        รอจนกว่าข้อความในคิวถูกส่งหมด (ใช้ในการทดสอบ)
+        """
+        self._queue.join()
+
+
+sender = SmsSender()
+
+
+def send_sms(phone_number, message):
+    return sender.enqueue(phone_number, message)
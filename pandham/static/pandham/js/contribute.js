@@ -1,4 +1,5 @@
-document.addEventListener("DOMContentLoaded", function() {
+// แบบฟอร์มอาจถูกแทนที่ด้วย htmx (เช่น แสดงข้อผิดพลาด) จึงผูก event ใหม่ทุกครั้งที่แบบฟอร์มถูกแทนที่
+function initContributeForm() {
     var bookPrice = document.getElementById('book_price').value;
 
     var amountRangeInput = document.getElementById('id_amount_contributed');
@@ -81,8 +82,16 @@ document.addEventListener("DOMContentLoaded", function() {
     }
 
     // ตรวจสอบจำนวนปันธรรม
-    donate_books.addEventListener('input', function() {
+    if(donate_books) donate_books.addEventListener('input', function() {
         checkDonateAmount();
     });
 
+}
+
+document.addEventListener("DOMContentLoaded", initContributeForm);
+
+document.addEventListener("htmx:afterSwap", function(event) {
+    if (document.getElementById("id_amount_contributed")) {
+        initContributeForm();
+    }
 });
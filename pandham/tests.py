@@ -1,3 +1,1235 @@
-from django.test import TestCase
+import gzip
+import os
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from io import StringIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import pyotp
+import requests
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.contrib.sessions.models import Session
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import OperationalError, connection, connections, router, transaction
+from django.db.models import QuerySet
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from wagtail.models import Locale, Page, Site
+from coderedcms.models import ReusableContent
+
+from utils.cache import TieredCache
+from utils.db import write_atomic
+from utils.sqlite.base import DatabaseWrapper as SQLiteDatabaseWrapper
+from utils.sessions import SessionStore
+
+from . import availability, cache_tags, instrumentation
+from .archive import archivable, archive_year
+from .ledger import create_checkpoint, latest_checkpoint, stock_discrepancies, stock_totals
+from .models import (
+    BookInventory, InventoryTransaction, InventoryTransactionSummary, PandhamStock, PandhamTargetGroup,
+    Propagation, ReferenceCounter, RequestPandham, StockCheckpoint)
+from .otp import OTP_INTERVAL, OtpExpired, OtpInvalid, OtpMissing, get_otp_store
+from .reference import ReferenceNumberAllocator
+from .sms import SMS_FAILED, SMS_RETRIES, SmsSender, sms_status
+from .wagtail_hooks import InventoryTransactionAdmin
+from .receivers import drain_books
+from .waiting_list import drain_waiting_list
+
+
+# template อย่างง่ายของหน้า pandham เพื่อให้นับเฉพาะ query ของ view และฟอร์ม
+# ไม่รวม layout ของ coderedcms
+PANDHAM_TEST_TEMPLATES = {
+    '404.html': '{{ exception }}',
+    'pandham/request-pandham.html': '{{ result }}{{ book.book_name }}{{ inventory_stock }}{{ pandham_stock }}{{ form }}',
+    'pandham/request-pandham-verify-otp.html': '{{ phone_number }}{{ form }}',
+    'pandham/request-pandham-success.html': (
+        '{{ request_pandham_success_message }}{{ request_pandham.reference_number }}'
+        '{{ request_pandham.book_inventory }}{{ request_pandham.recipient_category }}'
+    ),
+    'pandham/contribute-pandham.html': '{{ book_name }}{{ price }}{{ current_stock }}{{ form }}',
+    'pandham/contribute-pandham-verify-otp.html': '{{ phone_number }}{{ form }}',
+    'pandham/contribute-pandham-success.html': (
+        '{{ contribution_anumodhana_message }}{{ propagation.reference_number }}'
+        '{{ propagation.book_inventory }}{% if propagation.target_groups.all %}'
+        '{% for target_group in propagation.target_groups.all %}{{ target_group.name }}{% endfor %}'
+        '{% endif %}{{ ptf_saving_account }}'
+    ),
+}
+
+
+pandham_view_settings = override_settings(
+    SESSION_ENGINE='django.contrib.sessions.backends.cache',
+    TEMPLATES=[{
+        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'OPTIONS': {
+            'loaders': [
+                ('django.template.loaders.locmem.Loader', PANDHAM_TEST_TEMPLATES),
+                'django.template.loaders.app_directories.Loader',
+            ],
+        },
+    }],
+)
+
+
+def start_otp_flow(client, form_data):
+    # สร้าง OTP flow เหมือนหลังจาก submit ฟอร์ม แล้วคืนรหัส OTP ที่ถูกต้อง
+    store = get_otp_store()
+    flow_id = store.create_flow(form_data)
+    secret = pyotp.random_base32()
+    store.set_code(flow_id, secret)
+    session = client.session
+    session['otp_flow'] = flow_id
+    session.save()
+    return pyotp.TOTP(secret, interval=OTP_INTERVAL).now()
+
+
+# =============================
+# fixture ร่วมของเทสต์ view ใน pandham
+# =============================
+@pandham_view_settings
+class PandhamViewTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.book = BookInventory.objects.create(
+            book_name="หนังสือทดสอบ", price=100, initial_stock=20, current_stock=20)
+        PandhamStock.objects.create(book_inventory=cls.book, current_stock=5)
+        cls.target_groups = [
+            PandhamTargetGroup.objects.create(name="กลุ่ม 1"),
+            PandhamTargetGroup.objects.create(name="กลุ่ม 2"),
+        ]
+        for name in ['request_pandham_success_message', 'contribution_anumodhana_message', 'ptf_saving_account']:
+            ReusableContent.objects.create(name=name)
+
+    def setUp(self):
+        cache.clear()
+        # cache ของ ContentType ค้างข้ามเทสต์ ล้างไว้ให้จำนวน query ไม่ขึ้นกับลำดับการรัน
+        ContentType.objects.clear_cache()
+        patcher = mock.patch('pandham.views.send_sms', return_value='job')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def start_flow(self, form_data):
+        return start_otp_flow(self.client, form_data)
+
+    def request_form_data(self):
+        return {
+            'book_inventory': self.book.pk,
+            'accept_terms': 'on',
+            'name': 'ผู้ขอรับ',
+            'recipient_category': self.target_groups[0].pk,
+            'phone_number': '0812345678',
+            'shipping_address': 'ที่อยู่',
+        }
+
+    def contribute_form_data(self):
+        return {
+            'book_inventory': self.book.pk,
+            'amount_contributed': 200,
+            'number_of_books': 2,
+            'donate_books': 1,
+            'target_groups': [group.pk for group in self.target_groups],
+            'name': 'ผู้สมทบ',
+            'phone_number': '0812345678',
+            'shipping_address': 'ที่อยู่',
+        }
+
+
+# =============================
+# จำนวน query ของแต่ละ view ใน pandham
+# =============================
+class PandhamViewQueryCountTests(PandhamViewTestCase):
+    def test_request_pandham_get(self):
+        url = reverse('request_pandham', args=[self.book.pk])
+        # หนังสือ, availability, กลุ่มเป้าหมาย
+        with self.assertNumQueries(3):
+            self.assertEqual(self.client.get(url).status_code, 200)
+        # availability อยู่ใน cache แล้ว
+        with self.assertNumQueries(2):
+            self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_request_pandham_post(self):
+        url = reverse('request_pandham', args=[self.book.pk])
+        # หนังสือ, กลุ่มเป้าหมาย, ตรวจคำขอซ้ำ
+        with self.assertNumQueries(3):
+            response = self.client.post(url, self.request_form_data())
+        self.assertRedirects(response, reverse('request_pandham_verify_otp'), fetch_redirect_response=False)
+
+    def test_request_pandham_post_duplicate(self):
+        RequestPandham.objects.create(
+            book_inventory=self.book, phone_number='0812345678', name='ผู้ขอรับ', is_waiting=True)
+        url = reverse('request_pandham', args=[self.book.pk])
+        # หนังสือ, กลุ่มเป้าหมาย, ตรวจคำขอซ้ำ, availability
+        with self.assertNumQueries(4):
+            response = self.client.post(url, self.request_form_data())
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "อยู่ในรายการรอหนังสือ")
+
+    def test_request_pandham_verify_otp(self):
+        self.start_flow({'book_inventory': self.book.pk, 'phone_number': '0812345678'})
+        url = reverse('request_pandham_verify_otp')
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(url).status_code, 200)
+        with self.assertNumQueries(0):
+            response = self.client.post(url, {'otp': 'x'})
+        self.assertEqual(response.status_code, 200)
+
+    def test_request_pandham_success(self):
+        request_pandham = RequestPandham.objects.create(
+            book_inventory=self.book, phone_number='0812345678', name='ผู้ขอรับ',
+            recipient_category=self.target_groups[0], is_waiting=True)
+        url = reverse('request_pandham_success', args=[request_pandham.pk])
+        # คำขอ (พร้อมหนังสือและกลุ่ม), reusable content
+        with self.assertNumQueries(2):
+            self.assertEqual(self.client.get(url).status_code, 200)
+        # reusable content อยู่ใน cache แล้ว
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_contribute_pandham_get(self):
+        url = reverse('contribute_pandham', args=[self.book.pk])
+        # availability, กลุ่มเป้าหมาย
+        with self.assertNumQueries(2):
+            self.assertEqual(self.client.get(url).status_code, 200)
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_contribute_pandham_post(self):
+        url = reverse('contribute_pandham', args=[self.book.pk])
+        # availability, หนังสือ, กลุ่มเป้าหมาย
+        with self.assertNumQueries(3):
+            response = self.client.post(url, self.contribute_form_data())
+        self.assertRedirects(response, reverse('contribute_pandham_verify_otp'), fetch_redirect_response=False)
+
+    def test_contribute_pandham_verify_otp(self):
+        otp = self.start_flow({
+            'book_inventory': self.book.pk,
+            'amount_contributed': 200,
+            'number_of_books': 2,
+            'receive_books': 1,
+            'donate_books': 1,
+            'target_groups': [group.pk for group in self.target_groups],
+            'name': 'ผู้สมทบ',
+            'phone_number': '0812345678',
+            'shipping_address': 'ที่อยู่',
+        })
+        url = reverse('contribute_pandham_verify_otp')
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(url).status_code, 200)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.post(url, {'otp': 'x'}).status_code, 200)
+        # จองเลขอ้างอิง, ลงรายการ support และ pandham (รวม reference index ของ wagtail),
+        # บันทึก Propagation และกำหนดกลุ่มเป้าหมาย
+        with self.assertNumQueries(41):
+            response = self.client.post(url, {'otp': otp})
+        propagation = Propagation.objects.get()
+        self.assertRedirects(
+            response, reverse('contribute_pandham_success', args=[propagation.pk]),
+            fetch_redirect_response=False)
+
+    def test_contribute_pandham_success(self):
+        propagation = Propagation.objects.create(
+            book_inventory=self.book, phone_number='0812345678', name='ผู้สมทบ')
+        propagation.target_groups.set(self.target_groups)
+        url = reverse('contribute_pandham_success', args=[propagation.pk])
+        # propagation (พร้อมหนังสือ), กลุ่มเป้าหมาย, reusable content
+        with self.assertNumQueries(3):
+            self.assertEqual(self.client.get(url).status_code, 200)
+        with self.assertNumQueries(2):
+            self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_otp_views(self):
+        self.start_flow({'phone_number': '0812345678'})
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(reverse('resend_otp')).json()['status'], 'success')
+        with self.assertNumQueries(0):
+            self.client.get(reverse('otp_status'))
+
+    def test_webhook_get(self):
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(reverse('webhook')).status_code, 400)
+
+
+# =============================
+# session ของผู้ใช้ที่ยังไม่ได้ส่งฟอร์ม
+# =============================
+class PandhamSessionTests(PandhamViewTestCase):
+    @override_settings(SESSION_ENGINE='utils.sessions')
+    def test_get_does_not_write_session(self):
+        for url in [reverse('request_pandham', args=[self.book.pk]), reverse('contribute_pandham', args=[self.book.pk])]:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn(settings.SESSION_COOKIE_NAME, response.cookies)
+        self.assertFalse(Session.objects.exists())
+
+    def test_session_save_uses_write_atomic(self):
+        store = SessionStore()
+        store['phone_number'] = '0812345678'
+        with mock.patch('utils.sessions.write_atomic', wraps=write_atomic) as atomic:
+            store.save()
+            store['name'] = 'ผู้ขอ'
+            store.save()
+        self.assertEqual(atomic.call_count, 3)
+        self.assertEqual(Session.objects.get().get_decoded()['name'], 'ผู้ขอ')
+
+    def test_sweep_expired_sessions(self):
+        now = timezone.now()
+        for i in range(5):
+            Session.objects.create(session_key=f'expired{i}', session_data='', expire_date=now - timedelta(days=1))
+        Session.objects.create(session_key='active', session_data='', expire_date=now + timedelta(days=1))
+        call_command('sweep_expired_sessions', '--batch-size', '2', '--pause', '0', stdout=StringIO())
+        self.assertEqual(list(Session.objects.values_list('session_key', flat=True)), ['active'])
+
+
+# =============================
+# redirect ไปยังหน้า CMS ด้วย URL ที่ resolve ไว้ใน cache
+# =============================
+class PageUrlRedirectTests(PandhamViewTestCase):
+    def setUp(self):
+        super().setUp()
+        Locale.objects.get_or_create(language_code='en')
+        # มีมากกว่าหนึ่ง site เหมือนบน production
+        other_root = Page.add_root(instance=Page(title="Other", slug="other"))
+        Site.objects.create(hostname='other.example.org', root_page=other_root)
+        self.other_root = other_root
+
+    def test_verify_otp_redirect_without_flow(self):
+        root = Page.add_root(instance=Page(title="Root", slug="root"))
+        Site.objects.create(hostname='testserver', root_page=root, is_default_site=True)
+        url = reverse('request_pandham_verify_otp')
+        # ยังไม่มีหน้า pandham
+        self.assertContains(self.client.get(url), "ไม่พบหน้าที่เผยแพร่อยู่", status_code=404)
+
+        root.add_child(instance=Page(title="Pandham", slug="pandham")).save_revision().publish()
+        self.assertRedirects(self.client.get(url), '/pandham/', fetch_redirect_response=False)
+        # URL ของหน้า pandham อยู่ใน cache แล้ว
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('contribute_pandham_verify_otp'))
+        self.assertRedirects(response, '/pandham/', fetch_redirect_response=False)
+
+    def test_redirect_to_page_on_other_site(self):
+        self.other_root.add_child(instance=Page(title="Pandham", slug="pandham")).save_revision().publish()
+        response = self.client.get(reverse('request_pandham_verify_otp'))
+        self.assertRedirects(response, 'http://other.example.org/pandham/', fetch_redirect_response=False)
+
+
+# =============================
+# การตอบกลับเฉพาะบางส่วนของหน้าสำหรับ htmx
+# =============================
+class HtmxFragmentTests(PandhamViewTestCase):
+    def test_htmx_fragments(self):
+        url = reverse('contribute_pandham', args=[self.book.pk])
+        # แบบฟอร์มไม่ถูกต้อง ตอบกลับเฉพาะส่วนแบบฟอร์ม
+        response = self.client.post(url, {'book_inventory': self.book.pk}, HTTP_HX_REQUEST='true')
+        self.assertContains(response, 'id="contribute-pandham-form"')
+        self.assertContains(response, 'invalid-feedback')
+        self.assertNotContains(response, '<html')
+
+        # แบบฟอร์มถูกต้อง ตอบกลับส่วนยืนยัน OTP
+        response = self.client.post(url, self.contribute_form_data(), HTTP_HX_REQUEST='true')
+        self.assertContains(response, 'id="otp-panel"')
+        self.assertEqual(response['HX-Push-Url'], reverse('contribute_pandham_verify_otp'))
+
+        response = self.client.post(
+            reverse('contribute_pandham_verify_otp'), {'otp': 'x'}, HTTP_HX_REQUEST='true')
+        self.assertContains(response, 'id="otp-panel"')
+        self.assertContains(response, "รหัส OTP ไม่ถูกต้อง")
+
+        response = self.client.get(reverse('resend_otp'), HTTP_HX_REQUEST='true')
+        self.assertContains(response, "SMS OTP")
+
+        # คำขอซ้ำ ตอบกลับข้อความแจ้งพร้อมแบบฟอร์ม
+        RequestPandham.objects.create(
+            book_inventory=self.book, phone_number='0812345678', name='ผู้ขอรับ', is_waiting=True)
+        response = self.client.post(
+            reverse('request_pandham', args=[self.book.pk]), self.request_form_data(), HTTP_HX_REQUEST='true')
+        self.assertContains(response, 'id="request-pandham-form"')
+        self.assertContains(response, "อยู่ในรายการรอหนังสือ")
+
+
+# =============================
+# stock API พร้อม ETag/Last-Modified
+# =============================
+class StockApiTests(PandhamViewTestCase):
+    def test_stock_api(self):
+        url = reverse('stock_api_book', args=[self.book.pk])
+        response = self.client.get(url)
+        self.assertEqual(response.json()['pandham_stock'], 5)
+        etag = response['ETag']
+
+        # สต็อกไม่เปลี่ยน ตอบ 304 โดยไม่ query ฐานข้อมูล
+        with self.assertNumQueries(0):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('stock_api'), HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            InventoryTransaction.objects.create(
+                book_inventory=self.book, transaction_type='pandham', quantity=2)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.json()['pandham_stock'], 7)
+
+
+# =============================
+# การล้าง cache ของหน้าตาม tag ของหนังสือ
+# =============================
+class CachePurgeTests(PandhamViewTestCase):
+    @override_settings(WAGTAIL_CACHE=True)
+    def test_stock_purges_tagged_pages(self):
+        other = BookInventory.objects.create(book_name="อีกเล่ม", price=50, initial_stock=10, current_stock=10)
+        url = reverse('contribute_pandham', args=[self.book.pk])
+        other_url = reverse('contribute_pandham', args=[other.pk])
+        for page_url in [url, other_url]:
+            self.assertEqual(self.client.get(page_url)['X-Wagtail-Cache'], 'miss')
+            self.assertEqual(self.client.get(page_url)['X-Wagtail-Cache'], 'hit')
+
+        # ลงรายการสต็อกของหนังสือเล่มแรก ล้างเฉพาะหน้าที่แสดงหนังสือเล่มนั้น
+        with self.captureOnCommitCallbacks(execute=True):
+            InventoryTransaction.objects.create(
+                book_inventory=self.book, transaction_type='pandham', quantity=2)
+        self.assertEqual(self.client.get(url)['X-Wagtail-Cache'], 'miss')
+        self.assertEqual(self.client.get(other_url)['X-Wagtail-Cache'], 'hit')
+
+    @override_settings(WAGTAIL_CACHE=True)
+    def test_pages_of_one_book_do_not_share_a_tag(self):
+        urls = [
+            reverse('contribute_pandham', args=[self.book.pk]),
+            reverse('request_pandham', args=[self.book.pk]),
+        ]
+        cache = cache_tags._get_cache()
+        with mock.patch.object(cache, 'set', wraps=cache.set) as set_:
+            for page_url in urls:
+                self.assertEqual(self.client.get(page_url)['X-Wagtail-Cache'], 'miss')
+        # แต่ละหน้าเขียนเฉพาะ key ของตัวเอง ไม่มี key ของหนังสือที่หลายหน้าแก้ร่วมกัน
+        written = {call.args[0] for call in set_.call_args_list if call.args[0].startswith('pandham:cache_tags:')}
+        self.assertEqual(written, {
+            cache_tags._page_key(f'http://testserver{page_url}') for page_url in urls})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            InventoryTransaction.objects.create(
+                book_inventory=self.book, transaction_type='pandham', quantity=2)
+        for page_url in urls:
+            self.assertEqual(self.client.get(page_url)['X-Wagtail-Cache'], 'miss')
+            self.assertEqual(self.client.get(page_url)['X-Wagtail-Cache'], 'hit')
+
+
+# =============================
+# การเก็บสถิติ query และเวลาของ view
+# =============================
+class InstrumentationTests(PandhamViewTestCase):
+    @override_settings(PANDHAM_INSTRUMENTATION=True)
+    def test_instrumentation(self):
+        instrumentation.reset()
+        url = reverse('contribute_pandham', args=[self.book.pk])
+        self.client.get(url)
+        self.client.get(url)
+        with self.captureOnCommitCallbacks(execute=True):
+            Propagation.objects.create(
+                book_inventory=self.book, phone_number='0812345678', name='ผู้สมทบ', donate_books=1)
+
+        rows = {(row['kind'], row['name']): row for row in instrumentation.summarize(instrumentation.collect())}
+        view = rows['view', 'contribute_pandham']
+        self.assertEqual(view['count'], 2)
+        self.assertEqual(view['max_queries'], 2)
+        self.assertEqual(sum(view['histogram']), 2)
+        self.assertGreater(rows['save', 'Propagation.save']['max_queries'], 0)
+
+        output = StringIO()
+        call_command('pandham_metrics', '--reset', stdout=output)
+        self.assertIn('contribute_pandham', output.getvalue())
+        self.assertEqual(instrumentation.collect(), [])
+
+    def test_publish_runs_in_background(self):
+        ring = instrumentation.RingBuffer(10)
+        published = threading.Event()
+        threads = []
+
+        def publish():
+            threads.append(threading.current_thread())
+            published.set()
+
+        with mock.patch.object(instrumentation, 'PUBLISH_INTERVAL', 0.01), \
+                mock.patch.object(ring, 'publish', side_effect=publish):
+            ring.append({'kind': 'view', 'name': 'x'})
+            self.assertTrue(published.wait(5))
+        # append ไม่ส่งขึ้น cache เอง การส่งทำใน thread เบื้องหลัง
+        self.assertEqual(threads[0], ring._publisher)
+
+    def test_publish_keeps_pids_of_other_workers(self):
+        cache.clear()
+        other = {'kind': 'view', 'name': 'other'}
+        cache.set(instrumentation._samples_key(111), [other])
+        # pid 222 ไม่มีข้อมูลแล้ว ถูกตัดออกเมื่อมีการลงทะเบียน pid ใหม่
+        cache.set(instrumentation.PIDS_KEY, {111: 0, 222: 0})
+        ring = instrumentation.RingBuffer(10)
+        ring.append({'kind': 'view', 'name': 'mine'})
+        ring.publish()
+        self.assertEqual(set(cache.get(instrumentation.PIDS_KEY)), {111, os.getpid()})
+
+        # worker อื่นเขียนดัชนีทับโดยไม่มี pid นี้ การ publish ครั้งถัดไปเพิ่มกลับ
+        cache.set(instrumentation.PIDS_KEY, {111: 0})
+        ring.publish()
+        self.assertEqual(set(cache.get(instrumentation.PIDS_KEY)), {111, os.getpid()})
+
+        with mock.patch('pandham.instrumentation.os.getpid', return_value=999):
+            names = {sample['name'] for sample in instrumentation.collect()}
+        self.assertTrue({'other', 'mine'} <= names)
+
+
+# =============================
+# การย้ายรายการบัญชีเก่าไปเก็บเป็นไฟล์
+# =============================
+class ArchiveTransactionsTests(PandhamViewTestCase):
+    def old_transactions(self):
+        book = BookInventory.objects.create(book_name="เล่มเก่า", price=10, initial_stock=50, current_stock=50)
+        for transaction_type, quantity in [('pandham', 5), ('support', 3), ('request', 2), ('pandham', 6), ('pandham', 4)]:
+            InventoryTransaction.objects.create(
+                book_inventory=book, transaction_type=transaction_type, quantity=quantity)
+        old = timezone.now() - timedelta(days=3 * 366)
+        InventoryTransaction.objects.filter(book_inventory=book).exclude(quantity=4).update(created_at=old)
+        return book, old.year
+
+    def test_archive_transactions(self):
+        book, _ = self.old_transactions()
+
+        def book_totals(**kwargs):
+            return stock_totals(**kwargs)[book.pk]
+
+        expected = book_totals(use_checkpoints=False)
+        with tempfile.TemporaryDirectory() as media_root, self.settings(MEDIA_ROOT=media_root):
+            call_command('archive_transactions', '--chunk-size', '1', stdout=StringIO())
+            # ยอดสรุปของแต่ละ (หนังสือ, ประเภท) สะสมข้ามชุด
+            summaries = InventoryTransactionSummary.objects.filter(book_inventory=book)
+            self.assertEqual(summaries.count(), 3)
+            pandham = summaries.get(transaction_type='pandham')
+            self.assertEqual((pandham.quantity, pandham.transaction_count), (11, 2))
+            self.assertEqual(list(InventoryTransaction.objects.filter(book_inventory=book).values_list(
+                'quantity', flat=True)), [4])
+            with gzip.open(os.path.join(media_root, summaries[0].archive_file), 'rt', encoding='utf-8') as f:
+                self.assertEqual(len(f.readlines()), 4)
+
+        # ยอดคงเหลือยังตรงทั้งแบบใช้ checkpoint, แบบรวมทั้ง ledger และเมื่อไม่มี checkpoint
+        self.assertEqual(book_totals(), expected)
+        self.assertEqual(book_totals(use_checkpoints=False), expected)
+        StockCheckpoint.objects.all().delete()
+        self.assertEqual(book_totals(), expected)
+        self.assertFalse([row for row in stock_discrepancies() if row[0] == book.pk])
+
+    def test_archive_uses_short_transactions(self):
+        book, year = self.old_transactions()
+        queryset, _ = archivable(timezone.now())
+        with tempfile.TemporaryDirectory() as media_root, self.settings(MEDIA_ROOT=media_root):
+            files = []
+
+            def chunk_transaction():
+                # ไฟล์ archive ถูกเขียนเสร็จก่อนเปิด transaction แรก
+                files.append(os.listdir(os.path.join(media_root, 'ledger-archive')))
+                return write_atomic()
+
+            with mock.patch('pandham.archive.write_atomic', side_effect=chunk_transaction):
+                count, path = archive_year(queryset.filter(book_inventory=book), year, chunk_size=2)
+        self.assertEqual(count, 4)
+        # 2 ชุด และการตรวจว่าไม่มีรายการเหลือ
+        self.assertEqual(len(files), 3)
+        self.assertEqual(files[0], [os.path.basename(path)])
+
+    def test_archive_failure_removes_file(self):
+        book, year = self.old_transactions()
+        queryset, _ = archivable(timezone.now())
+        with tempfile.TemporaryDirectory() as media_root, self.settings(MEDIA_ROOT=media_root):
+            with mock.patch.object(
+                    InventoryTransactionSummary.objects, 'bulk_create', side_effect=RuntimeError("boom")):
+                with self.assertRaises(RuntimeError):
+                    archive_year(queryset.filter(book_inventory=book), year)
+            self.assertEqual(os.listdir(os.path.join(media_root, 'ledger-archive')), [])
+        self.assertEqual(InventoryTransaction.objects.filter(book_inventory=book).count(), 5)
+
+
+# =============================
+# database router ของ alias read_only
+# =============================
+class ReadOnlyRouterTests(PandhamViewTestCase):
+    def test_admin_lists_read_from_read_only(self):
+        # หน้ารายการอ่านจาก read_only แต่การบันทึก instance ที่โหลดมาจาก read_only ไปที่ default
+        request = RequestFactory().get('/')
+        self.assertEqual(InventoryTransactionAdmin().get_queryset(request).db, 'read_only')
+        self.book._state.db = 'read_only'
+        self.assertEqual(router.db_for_write(BookInventory, instance=self.book), 'default')
+        self.assertEqual(router.db_for_read(BookInventory), 'default')
+        self.assertFalse(router.allow_migrate('read_only', 'pandham'))
+
+
+# =============================
+# การตัดสต็อกเมื่อลงรายการ InventoryTransaction
+# =============================
+class StockPostingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.book = BookInventory.objects.create(
+            book_name="หนังสือทดสอบ", price=100, initial_stock=10, current_stock=10)
+        PandhamStock.objects.create(book_inventory=cls.book, current_stock=3)
+
+    def assertStock(self, main, pandham):
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.current_stock, main)
+        self.assertEqual(PandhamStock.objects.get(book_inventory=self.book).current_stock, pandham)
+
+    def test_oversell_is_rejected(self):
+        for transaction_type, quantity in [('support', 11), ('pandham', 11), ('request', 4)]:
+            with self.assertRaises(ValidationError):
+                InventoryTransaction.objects.create(
+                    book_inventory=self.book, transaction_type=transaction_type, quantity=quantity)
+        self.assertStock(10, 3)
+        self.assertFalse(InventoryTransaction.objects.exists())
+
+    def test_propagation_oversell_rolls_back(self):
+        # ตัด 'pandham' ได้ แต่ 'support' ไม่พอ ทั้งรายการต้องถูกยกเลิก
+        with self.assertRaises(ValidationError):
+            Propagation.objects.create(
+                book_inventory=self.book, phone_number='0812345678', name='ผู้สมทบ',
+                number_of_books=12, receive_books=9, donate_books=3)
+        self.assertStock(10, 3)
+        self.assertFalse(InventoryTransaction.objects.exists())
+        self.assertFalse(Propagation.objects.exists())
+
+    def test_edit_cannot_oversell(self):
+        txn_in = InventoryTransaction.objects.create(
+            book_inventory=self.book, transaction_type='in', quantity=5)
+        InventoryTransaction.objects.create(book_inventory=self.book, transaction_type='support', quantity=12)
+        self.assertStock(3, 3)
+
+        # ลดจำนวนของรายการ 'in' จนยอดติดลบ
+        txn_in.quantity = 1
+        with self.assertRaises(ValidationError):
+            txn_in.save()
+        self.assertStock(3, 3)
+
+        # เปลี่ยนประเภทเป็นการตัดสต็อก
+        txn_in.quantity = 5
+        txn_in.transaction_type = 'support'
+        with self.assertRaises(ValidationError):
+            txn_in.save()
+        self.assertStock(3, 3)
+        self.assertEqual(InventoryTransaction.objects.get(pk=txn_in.pk).transaction_type, 'in')
+
+        txn_in.transaction_type = 'in'
+        txn_in.quantity = 3
+        txn_in.save()
+        self.assertStock(1, 3)
+
+    def test_edit_adjustment_cannot_oversell(self):
+        # รายการปรับปรุงยอดใหม่ลดยอดได้โดยไม่ตรวจสอบ แต่การแก้ไขรายการเดิมต้องตรวจสอบ
+        adjustment = InventoryTransaction.objects.create(
+            book_inventory=self.book, transaction_type='adjustment', quantity=-12)
+        self.assertStock(-2, 3)
+        adjustment.quantity = -13
+        with self.assertRaises(ValidationError):
+            adjustment.save()
+        self.assertStock(-2, 3)
+        adjustment.quantity = 0
+        adjustment.save()
+        self.assertStock(10, 3)
+
+    @pandham_view_settings
+    def test_contribute_oversell_shows_form_error(self):
+        otp = start_otp_flow(self.client, {
+            'book_inventory': self.book.pk,
+            'amount_contributed': 200,
+            'number_of_books': 50,
+            'donate_books': 0,
+            'name': 'ผู้สมทบ',
+            'phone_number': '0812345678',
+            'shipping_address': 'ที่อยู่',
+        })
+        with mock.patch('pandham.views.send_sms', return_value='job'):
+            response = self.client.post(reverse('contribute_pandham_verify_otp'), {'otp': otp})
+        self.assertContains(response, "มีหนังสือไม่เพียงพอในคลังหลัก")
+        self.assertStock(10, 3)
+        self.assertFalse(Propagation.objects.exists())
+
+
+# =============================
+# นำเข้ารายการ InventoryTransaction จาก CSV (bulk_post)
+# =============================
+class ImportTransactionsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.book = BookInventory.objects.create(
+            book_name="หนังสือทดสอบ", price=100, initial_stock=10, current_stock=10)
+
+    def import_csv(self, content, *args):
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', encoding='utf-8', delete=False) as f:
+            f.write(content)
+        self.addCleanup(os.remove, f.name)
+        output = StringIO()
+        call_command('import_transactions', f.name, *args, stdout=output)
+        return output.getvalue()
+
+    def test_import_by_id_and_name(self):
+        output = self.import_csv(
+            "book_inventory,book_name,transaction_type,quantity,details\n"
+            f"{self.book.pk},,in,5,พิมพ์เพิ่ม\n"
+            ",หนังสือทดสอบ,pandham,3,\n"
+        )
+        self.assertIn("Imported 2 transactions", output)
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.current_stock, 12)
+        self.assertEqual(PandhamStock.objects.get(book_inventory=self.book).current_stock, 3)
+
+    def test_import_without_book_name_column(self):
+        self.import_csv(f"book_inventory,transaction_type,quantity\n{self.book.pk},in,5\n")
+        self.assertEqual(InventoryTransaction.objects.get().quantity, 5)
+
+    def test_invalid_rows_name_the_line(self):
+        for content, message in [
+            ("book_inventory,transaction_type,quantity\nabc,in,5\n", "Line 2: invalid book_inventory 'abc'"),
+            (f"book_inventory,transaction_type,quantity\n{self.book.pk},in,5\n,in,1\n", "Line 3: unknown book"),
+            (f"book_inventory,transaction_type,quantity\n{self.book.pk},in,x\n", "Line 2: invalid quantity"),
+        ]:
+            with self.assertRaisesMessage(CommandError, message):
+                self.import_csv(content)
+        self.assertFalse(InventoryTransaction.objects.exists())
+
+    def test_batch_is_all_or_nothing(self):
+        # ยอดสุทธิของทั้งชุดต่อหนังสือไม่พอ ไม่มีรายการใดถูกบันทึก
+        with self.assertRaises(CommandError):
+            self.import_csv(
+                "book_inventory,transaction_type,quantity\n"
+                f"{self.book.pk},in,2\n{self.book.pk},support,13\n"
+            )
+        self.import_csv(f"book_inventory,transaction_type,quantity\n{self.book.pk},support,4\n", '--dry-run')
+        self.assertFalse(InventoryTransaction.objects.exists())
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.current_stock, 10)
+
+
+# =============================
+# ยอดคงเหลือจาก ledger, checkpoint และคำสั่ง reconcile_stock
+# =============================
+class LedgerTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.book = BookInventory.objects.create(
+            book_name="หนังสือทดสอบ", price=100, initial_stock=20, current_stock=20)
+        cls.other = BookInventory.objects.create(
+            book_name="อีกเล่ม", price=50, initial_stock=10, current_stock=10)
+        for book, transaction_type, quantity in [
+            (cls.book, 'in', 5), (cls.book, 'pandham', 4), (cls.book, 'request', 1),
+            (cls.other, 'support', 3), (cls.book, 'support', 2),
+        ]:
+            InventoryTransaction.objects.create(book_inventory=book, transaction_type=transaction_type, quantity=quantity)
+
+    def reconcile(self, *args):
+        output = StringIO()
+        call_command('reconcile_stock', *args, stdout=output)
+        return output.getvalue()
+
+    def test_stock_totals(self):
+        expected = {self.book.pk: (-1, 3), self.other.pk: (-3, 0)}
+        self.assertEqual(stock_totals(use_checkpoints=False), expected)
+        self.assertEqual(stock_totals(), expected)
+        self.assertEqual(stock_totals(book_ids={self.other.pk}), {self.other.pk: (-3, 0)})
+
+        # ยอดย้อนหลัง ณ เวลาก่อนรายการสุดท้าย
+        last = InventoryTransaction.objects.latest('pk')
+        InventoryTransaction.objects.filter(pk=last.pk).update(created_at=timezone.now() + timedelta(hours=1))
+        self.assertEqual(stock_totals(at=timezone.now())[self.book.pk], (1, 3))
+
+    def test_create_checkpoint(self):
+        # รายการที่ใหม่กว่า lag ยังไม่นับเข้า checkpoint
+        self.assertIsNone(create_checkpoint())
+        boundary = create_checkpoint(lag=timedelta(0))
+        self.assertEqual(boundary, InventoryTransaction.objects.latest('pk').pk)
+        self.assertIsNone(create_checkpoint(lag=timedelta(0)))
+        self.assertEqual(latest_checkpoint()[1][self.book.pk], (-1, 3))
+
+        InventoryTransaction.objects.create(book_inventory=self.book, transaction_type='in', quantity=2)
+        expected = stock_totals(use_checkpoints=False)
+        self.assertEqual(stock_totals(), expected)
+        self.assertEqual(expected[self.book.pk], (1, 3))
+
+        # แก้ไขรายการที่ checkpoint นับไว้แล้ว checkpoint นั้นถูกลบ
+        txn = InventoryTransaction.objects.get(book_inventory=self.other)
+        txn.quantity = 1
+        txn.save()
+        self.assertEqual(latest_checkpoint(), (0, {}))
+        self.assertEqual(stock_totals()[self.other.pk], (-1, 0))
+
+    def test_reconcile_report_only(self):
+        self.assertIn("All balances match the ledger.", self.reconcile())
+        BookInventory.objects.filter(pk=self.book.pk).update(current_stock=99)
+        PandhamStock.objects.filter(book_inventory=self.book).delete()
+
+        # รายงานอย่างเดียวไม่เปิด transaction (ไม่มี SAVEPOINT ภายใน TestCase)
+        with CaptureQueriesContext(connection) as queries:
+            output = self.reconcile()
+        self.assertFalse([q for q in queries if 'SAVEPOINT' in q['sql']])
+        self.assertIn(f"{self.book.pk}\tmain\t99\t19", output)
+        self.assertIn(f"{self.book.pk}\tpandham\t0\t3", output)
+        self.assertIn("Found 2 drifted balances.", output)
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.current_stock, 99)
+
+    def test_reconcile_repair(self):
+        BookInventory.objects.filter(pk=self.book.pk).update(current_stock=99)
+        PandhamStock.objects.filter(book_inventory=self.book).delete()
+        BookInventory.objects.filter(pk=self.other.pk).update(current_stock=0)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertIn("Repaired 3 balances.", self.reconcile('--repair', '--full'))
+        # ทุกเล่มถูกซ่อมใน transaction เดียว (savepoint เดียวภายใน TestCase)
+        self.assertEqual(sum(query['sql'].startswith('SAVEPOINT') for query in queries.captured_queries), 1)
+        self.assertEqual(
+            dict(BookInventory.objects.values_list('pk', 'current_stock')), {self.book.pk: 19, self.other.pk: 7})
+        self.assertEqual(PandhamStock.objects.get(book_inventory=self.book).current_stock, 3)
+        self.assertIn("All balances match the ledger.", self.reconcile())
+
+
+# =============================
+# การจองหนังสือปันธรรมจาก Propagation (claim / allocate)
+# =============================
+class PropagationClaimTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.book = BookInventory.objects.create(
+            book_name="หนังสือทดสอบ", price=100, initial_stock=20, current_stock=20)
+        cls.group, cls.other_group = [
+            PandhamTargetGroup.objects.create(name="กลุ่ม 1"),
+            PandhamTargetGroup.objects.create(name="กลุ่ม 2"),
+        ]
+
+    def propagate(self, donate_books, group=None):
+        propagation = Propagation.objects.create(
+            book_inventory=self.book, phone_number='0812345678', name='ผู้สมทบ',
+            number_of_books=donate_books, donate_books=donate_books)
+        propagation.target_groups.set([group or self.group])
+        return propagation
+
+    def remaining(self, *propagations):
+        return [Propagation.objects.get(pk=p.pk).remaining_donated for p in propagations]
+
+    def test_claim_oldest_matching(self):
+        other = self.propagate(5, self.other_group)
+        first = self.propagate(1)
+        second = self.propagate(3)
+        self.assertEqual(Propagation.claim(self.book.pk, self.group.pk, 2), second.pk)
+        self.assertEqual(Propagation.claim(self.book.pk, self.group.pk, 1), first.pk)
+        self.assertEqual(Propagation.claim(self.book.pk, self.group.pk, 1), second.pk)
+        self.assertIsNone(Propagation.claim(self.book.pk, self.group.pk, 1))
+        self.assertEqual(self.remaining(other, first, second), [5, 0, 0])
+        self.assertEqual(Propagation.objects.get(pk=second.pk).requested, 3)
+
+    def test_claim_retries_when_taken(self):
+        first = self.propagate(1)
+        second = self.propagate(1)
+        first_query = QuerySet.first
+        raced = []
+
+        def racing_first(queryset):
+            # อีกคำขอจองรายการเดียวกันไประหว่าง SELECT กับ UPDATE
+            pk = first_query(queryset)
+            if not raced:
+                raced.append(None)
+                raced[0] = Propagation.claim(self.book.pk, self.group.pk, 1)
+            return pk
+
+        with mock.patch.object(QuerySet, 'first', racing_first):
+            claimed = Propagation.claim(self.book.pk, self.group.pk, 1)
+        self.assertEqual(raced, [first.pk])
+        self.assertEqual(claimed, second.pk)
+        self.assertEqual(self.remaining(first, second), [0, 0])
+
+    @skipUnless(connection.vendor == 'sqlite', "query plan ของ SQLite")
+    def test_claim_uses_partial_index(self):
+        plan = Propagation.claim_candidates(self.book.pk, self.group.pk, 1).explain()
+        self.assertIn('pandham_prop_remaining_idx', plan)
+
+    def test_allocate(self):
+        propagation = self.propagate(2)
+        request_pandham = RequestPandham.objects.create(
+            book_inventory=self.book, phone_number='0899999999', name='ผู้ขอรับ',
+            recipient_category=self.group, is_waiting=True)
+        self.assertTrue(request_pandham.allocate())
+        self.assertEqual(request_pandham.propagation_id, propagation.pk)
+        self.assertEqual(PandhamStock.objects.get(book_inventory=self.book).current_stock, 1)
+        self.assertEqual(self.remaining(propagation), [1])
+
+    def test_allocate_rolls_back_claim_without_stock(self):
+        # คลังปันธรรมถูกตัดไปแล้ว การจอง Propagation ต้องถูกยกเลิกด้วย
+        propagation = self.propagate(1)
+        PandhamStock.objects.filter(book_inventory=self.book).update(current_stock=0)
+        request_pandham = RequestPandham(
+            book_inventory=self.book, phone_number='0899999999', name='ผู้ขอรับ',
+            recipient_category=self.group, reference_number='REQP-TEST')
+        self.assertFalse(request_pandham.allocate())
+        self.assertIsNone(request_pandham.propagation_id)
+        self.assertEqual(self.remaining(propagation), [1])
+        self.assertFalse(InventoryTransaction.objects.filter(transaction_type='request').exists())
+
+
+# =============================
+# จัดสรรหนังสือให้ผู้รอรับ (waiting list)
+# =============================
+class WaitingListTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.book = BookInventory.objects.create(
+            book_name="หนังสือทดสอบ", price=100, initial_stock=20, current_stock=20)
+        cls.group, cls.other_group = [
+            PandhamTargetGroup.objects.create(name="กลุ่ม 1", priority=1),
+            PandhamTargetGroup.objects.create(name="กลุ่ม 2", priority=2),
+        ]
+
+    def wait(self, group, count=1, number_of_books=1):
+        return [
+            RequestPandham.objects.create(
+                book_inventory=self.book, phone_number=f'08000000{i:02d}', name='ผู้ขอรับ',
+                recipient_category=group, number_of_books=number_of_books, is_waiting=True).pk
+            for i in range(count)
+        ]
+
+    def propagate(self, donate_books, groups):
+        # กลุ่มเป้าหมายถูกกำหนดหลังบันทึก เหมือนหน้า admin และ view สมทบทุน
+        propagation = Propagation.objects.create(
+            book_inventory=self.book, phone_number='0812345678', name='ผู้สมทบ',
+            number_of_books=donate_books, donate_books=donate_books)
+        propagation.target_groups.set(groups)
+        return propagation
+
+    def waiting(self):
+        return list(RequestPandham.objects.filter(is_waiting=True).order_by('pk').values_list('pk', flat=True))
+
+    def test_fifo_in_batches(self):
+        requests = self.wait(self.group, 5)
+        self.propagate(3, [self.group])
+        self.assertEqual(drain_waiting_list(self.book.pk, batch_size=2), 3)
+        self.assertEqual(self.waiting(), requests[3:])
+        self.assertEqual(PandhamStock.objects.get(book_inventory=self.book).current_stock, 0)
+        self.assertEqual(
+            InventoryTransaction.objects.filter(transaction_type='request').count(), 3)
+
+    def test_request_that_does_not_fit_does_not_block_the_next(self):
+        # คำขอแรกต้องการ 5 เล่ม แต่มีเพียง 3 เล่ม คำขอถัดไปทั้งในชุดเดียวกันและชุดถัดไปได้รับตามลำดับ
+        head = self.wait(self.group, number_of_books=5)
+        requests = self.wait(self.group, 3)
+        self.propagate(3, [self.group])
+        self.assertEqual(drain_waiting_list(self.book.pk, batch_size=2), 3)
+        self.assertEqual(self.waiting(), head)
+        self.assertEqual(
+            set(RequestPandham.objects.filter(is_waiting=False).values_list('pk', flat=True)), set(requests))
+
+    def test_drain_skips_write_lock_without_waiting_requests(self):
+        with self.assertNumQueries(1):
+            drain_books([self.book.pk])
+
+    def test_groups_use_their_own_donors(self):
+        # คำขอของกลุ่มที่ยังไม่มีผู้ปันธรรม ไม่ขวางคำขอที่มาทีหลังของกลุ่มอื่น
+        other_request = self.wait(self.other_group)[0]
+        request = self.wait(self.group)[0]
+        propagation = self.propagate(1, [self.group])
+        drain_waiting_list(self.book.pk)
+        self.assertEqual(self.waiting(), [other_request])
+        self.assertEqual(RequestPandham.objects.get(pk=request).propagation_id, propagation.pk)
+
+        other = self.propagate(2, [self.other_group])
+        drain_waiting_list(self.book.pk)
+        self.assertEqual(self.waiting(), [])
+        self.assertEqual(Propagation.objects.get(pk=other.pk).remaining_donated, 1)
+
+    def test_target_groups_added_trigger_drain(self):
+        requests = self.wait(self.group, 2)
+        with self.captureOnCommitCallbacks(execute=True):
+            propagation = Propagation.objects.create(
+                book_inventory=self.book, phone_number='0812345678', name='ผู้สมทบ',
+                number_of_books=1, donate_books=1)
+        # ยังไม่มีกลุ่มเป้าหมาย
+        self.assertEqual(self.waiting(), requests)
+        with self.captureOnCommitCallbacks(execute=True):
+            propagation.target_groups.add(self.group)
+        self.assertEqual(self.waiting(), requests[1:])
+
+        # เพิ่มจากฝั่งกลุ่มเป้าหมาย (reverse)
+        with self.captureOnCommitCallbacks(execute=True):
+            other = Propagation.objects.create(
+                book_inventory=self.book, phone_number='0812345678', name='ผู้สมทบ',
+                number_of_books=1, donate_books=1)
+            self.group.propagation_set.add(other)
+        self.assertEqual(self.waiting(), [])
+
+    def test_drain_error_does_not_reach_the_caller(self):
+        self.wait(self.group)
+        with mock.patch('pandham.receivers.drain_waiting_list', side_effect=RuntimeError("boom")), \
+                self.assertLogs('pandham.receivers', 'ERROR'), \
+                self.captureOnCommitCallbacks(execute=True):
+            self.propagate(1, [self.group])
+        self.assertTrue(Propagation.objects.exists())
+        self.assertEqual(PandhamStock.objects.get(book_inventory=self.book).current_stock, 1)
+
+
+# =============================
+# หมายเลขอ้างอิงจาก ReferenceCounter
+# =============================
+class ReferenceNumberTests(TestCase):
+    def setUp(self):
+        self.allocator = ReferenceNumberAllocator(block_size=50)
+
+    def sequence(self, count):
+        return [int(self.allocator.next('TEST').rsplit('-', 1)[1]) for _ in range(count)]
+
+    def counter(self):
+        return ReferenceCounter.objects.get(prefix='TEST').value
+
+    def test_committed_block_is_reused(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.sequence(1), [1])
+        with self.assertNumQueries(0):
+            self.assertEqual(self.sequence(49), list(range(2, 51)))
+        self.assertEqual(self.sequence(1), [51])
+
+    def test_uncommitted_block_is_not_shared(self):
+        # ทั้งเทสต์อยู่ใน transaction ของ TestCase ที่ไม่ commit
+        self.assertEqual(self.sequence(2), [1, 51])
+        self.assertEqual(self.allocator._blocks, {})
+
+    def test_remainders_are_kept_after_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.sequence(2), [1, 51])
+        with self.assertNumQueries(0):
+            self.assertEqual(self.sequence(98), list(range(2, 51)) + list(range(52, 101)))
+        self.assertEqual(self.counter(), 100)
+
+    def test_rolled_back_block_is_discarded(self):
+        try:
+            with self.captureOnCommitCallbacks(execute=True), transaction.atomic():
+                self.assertEqual(self.sequence(1), [1])
+                raise RuntimeError
+        except RuntimeError:
+            pass
+        # การจองช่วง 1-50 ถูก rollback ไปพร้อมกัน ต้องจองใหม่แทนการใช้เลขที่เหลือ
+        self.assertEqual(self.allocator._blocks, {})
+        self.assertFalse(ReferenceCounter.objects.exists())
+        self.assertEqual(self.sequence(1), [1])
+
+
+# =============================
+# การส่ง SMS เบื้องหลัง
+# =============================
+class SmsSenderTests(TestCase):
+    def setUp(self):
+        self.sender = SmsSender()
+
+    def test_retries_only_connect_errors(self):
+        retry = self.sender._build_session().get_adapter('https://').max_retries
+        self.assertEqual(retry.connect, SMS_RETRIES)
+        self.assertEqual((retry.read, retry.status, retry.other), (0, 0, 0))
+        self.assertFalse(retry.status_forcelist)
+
+    def test_failure_log_masks_phone_number(self):
+        self.sender._ensure_worker()
+        error = requests.ConnectionError("https://sms.example/?MobileNumbers=0812345678")
+        with mock.patch.object(self.sender._session, 'get', side_effect=error), \
+                self.assertLogs('pandham.sms', 'INFO') as logs:
+            job_id = self.sender.enqueue('0812345678', 'OTP 123456')
+            self.sender.join()
+        output = "\n".join(logs.output)
+        self.assertNotIn('0812345678', output)
+        self.assertIn('******5678', output)
+        self.assertEqual(sms_status(job_id), SMS_FAILED)
+
+    def test_success_log_masks_phone_number(self):
+        response = mock.Mock(status_code=200, text='sent to 0812345678')
+        self.sender._session = mock.Mock(**{'get.return_value': response})
+        with self.assertLogs('pandham.sms', 'INFO') as logs:
+            self.sender.send('0812345678', 'OTP 123456')
+        self.assertNotIn('0812345678', "\n".join(logs.output))
+
+
+# =============================
+# ที่เก็บ OTP ใน cache
+# =============================
+class OtpStoreTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.store = get_otp_store()
+        self.flow_id = self.store.create_flow({'name': 'ผู้ขอ'})
+        self.secret = pyotp.random_base32()
+        self.store.set_code(self.flow_id, self.secret, sms_job='job')
+
+    def otp(self):
+        return pyotp.TOTP(self.secret, interval=OTP_INTERVAL).now()
+
+    def test_consume_returns_form_once(self):
+        self.assertEqual(self.store.get_code(self.flow_id)['sms_job'], 'job')
+        self.assertEqual(self.store.consume(self.flow_id, self.otp()), {'name': 'ผู้ขอ'})
+        self.assertIsNone(self.store.get_flow(self.flow_id))
+        with self.assertRaises(OtpMissing):
+            self.store.consume(self.flow_id, self.otp())
+
+    def test_invalid_code_keeps_flow(self):
+        with self.assertRaises(OtpInvalid):
+            self.store.consume(self.flow_id, f"{(int(self.otp()) + 1) % 1000000:06d}")
+        self.assertIsNotNone(self.store.get_code(self.flow_id))
+
+    def test_expired_code(self):
+        cache.delete(self.store._code_key(self.flow_id))
+        with self.assertRaises(OtpExpired):
+            self.store.consume(self.flow_id, self.otp())
+        self.assertIsNotNone(self.store.get_flow(self.flow_id))
+
+    def test_code_used_by_another_request(self):
+        otp = self.otp()
+        # คำขออื่นลบรหัสไปหลังจากที่คำขอนี้อ่านรหัสแล้ว
+        with mock.patch.object(self.store.cache, 'delete', return_value=False):
+            with self.assertRaises(OtpExpired):
+                self.store.consume(self.flow_id, otp)
+
+    def test_discard(self):
+        self.store.discard(self.flow_id)
+        self.assertIsNone(self.store.get_flow(self.flow_id))
+        self.assertIsNone(self.store.get_code(self.flow_id))
+
+
+# =============================
+# cache ความพร้อมของหนังสือ
+# =============================
+class AvailabilityTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.book = BookInventory.objects.create(
+            book_name="หนังสือทดสอบ", price=100, initial_stock=10, current_stock=10)
+        cls.other = BookInventory.objects.create(
+            book_name="หนังสืออีกเล่ม", price=50, initial_stock=5, current_stock=5)
+        PandhamStock.objects.create(book_inventory=cls.book, current_stock=3)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_get_many_loads_misses_in_one_query(self):
+        with self.assertNumQueries(1):
+            result = availability.get_many([self.book.pk, self.other.pk, 0])
+        self.assertEqual(set(result), {self.book.pk, self.other.pk})
+        self.assertEqual(result[self.book.pk]['main_stock'], 10)
+        self.assertEqual(result[self.book.pk]['pandham_stock'], 3)
+        self.assertEqual(result[self.other.pk]['pandham_stock'], 0)
+        with self.assertNumQueries(0):
+            self.assertEqual(availability.get(self.book.pk), result[self.book.pk])
+
+    def test_posting_invalidates_on_commit(self):
+        availability.get(self.book.pk)
+        version = availability.stock_version()
+        with self.captureOnCommitCallbacks(execute=True):
+            InventoryTransaction.objects.create(
+                book_inventory=self.book, transaction_type='pandham', quantity=2)
+            # ยังไม่ commit: entry เดิมยังอยู่
+            self.assertEqual(availability.get(self.book.pk)['main_stock'], 10)
+        entry = availability.get(self.book.pk)
+        self.assertEqual((entry['main_stock'], entry['pandham_stock']), (8, 5))
+        self.assertNotEqual(availability.stock_version(), version)
+
+    def test_book_edit_invalidates(self):
+        availability.get(self.book.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            BookInventory.objects.filter(pk=self.book.pk).update(price=120)
+            self.book.refresh_from_db()
+            self.book.save()
+        self.assertEqual(availability.get(self.book.pk)['price'], 120)
+
+
+# =============================
+# cache สองชั้น (utils.cache.TieredCache)
+# =============================
+class TieredCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.tiered = TieredCache(None, {'OPTIONS': {
+            'SHARED': 'default',
+            'LOCAL_SKIP_PREFIXES': ['views.decorators.cache.'],
+            'CHECK_INTERVAL': 60,
+        }})
+
+    def test_small_values_are_kept_locally(self):
+        self.tiered.set('pandham:availability:1', {'main_stock': 1})
+        self.assertEqual(self.tiered.get('pandham:availability:1'), {'main_stock': 1})
+        self.assertEqual(self.tiered.stats()['local'], {'hits': 1, 'misses': 0, 'entries': 1})
+
+    def test_local_hit_respects_timeout(self):
+        self.tiered.set('pandham:availability:1', {'main_stock': 1}, 10)
+        expired = time.time() + 11
+        # ยังอยู่ใน CHECK_INTERVAL แต่เลยเวลาหมดอายุของค่าแล้ว
+        with mock.patch('time.time', return_value=expired):
+            self.assertIsNone(self.tiered.get('pandham:availability:1'))
+        self.assertEqual(self.tiered.stats()['local'], {'hits': 0, 'misses': 1, 'entries': 0})
+
+    def test_page_cache_skips_local_tier(self):
+        key = 'views.decorators.cache.cache_page..GET.abc.def'
+        self.tiered.set(key, 'page')
+        self.assertEqual(self.tiered.get(key), 'page')
+        self.tiered.delete(key)
+        self.assertIsNone(self.tiered.get(key))
+        stats = self.tiered.stats()
+        self.assertEqual(stats['local']['entries'], 0)
+        self.assertEqual(stats['shared'], {'hits': 1, 'misses': 1})
+
+
+# =============================
+# BEGIN IMMEDIATE เฉพาะ write_atomic (utils.sqlite)
+# =============================
+@skipUnless(connection.vendor == 'sqlite', "ทดสอบ lock ของ SQLite")
+class WriteAtomicTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings_dict = {
+            **connection.settings_dict,
+            'ENGINE': 'utils.sqlite',
+            'NAME': os.path.join(directory.name, 'contention.sqlite3'),
+            'PRAGMAS': {'busy_timeout': 100},
+        }
+        # สอง connection ไปยังไฟล์เดียวกัน เหมือนสอง worker
+        for alias in ['first', 'second']:
+            connections[alias] = SQLiteDatabaseWrapper(dict(settings_dict), alias)
+            self.addCleanup(connections.__delitem__, alias)
+            self.addCleanup(connections[alias].close)
+        with connections['first'].cursor() as cursor:
+            cursor.execute("CREATE TABLE counter (value integer)")
+            cursor.execute("INSERT INTO counter VALUES (0)")
+
+    def read(self, alias):
+        with connections[alias].cursor() as cursor:
+            cursor.execute("SELECT value FROM counter")
+            return cursor.fetchone()[0]
+
+    def write(self, alias, value):
+        with connections[alias].cursor() as cursor:
+            cursor.execute("UPDATE counter SET value = %s", [value])
+
+    def test_writers_queue_behind_write_atomic(self):
+        with write_atomic(using='first'):
+            # ผู้อ่านใน atomic ปกติไม่ต้องรอผู้เขียน
+            with transaction.atomic(using='second'):
+                self.assertEqual(self.read('second'), 0)
+            # ผู้เขียนอีกรายรอ lock ตั้งแต่ BEGIN จนหมด busy_timeout
+            with self.assertRaisesMessage(OperationalError, 'database is locked'):
+                with write_atomic(using='second'):
+                    self.write('second', 2)
+            self.write('first', 1)
+        self.assertEqual(self.read('second'), 1)
+
+    def test_plain_atomic_does_not_take_the_write_lock(self):
+        with transaction.atomic(using='first'):
+            self.assertEqual(self.read('first'), 0)
+            with write_atomic(using='second'):
+                self.write('second', 2)
+        self.assertEqual(self.read('first'), 2)
@@ -4,7 +4,11 @@ from . import views
 urlpatterns = [
     # messages
     path('resend-otp/', views.resend_otp, name='resend_otp'),
+    path('otp-status/', views.otp_status, name='otp_status'),
     path('webhook/', views.webhook, name='webhook'),
+    # stock api
+    path('api/stock/', views.stock_api, name='stock_api'),
+    path('api/stock/<int:book_id>/', views.stock_api, name='stock_api_book'),
     # request pandham
     path('request-pandham/<int:book_id>/', views.RequestPandhamView.as_view(), name='request_pandham'),
     path('request-pandham-verify-otp/', views.RequestPandhamVerifyOTPView.as_view(), name='request_pandham_verify_otp'),
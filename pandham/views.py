@@ -1,28 +1,35 @@
-import datetime
+import logging
 import os
 import pyotp
-import requests
 
 from django import forms
+from django.core.exceptions import ValidationError
 from django.db import models
 from django.http import (
     HttpResponse, HttpResponseRedirect, HttpResponseBadRequest, JsonResponse)
 from django.shortcuts import render, redirect, get_object_or_404
 from django.urls import reverse_lazy, reverse
 from django.utils.translation import gettext_lazy as _
+from django.views.decorators.cache import cache_control
 from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import condition, require_GET
 from django.views.generic import TemplateView, FormView
-
-from wagtail.models import Page
-from coderedcms.models import ReusableContent
+from django_htmx.http import HttpResponseClientRedirect, push_url
 
 from formtools.wizard.views import SessionWizardView
 from dotenv import load_dotenv
+from wagtailcache.cache import nocache_page
+
+from utils.db import write_atomic
+from utils.page_url import get_page_url
 
+from . import availability
 from .forms import RequestPandhamForm, ContributeForm, VerifyOTPForm
-from .models import (
-    BookInventory, PandhamStock, Propagation,
-    InventoryTransaction, PandhamTargetGroup, RequestPandham)
+from .models import BookInventory, Propagation, RequestPandham
+from .instrumentation import instrument
+from .loaders import get_loader
+from .otp import OTP_INTERVAL, OtpError, get_otp_store
+from .sms import send_sms, sms_status
 
 from linebot import LineBotApi, WebhookHandler
 from linebot.exceptions import InvalidSignatureError, LineBotApiError
@@ -30,9 +37,6 @@ from linebot.models import MessageEvent, TextMessage, TextSendMessage
 
 
 load_dotenv()  # Load environment variables from .env file
-api_key = os.getenv("API_KEY")
-client_id = os.getenv("CLIENT_ID")
-send_sms_url = os.getenv("SEND_SMS_URL")
 
 LINE_CHANNEL_ACCESS_TOKEN = os.getenv('LINE_CHANNEL_ACCESS_TOKEN')
 LINE_CHANNEL_SECRET = os.getenv('LINE_CHANNEL_SECRET')
@@ -40,6 +44,8 @@ LINE_CHANNEL_SECRET = os.getenv('LINE_CHANNEL_SECRET')
 line_bot_api = LineBotApi(LINE_CHANNEL_ACCESS_TOKEN)
 handler = WebhookHandler(LINE_CHANNEL_SECRET)
 
+logger = logging.getLogger(__name__)
+
 
 # =============================
 # คลาส OtpService
@@ -48,48 +54,43 @@ handler = WebhookHandler(LINE_CHANNEL_SECRET)
 class OtpService:
     def __init__(self, request):
         self.request = request
+        self.store = get_otp_store()
+
+    @property
+    def flow_id(self):
+        return self.request.session.get('otp_flow')
+
+    def get_form_data(self):
+        return self.store.get_flow(self.flow_id)
+
+    def start(self, form_data):
+        # เก็บข้อมูลฟอร์มไว้ใน OTP store และเก็บเพียง flow id ไว้ใน session
+        self.request.session['otp_flow'] = self.store.create_flow(form_data)
+        return self.generate_and_send_otp(form_data['phone_number'])
 
+    @instrument('OtpService.generate_and_send_otp')
     def generate_and_send_otp(self, phone_number):
-        totp = pyotp.TOTP(pyotp.random_base32(), interval=180)
+        totp = pyotp.TOTP(pyotp.random_base32(), interval=OTP_INTERVAL)
         otp = totp.now()
-        self.request.session['otp_secret_key'] = totp.secret  # Save the OTP in the session
-        valid_date = datetime.datetime.now() + datetime.timedelta(minutes=3)  # Save the OTP valid date in the session
-        self.request.session['otp_valid_date'] = str(valid_date)
 
         message = """รหัส OTP : {otp} กรุณากรอกลงฟอร์มภายใน 3 นาที
         อนุโมทนาครับ/ค่ะ
         """.format(otp=otp)
 
-        url = send_sms_url
-        params = {
-            "SenderId": "PTF",
-            "Is_Unicode": "true",
-            "Is_Flash": "false",
-            "Message": message,
-            "MobileNumbers": phone_number,
-            "apiKey": api_key,
-            "clientId": client_id
-        }
-        response = requests.get(url, params=params)
-        print(response.json())
-
-    def verify_otp(self, otp_entered):
-        otp_secret_key = self.request.session.get('otp_secret_key')
-        otp_valid_date = self.request.session.get('otp_valid_date')
-        if otp_secret_key and otp_valid_date is not None:
-            valid_date = datetime.datetime.fromisoformat(otp_valid_date)
+        # ส่ง SMS ในเบื้องหลัง แล้วเก็บ job id ไว้ให้หน้า OTP ตรวจสอบสถานะ
+        job_id = send_sms(phone_number, message)
+        self.store.set_code(self.flow_id, totp.secret, sms_job=job_id)
+        return job_id
 
-            if valid_date > datetime.datetime.now():
-                totp = pyotp.TOTP(otp_secret_key, interval=180)
-                if totp.verify(otp_entered):
-                    return True
-        return False
+    def sms_job(self):
+        code = self.store.get_code(self.flow_id)
+        return code and code.get('sms_job')
 
-    def clear_otp(self):
-        if 'otp_secret_key' in self.request.session:
-            del self.request.session['otp_secret_key']
-        if 'otp_valid_date' in self.request.session:
-            del self.request.session['otp_valid_date']
+    def consume_otp(self, otp_entered):
+        # คืนข้อมูลฟอร์มเมื่อ OTP ถูกต้อง หรือ raise OtpError
+        form_data = self.store.consume(self.flow_id, otp_entered)
+        self.request.session.pop('otp_flow', None)
+        return form_data
 
 
 # =============================
@@ -97,16 +98,28 @@ class OtpService:
 # สำหรับการส่ง OTP ใหม่
 # =============================
 def resend_otp(request):
-    phone_number = request.GET.get('phone_number', None)
-
-    if phone_number:
-        # สมมติว่าคุณมี logic สำหรับสร้างและส่ง OTP ที่นี่
-        otp_service = OtpService(request)
-        otp_service.clear_otp()
-        otp_service.generate_and_send_otp(phone_number)
-        return JsonResponse({'status': 'success', 'message': 'OTP sent successfully.'})
+    otp_service = OtpService(request)
+    form_data = otp_service.get_form_data()
+
+    if form_data:
+        # ส่งรหัสใหม่ไปยังหมายเลขโทรศัพท์ของ flow ปัจจุบัน
+        job_id = otp_service.generate_and_send_otp(form_data['phone_number'])
+        if request.htmx:
+            return render(request, 'pandham/partials/otp-sms-status.html', {'sms_status': sms_status(job_id)})
+        return JsonResponse({'status': 'success', 'message': 'OTP is being sent.', 'sms_status': sms_status(job_id)})
     else:
-        return JsonResponse({'status': 'error', 'message': 'Phone number is required.'})
+        if request.htmx:
+            return render(request, 'pandham/partials/otp-sms-status.html', {'sms_status': 'expired'})
+        return JsonResponse({'status': 'error', 'message': 'OTP session has expired.'})
+
+
+# =============================
+# ฟังก์ชัน otp_status
+# สำหรับให้หน้า OTP ตรวจสอบสถานะการส่ง SMS (sending, sent, failed)
+# =============================
+def otp_status(request):
+    status = sms_status(OtpService(request).sms_job())
+    return JsonResponse({'sms_status': status or 'unknown'})
 
 
 # =============================
@@ -137,7 +150,7 @@ def handle_message(event):
         TextSendMessage(text=event.message.text))
 
     # Log group_id or use it as needed
-    print(event.source.group_id)
+    logger.info("LINE message received", extra={'group_id': getattr(event.source, 'group_id', None)})
 
 
 # =============================
@@ -145,15 +158,42 @@ def handle_message(event):
 # สำหรับการส่ง Line Message ไปยังกลุ่มที่กำหนด
 # =============================
 def send_line_message(group_id, message):
-    line_bot_api.push_message(group_id, TextSendMessage(text=message))
+    with instrument('send_line_message', count_queries=False):
+        line_bot_api.push_message(group_id, TextSendMessage(text=message))
+
+
+# =============================
+# คลาส HtmxPartialMixin
+# สำหรับตอบกลับเฉพาะส่วนของหน้า (fragment) เมื่อเป็นคำขอจาก htmx
+# =============================
+class HtmxPartialMixin:
+    partial_template_name = None
+
+    def get_template_names(self):
+        if self.request.htmx and self.partial_template_name:
+            return [self.partial_template_name]
+        return super().get_template_names()
+
+
+def render_otp_panel(request, verify_url, phone_number, **extra_context):
+    # แสดงส่วนยืนยัน OTP แทนแบบฟอร์มเดิม และเปลี่ยน URL ของเบราว์เซอร์ไปยังหน้ายืนยัน OTP
+    context = {
+        'form': VerifyOTPForm(),
+        'phone_number': phone_number,
+        'verify_url': verify_url,
+    }
+    context.update(extra_context)
+    response = render(request, 'pandham/partials/verify-otp-panel.html', context)
+    return push_url(response, verify_url)
 
 
 # =============================
 # ฟังก์ชัน RequestPandhamView
 # สำหรับการกรอกข้อมูลเพื่อขอปันธรรม
 # =============================
-class RequestPandhamView(FormView):
+class RequestPandhamView(HtmxPartialMixin, FormView):
     template_name = 'pandham/request-pandham.html'
+    partial_template_name = 'pandham/partials/request-pandham-form.html'
     form_class = RequestPandhamForm
     success_url = reverse_lazy('request_pandham_verify_otp')
 
@@ -164,6 +204,11 @@ class RequestPandhamView(FormView):
             initial['book_inventory'] = book_inventory
         return initial
 
+    def get_form_kwargs(self):
+        kwargs = super().get_form_kwargs()
+        kwargs['loader'] = get_loader(self.request)
+        return kwargs
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         # สมมติว่า book_id มาจาก URL kwargs หรือ initial data
@@ -171,22 +216,19 @@ class RequestPandhamView(FormView):
         context['book'] = ''
         context['current_stock'] = 0
         if book_id:
-            # ดึงข้อมูล book จากฐานข้อมูล
-            book = get_object_or_404(BookInventory, pk=book_id)
+            loader = get_loader(self.request)
+            # ดึงข้อมูล book ผ่าน loader ของ request
+            book = loader.book_or_404(book_id)
             # เพิ่ม book object เข้าไปใน context
             context['book'] = book
 
-            inventory_current_stock = book.current_stock
-            pandham = PandhamStock.objects.filter(book_inventory=book).first()
-            if pandham:
-                pandham_current_stock = pandham.current_stock
-            else:
-                pandham_current_stock = 0
+            # ดึงยอดสต็อกจาก cache ความพร้อมของหนังสือ
+            book_availability = loader.availability(book.pk)
+            inventory_current_stock = book_availability['main_stock']
+            pandham_current_stock = book_availability['pandham_stock']
             # เพิ่ม current_stock เข้าไปใน context
             context['inventory_stock'] = inventory_current_stock
             context['pandham_stock'] = pandham_current_stock
-            # เพิ่ม current_stock เข้าไปใน session
-            self.request.session['pandham_stock'] = pandham_current_stock
 
         return context
 
@@ -198,7 +240,7 @@ class RequestPandhamView(FormView):
         book_inventory = form_cleaned_data.get('book_inventory')
         phone_number = form_cleaned_data.get('phone_number')
         shipping_address = form_cleaned_data.get('shipping_address')
-        # Save the form data in the session
+        # Save the form data in the OTP store
         form_data = {
             "book_inventory": book_inventory.id if book_inventory else None,
             "name": form_cleaned_data.get('name'),
@@ -206,32 +248,28 @@ class RequestPandhamView(FormView):
             "shipping_address": shipping_address,
         }
 
+        # ดึงคำขอเดิมของหมายเลขนี้ด้วย query เดียว (รายการที่รอรับหนังสืออยู่ก่อน)
         requested = RequestPandham.objects.filter(
             phone_number=phone_number,
             book_inventory=book_inventory,
-        ).first()
-
-        waiting_list = RequestPandham.objects.filter(
-            phone_number=phone_number,
-            book_inventory=book_inventory,
-            is_waiting=True
-        ).first()
+        ).order_by('-is_waiting', 'pk').first()
 
-        if requested or waiting_list:
-            if waiting_list:
+        if requested:
+            if requested.is_waiting:
                 message = "คุณได้ขอรับหนังสือปันธรรมเล่มนี้แล้ว อยู่ในรายการรอหนังสือเ"
             else:
                 message = "คุณได้ขอรับหนังสือปันธรรมเล่มนี้แล้ว อยู่ระหว่างการดำเนินการ"
-            context = self.get_context_data()
+            context = self.get_context_data(form=form)
             context.update({
                 'result': message,
-                'ref': requested or waiting_list
+                'ref': requested
             })
-            return render(self.request, self.template_name, context)
+            return self.render_to_response(context)
 
-        self.request.session['form_data'] = form_data
         otp_service = OtpService(self.request)
-        otp_service.generate_and_send_otp(form_data['phone_number'])
+        otp_service.start(form_data)
+        if self.request.htmx:
+            return render_otp_panel(self.request, self.get_success_url(), form_data['phone_number'])
         return HttpResponseRedirect(self.get_success_url())
 
 
@@ -239,18 +277,18 @@ class RequestPandhamView(FormView):
 # ฟังก์ชัน RequestPandhamVerifyOTPView
 # สำหรับการ Verify OTP หลังจาก submit form และส่ง OTP แล้ว
 # =============================
-class RequestPandhamVerifyOTPView(FormView):
+class RequestPandhamVerifyOTPView(HtmxPartialMixin, FormView):
     template_name = 'pandham/request-pandham-verify-otp.html'
+    partial_template_name = 'pandham/partials/verify-otp-panel.html'
     form_class = VerifyOTPForm
     success_url = reverse_lazy('request_pandham_success')
 
     def get(self, request, *args, **kwargs):
-        # ตรวจสอบว่ามี 'form_data' ใน session หรือไม่
-        if 'form_data' not in request.session:
+        # ตรวจสอบว่ามีข้อมูลฟอร์มที่รอยืนยัน OTP หรือไม่
+        if OtpService(request).get_form_data() is None:
             # หากไม่พบ, redirect ไปยังหน้า pandham
-            page = Page.objects.get(slug='pandham')
-            return redirect(page.url)
-        # หากมี 'form_data' ใน session, ดำเนินการตามปกติ
+            return redirect(get_page_url('pandham', request))
+        # หากมีข้อมูลฟอร์ม, ดำเนินการตามปกติ
         return super().get(request, *args, **kwargs)
 
     def get_success_url(self, request_pandham_id=None):
@@ -258,12 +296,16 @@ class RequestPandhamVerifyOTPView(FormView):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['phone_number'] = self.request.session['form_data']['phone_number']
+        form_data = OtpService(self.request).get_form_data() or {}
+        context['phone_number'] = form_data.get('phone_number', '')
+        context['verify_url'] = self.request.path
         return context
 
     # ฟังก์ชันสำหรับสร้าง RequestPandham
     def create_request_pandham(self, form_data, otp_entered):
-        pandham_stock = self.request.session.get('pandham_stock', False)
+        # ดูยอดคลังปันธรรมขณะยืนยัน แทนการเก็บยอดไว้ใน session ตอนเปิดฟอร์ม (GET ไม่เขียน session)
+        book_availability = get_loader(self.request).availability(form_data.get('book_inventory'))
+        pandham_stock = book_availability['pandham_stock'] if book_availability else 0
         request_pandham = RequestPandham.objects.create(
             book_inventory_id=form_data.get('book_inventory'),
             number_of_books=1,
@@ -274,38 +316,23 @@ class RequestPandhamVerifyOTPView(FormView):
             shipping_address=form_data.get('shipping_address'),
             is_waiting=not pandham_stock,
         )
-        request_pandham.save()
         return request_pandham
 
     def form_valid(self, form):
         otp_entered = form.cleaned_data.get('otp')
-        otp_secret_key = self.request.session.get('otp_secret_key')
-        otp_valid_date = self.request.session.get('otp_valid_date')
-        if otp_secret_key and otp_valid_date is not None:
-            valid_date = datetime.datetime.fromisoformat(otp_valid_date)
-
-            if valid_date > datetime.datetime.now():
-                totp = pyotp.TOTP(otp_secret_key, interval=180)
-                if totp.verify(otp_entered):
-                    # อัปเดต form_data ใน session ด้วยค่า OTP ที่ได้รับ
-                    form_data = self.request.session.get('form_data', {})
-                    request_pandham = self.create_request_pandham(form_data, otp_entered)
-                    send_line_messaage(group_id, message)
-
-                    # ลบ 'form_data' และ 'pandham_stock' ออกจาก session
-                    self.request.session.pop('form_data', None)
-
-                    # ลบ OTP ออกจาก session
-                    otp_service = OtpService(self.request)
-                    otp_service.clear_otp()
-
-                    return redirect(self.get_success_url(request_pandham.id))
-                else:
-                    form.add_error('otp', "รหัส OTP ไม่ถูกต้อง")
-            else:
-                form.add_error('otp', "รหัส OTP หมดอายุ")
+        otp_service = OtpService(self.request)
+        try:
+            # ตรวจสอบ OTP และดึงข้อมูลฟอร์มออกจาก OTP store (ใช้ได้ครั้งเดียว)
+            form_data = otp_service.consume_otp(otp_entered)
+        except OtpError as e:
+            form.add_error('otp', str(e))
         else:
-            form.add_error('otp', "พบปัญหาการยืนยัน OTP, ติดต่อเจ้าหน้าที่")
+            request_pandham = self.create_request_pandham(form_data, otp_entered)
+            send_line_messaage(group_id, message)
+
+            if self.request.htmx:
+                return HttpResponseClientRedirect(self.get_success_url(request_pandham.id))
+            return redirect(self.get_success_url(request_pandham.id))
 
         # ในกรณีที่มี error ไม่ควรส่งต่อไปยัง success_url ให้ใช้ super().form_valid(form) ให้ใช้ self.form_invalid(form)
         return self.form_invalid(form)
@@ -326,13 +353,14 @@ class RequestPandhamSuccessView(TemplateView):
         # และนำข้อมูลนั้นมาใส่ใน context แล้วส่งต่อไปยัง template
         context = super().get_context_data(**kwargs)
         request_pandham_id = kwargs.get('request_pandham_id')
-        request_pandham = get_object_or_404(RequestPandham, pk=request_pandham_id)
+        request_pandham = get_object_or_404(
+            RequestPandham.objects.select_related('book_inventory', 'recipient_category'),
+            pk=request_pandham_id,
+        )
         context['request_pandham'] = request_pandham
 
         # reusable content
-        request_pandham_success_message = ReusableContent.objects.filter(name='request_pandham_success_message').first()
-        if request_pandham_success_message:
-            context['request_pandham_success_message'] = request_pandham_success_message
+        context.update(get_loader(self.request).reusable_contents('request_pandham_success_message'))
 
         return context
 
@@ -341,8 +369,9 @@ class RequestPandhamSuccessView(TemplateView):
 # ฟังก์ชัน ContributePandhamView
 # สำหรับการสมทบทุนการพิมพ์หนังสือ และรับหนังสือหรือปันธรรม
 # =============================
-class ContributePandhamView(FormView):
+class ContributePandhamView(HtmxPartialMixin, FormView):
     template_name = 'pandham/contribute-pandham.html'
+    partial_template_name = 'pandham/partials/contribute-pandham-form.html'
     form_class = ContributeForm
     success_url = reverse_lazy('contribute_pandham_verify_otp')
 
@@ -361,12 +390,12 @@ class ContributePandhamView(FormView):
         context['current_stock'] = 0
         context['price'] = 0
         if book_id:
-            # ดึงข้อมูล book จากฐานข้อมูล
-            book = get_object_or_404(BookInventory, pk=book_id)
-            # เพิ่ม book object เข้าไปใน context
-            context['book_name'] = book.book_name
-            context['current_stock'] = book.current_stock
-            context['price'] = book.price
+            # ดึงข้อมูล book จาก cache ความพร้อมของหนังสือ
+            book = get_loader(self.request).availability_or_404(book_id)
+            # เพิ่มข้อมูล book เข้าไปใน context
+            context['book_name'] = book['book_name']
+            context['current_stock'] = book['main_stock']
+            context['price'] = book['price']
 
         return context
     def get_form_kwargs(self):
@@ -376,12 +405,12 @@ class ContributePandhamView(FormView):
         book_id = self.kwargs.get('book_id') or self.request.GET.get('book_inventory')
 
         if book_id:
-            # ดึงข้อมูล book จากฐานข้อมูล
-            book = get_object_or_404(BookInventory, pk=book_id)
-            kwargs['min_contribute_value'] = book.price
-            kwargs['max_contribute_value'] = book.current_stock * book.price
-            kwargs['step_contribute_value'] = book.price
-            kwargs['max_number_of_book_value'] = book.current_stock
+            # ดึงข้อมูล book จาก cache ความพร้อมของหนังสือ
+            book = get_loader(self.request).availability_or_404(book_id)
+            kwargs['min_contribute_value'] = book['price']
+            kwargs['max_contribute_value'] = book['main_stock'] * book['price']
+            kwargs['step_contribute_value'] = book['price']
+            kwargs['max_number_of_book_value'] = book['main_stock']
         else:
             # ตั้งค่า max_value เป็นค่าเริ่มต้นหากไม่มี book_id
             kwargs['min_contribute_value'] = 500  # หรือค่าเริ่มต้นอื่นที่เหมาะสม
@@ -389,6 +418,7 @@ class ContributePandhamView(FormView):
             kwargs['step_contribute_value'] = 500
             kwargs['max_number_of_book_value'] = 10
 
+        kwargs['loader'] = get_loader(self.request)
         return kwargs
 
     def form_valid(self, form):
@@ -397,9 +427,9 @@ class ContributePandhamView(FormView):
         # For example, form.cleaned_data['field_name']
         form_cleaned_data = form.cleaned_data
         # แปลง QuerySet ของ target_groups เป็น list ของ ID
-        target_groups_ids = list(form_cleaned_data.get('target_groups').values_list('id', flat=True))
+        target_groups_ids = [target_group.id for target_group in form_cleaned_data.get('target_groups')]
 
-        # Save the form data in the session
+        # Save the form data in the OTP store
         form_data = {
             "book_inventory": form_cleaned_data.get('book_inventory').id if form_cleaned_data.get('book_inventory') else None,
             "amount_contributed": int(form_cleaned_data.get('amount_contributed')),
@@ -412,9 +442,11 @@ class ContributePandhamView(FormView):
             "shipping_address": form_cleaned_data.get('shipping_address'),
         }
 
-        self.request.session['form_data'] = form_data
         otp_service = OtpService(self.request)
-        otp_service.generate_and_send_otp(form_data['phone_number'])
+        otp_service.start(form_data)
+        if self.request.htmx:
+            return render_otp_panel(
+                self.request, self.get_success_url(), form_data['phone_number'], resend_label="ขอรหัส OTP")
         return HttpResponseRedirect(self.get_success_url())
 
 
@@ -422,18 +454,18 @@ class ContributePandhamView(FormView):
 # ฟังก์ชัน ContributePandhamVerifyOTPView
 # สำหรับการ Verify OTP หลังจาก submit form และส่ง OTP แล้ว
 # =============================
-class ContributePandhamVerifyOTPView(FormView):
+class ContributePandhamVerifyOTPView(HtmxPartialMixin, FormView):
     template_name = 'pandham/contribute-pandham-verify-otp.html'
+    partial_template_name = 'pandham/partials/verify-otp-panel.html'
     form_class = VerifyOTPForm
     success_url = reverse_lazy('contribute_pandham_success')
 
     def get(self, request, *args, **kwargs):
-        # ตรวจสอบว่ามี 'form_data' ใน session หรือไม่
-        if 'form_data' not in request.session:
+        # ตรวจสอบว่ามีข้อมูลฟอร์มที่รอยืนยัน OTP หรือไม่
+        if OtpService(request).get_form_data() is None:
             # หากไม่พบ, redirect ไปยังหน้า pandham
-            page = Page.objects.get(slug='pandham')
-            return redirect(page.url)
-        # หากมี 'form_data' ใน session, ดำเนินการตามปกติ
+            return redirect(get_page_url('pandham', request))
+        # หากมีข้อมูลฟอร์ม, ดำเนินการตามปกติ
         return super().get(request, *args, **kwargs)
 
 
@@ -442,9 +474,13 @@ class ContributePandhamVerifyOTPView(FormView):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['phone_number'] = self.request.session['form_data']['phone_number']
+        form_data = OtpService(self.request).get_form_data() or {}
+        context['phone_number'] = form_data.get('phone_number', '')
+        context['verify_url'] = self.request.path
+        context['resend_label'] = "ขอรหัส OTP"
         return context
 
+    @write_atomic
     def create_propagation(self, form_data, otp_entered):
         propagation = Propagation.objects.create(
             book_inventory_id=form_data.get('book_inventory'),
@@ -459,44 +495,26 @@ class ContributePandhamVerifyOTPView(FormView):
         )
         target_group_ids = form_data.get('target_groups', [])
         if target_group_ids:
-            target_groups = PandhamTargetGroup.objects.filter(id__in=target_group_ids)
-            propagation.target_groups.set(target_groups)
-        propagation.save()
+            propagation.target_groups.set(target_group_ids)
         return propagation
 
     def form_valid(self, form):
         # ตรวจสอบค่า OTP ที่กรอกเข้ามา
         otp_entered = form.cleaned_data.get('otp')
-        # เปิด session และดึงค่า OTP secret key และ valid date ออกมา
-        otp_secret_key = self.request.session.get('otp_secret_key')
-        otp_valid_date = self.request.session.get('otp_valid_date')
-
-        if otp_secret_key and otp_valid_date is not None:
-            valid_date = datetime.datetime.fromisoformat(otp_valid_date)
-            # ตรวจสอบว่า OTP ยังใช้งานได้อยู่หรือไม่
-            if valid_date > datetime.datetime.now():
-                totp = pyotp.TOTP(otp_secret_key, interval=180)
-                # ตรวจสอบค่า OTP ที่กรอกเข้ามา
-                if totp.verify(otp_entered):
-                    # เปิด session และดึงค่า form_data ออกมา
-                    form_data = self.request.session.get('form_data', {})
-                    propagation = self.create_propagation(form_data, otp_entered)
-                    self.request.session['propagation_id'] = propagation.id
-
-                    # ลบ 'form_data' ออกจาก session
-                    del self.request.session['form_data']
-
-                    # ลบ OTP ออกจาก session
-                    otp_service = OtpService(self.request)
-                    otp_service.clear_otp()
-
-                    return redirect(self.get_success_url(propagation.id))
-                else:
-                    form.add_error('otp', "รหัส OTP ไม่ถูกต้อง")
-            else:
-                form.add_error('otp', "รหัส OTP หมดอายุ")
+        otp_service = OtpService(self.request)
+        try:
+            # ตรวจสอบ OTP และดึงข้อมูลฟอร์มออกจาก OTP store (ใช้ได้ครั้งเดียว)
+            form_data = otp_service.consume_otp(otp_entered)
+            # หนังสือในคลังถูกตัดไปก่อนหน้า (เช่น มีผู้สมทบพร้อมกัน) ทั้งรายการถูกยกเลิก
+            propagation = self.create_propagation(form_data, otp_entered)
+        except OtpError as e:
+            form.add_error('otp', str(e))
+        except ValidationError as e:
+            form.add_error(None, e.messages + ["กรุณาทำรายการใหม่อีกครั้ง"])
         else:
-            form.add_error('otp', "พบปัญหาการยืนยัน OTP, ติดต่อเจ้าหน้าที่")
+            if self.request.htmx:
+                return HttpResponseClientRedirect(self.get_success_url(propagation.id))
+            return redirect(self.get_success_url(propagation.id))
 
         # ในกรณีที่มี error ไม่ควรส่งต่อไปยัง success_url ให้ใช้ super().form_valid(form) ให้ใช้ self.form_invalid(form)
         return self.form_invalid(form)
@@ -517,17 +535,64 @@ class ContributePandhamSuccessView(TemplateView):
         # และนำข้อมูลนั้นมาใส่ใน context แล้วส่งต่อไปยัง template
         context = super().get_context_data(**kwargs)
         propagation_id = kwargs.get('propagation_id')
-        propagation = get_object_or_404(Propagation, pk=propagation_id)
+        propagation = get_object_or_404(
+            Propagation.objects.select_related('book_inventory').prefetch_related('target_groups'),
+            pk=propagation_id,
+        )
         context['propagation'] = propagation
 
         # reusable content
-        contribution_anumodhana_message = ReusableContent.objects.filter(name='contribution_anumodhana_message').first()
-        if contribution_anumodhana_message:
-            context['contribution_anumodhana_message'] = contribution_anumodhana_message
-        ptf_saving_account = ReusableContent.objects.filter(name='ptf_saving_account').first()
-        if ptf_saving_account:
-            context['ptf_saving_account'] = ptf_saving_account
+        context.update(get_loader(self.request).reusable_contents(
+            'contribution_anumodhana_message',
+            'ptf_saving_account',
+        ))
 
         return context
 
 
+
+
+# =============================
+# ฟังก์ชัน stock_api
+# สำหรับให้หน้า catalog ตรวจสอบสต็อกล่าสุด (รองรับ ETag/Last-Modified)
+# คำขอที่สต็อกไม่เปลี่ยนจะได้ 304 โดยไม่ query ตารางสต็อก
+# =============================
+def get_stock_version(request):
+    if not hasattr(request, '_pandham_stock_version'):
+        request._pandham_stock_version = availability.stock_version()
+    return request._pandham_stock_version
+
+
+def stock_etag(request, book_id=None):
+    return f"{get_stock_version(request)['stamp']}-{book_id or 'all'}"
+
+
+def stock_last_modified(request, book_id=None):
+    return get_stock_version(request)['last_modified']
+
+
+@nocache_page
+@cache_control(no_cache=True)
+@require_GET
+@condition(etag_func=stock_etag, last_modified_func=stock_last_modified)
+def stock_api(request, book_id=None):
+    # อ่านจากฐานข้อมูลโดยตรง เพื่อให้ข้อมูลใหม่อย่างน้อยเท่ากับ ETag ที่คำนวณไว้ก่อนหน้า
+    books = BookInventory.objects.values(
+        'id', 'is_available', 'current_stock', 'stock__current_stock',
+    )
+    if book_id is not None:
+        books = books.filter(pk=book_id)
+    stocks = [
+        {
+            'id': book['id'],
+            'is_available': book['is_available'],
+            'main_stock': book['current_stock'],
+            'pandham_stock': book['stock__current_stock'] or 0,
+        }
+        for book in books
+    ]
+    if book_id is not None:
+        if not stocks:
+            return JsonResponse({'error': 'Book not found.'}, status=404)
+        return JsonResponse(stocks[0])
+    return JsonResponse({'books': stocks})
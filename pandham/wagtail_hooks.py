@@ -1,19 +1,39 @@
 from django import forms
+from django.db import transaction
+from django.shortcuts import render
+from django.urls import path, reverse
 from django.utils.translation import gettext_lazy as _
+from wagtail import hooks
+from wagtail.admin.menu import AdminOnlyMenuItem
 from wagtail.contrib.modeladmin.options import (
     ModelAdmin, ModelAdminGroup, modeladmin_register
 )
+from coderedcms.models import ReusableContent
+
+from utils.db import read_only_db
+
+from . import instrumentation, reusable_content
 from .models import (
     PandhamTargetGroup,
     PandhamTarget,
     BookInventory,
     PandhamStock,
     InventoryTransaction,
+    InventoryTransactionSummary,
     Propagation,
     RequestPandham,
 )
 
-class PandhamTargetGroupAdmin(ModelAdmin):
+
+class ReadOnlyIndexMixin:
+    """
+    หน้ารายการอ่านจาก alias read_only (ดู utils.db) หน้าแก้ไขและการบันทึกยังใช้ default
+    """
+    def get_queryset(self, request):
+        return super().get_queryset(request).using(read_only_db())
+
+
+class PandhamTargetGroupAdmin(ReadOnlyIndexMixin, ModelAdmin):
     model = PandhamTargetGroup
     menu_label = _("Target Group",)
     menu_icon = "group"
@@ -23,7 +43,7 @@ class PandhamTargetGroupAdmin(ModelAdmin):
     list_display = ("name", "priority",)
     search_fields = ("name",)
 
-class PandhamTargetAdmin(ModelAdmin):
+class PandhamTargetAdmin(ReadOnlyIndexMixin, ModelAdmin):
     model = PandhamTarget
     menu_label = _("Target",)
     menu_icon = "user"
@@ -34,7 +54,7 @@ class PandhamTargetAdmin(ModelAdmin):
     search_fields = ("name",)
     list_filter = ("pandham_target_group",)
 
-class BookInventoryAdmin(ModelAdmin):
+class BookInventoryAdmin(ReadOnlyIndexMixin, ModelAdmin):
     model = BookInventory
     menu_label = _("Inventory",)
     menu_icon = "list-ul"
@@ -46,7 +66,7 @@ class BookInventoryAdmin(ModelAdmin):
     search_fields = ("book_name",)
     list_filter = ("is_available",)
 
-class PandhamStockAdmin(ModelAdmin):
+class PandhamStockAdmin(ReadOnlyIndexMixin, ModelAdmin):
     model = PandhamStock
     menu_label = _("Pandham Stock",)
     menu_icon = "list-ul"
@@ -58,7 +78,7 @@ class PandhamStockAdmin(ModelAdmin):
     list_filter = ("book_inventory",)
 
 
-class InventoryTransactionAdmin(ModelAdmin):
+class InventoryTransactionAdmin(ReadOnlyIndexMixin, ModelAdmin):
     model = InventoryTransaction
     menu_label = _("Transaction",)
     menu_icon = "list-ul"
@@ -70,7 +90,18 @@ class InventoryTransactionAdmin(ModelAdmin):
     search_fields = ("book_inventory__book_name",)
     list_filter = ("transaction_type", "book_inventory__book_name",)
 
-class PropagationAdmin(ModelAdmin):
+class InventoryTransactionSummaryAdmin(ReadOnlyIndexMixin, ModelAdmin):
+    model = InventoryTransactionSummary
+    menu_label = _("Transaction Summary",)
+    menu_icon = "list-ul"
+    menu_order = 550
+    add_to_settings_menu = False
+    exclude_from_explorer = False
+    list_display = ("book_inventory", "transaction_type", "period_start", "quantity", "transaction_count",)
+    search_fields = ("book_inventory__book_name",)
+    list_filter = ("transaction_type",)
+
+class PropagationAdmin(ReadOnlyIndexMixin, ModelAdmin):
     model = Propagation
     menu_label = _("Propagation",)
     menu_icon = "list-ul"
@@ -81,7 +112,7 @@ class PropagationAdmin(ModelAdmin):
     search_fields = ("book_inventory__name",)
     list_filter = ("book_inventory", "target_groups",)
 
-class RequestPandhamAdmin(ModelAdmin):
+class RequestPandhamAdmin(ReadOnlyIndexMixin, ModelAdmin):
     model = RequestPandham
     menu_label = _("Request Pandham",)
     menu_icon = "list-ul"
@@ -102,9 +133,62 @@ class PandhamAdminGroup(ModelAdminGroup):
         BookInventoryAdmin,
         PandhamStockAdmin,
         InventoryTransactionAdmin,
+        InventoryTransactionSummaryAdmin,
         PropagationAdmin,
         RequestPandhamAdmin,
     )
 
 modeladmin_register(PandhamAdminGroup)
 
+
+
+# =============================
+# ล้าง cache ของ ReusableContent เมื่อ snippet ถูกสร้าง แก้ไข หรือลบ
+# =============================
+def invalidate_reusable_contents(instances):
+    names = {instance.name for instance in instances if isinstance(instance, ReusableContent)}
+    if names:
+        transaction.on_commit(lambda: reusable_content.invalidate(names))
+
+
+@hooks.register('after_create_snippet')
+@hooks.register('after_edit_snippet')
+def invalidate_reusable_content_after_save(request, instance):
+    invalidate_reusable_contents([instance])
+
+
+@hooks.register('after_delete_snippet')
+def invalidate_reusable_content_after_delete(request, instances):
+    invalidate_reusable_contents(instances)
+
+
+# =============================
+# รายงานเวลาและจำนวน query ของ pandham (ดู pandham.instrumentation)
+# =============================
+def instrumentation_report(request):
+    if request.method == 'POST' and 'reset' in request.POST:
+        instrumentation.reset()
+    return render(request, 'pandham/admin/instrumentation_report.html', {
+        'title': _("Pandham performance"),
+        'enabled': instrumentation.is_enabled(),
+        'rows': instrumentation.summarize(instrumentation.collect()),
+        'histogram_labels': instrumentation.histogram_labels(),
+    })
+
+
+@hooks.register('register_admin_urls')
+def register_instrumentation_report_url():
+    return [
+        path('reports/pandham-performance/', instrumentation_report, name='pandham_instrumentation_report'),
+    ]
+
+
+@hooks.register('register_reports_menu_item')
+def register_instrumentation_report_menu_item():
+    return AdminOnlyMenuItem(
+        _("Pandham performance"),
+        reverse('pandham_instrumentation_report'),
+        name='pandham-performance',
+        icon_name='time',
+        order=1500,
+    )
@@ -0,0 +1,150 @@
+"""
+จัดสรรหนังสือปันธรรมให้รายชื่อผู้รอรับ (RequestPandham.is_waiting) ตามลำดับก่อนหลัง
+"""
+from django.core.exceptions import ValidationError
+from django.db.models import Case
+from django.db.models import F
+from django.db.models import IntegerField
+from django.db.models import Q
+from django.db.models import Value
+from django.db.models import When
+from django.utils import timezone
+
+from utils.db import write_atomic
+
+from .models import InventoryTransaction
+from .models import PandhamStock
+from .models import Propagation
+from .models import RequestPandham
+
+
+# จำนวนคำขอที่จัดสรรต่อหนึ่งชุด
+DRAIN_BATCH_SIZE = 100
+
+# จำนวนครั้งที่ลองชุดเดิมใหม่เมื่อมีการจองตัดหน้าระหว่างจัดสรร
+DRAIN_ATTEMPTS = 3
+
+
+class AllocationConflict(Exception):
+    pass
+
+
+def drain_waiting_list(book_inventory_id, batch_size=DRAIN_BATCH_SIZE):
+    """
+    จัดสรรหนังสือให้ผู้รอรับของหนังสือเล่มนี้ตามลำดับ created_at ทีละ batch_size รายการ
+    จนกว่าคลังปันธรรมจะหมดหรือไม่มีผู้รอรับเหลือ คืนค่าจำนวนคำขอที่จัดสรรได้
+    คำขอที่จัดสรรไม่ได้ (จำนวนเล่มเกินสต็อกที่เหลือ หรือกลุ่มยังไม่มีผู้ปันธรรม) ยังคงรอ
+    และไม่ขวางคำขอถัดไป ทุกคำขอในชุดจึงถูกพิจารณาก่อนขยับไปชุดถัดไป
+    """
+    allocated = 0
+    after = None
+    attempts = 0
+    while True:
+        try:
+            count, after, more = _drain_batch(book_inventory_id, batch_size, after)
+        except AllocationConflict:
+            attempts += 1
+            if attempts >= DRAIN_ATTEMPTS:
+                break
+            continue
+        allocated += count
+        if not more:
+            break
+    return allocated
+
+
+def _drain_batch(book_inventory_id, batch_size, after):
+    """
+    จัดสรรหนึ่งชุดด้วย query แบบ set-based จำนวนคงที่
+    คืนค่า (จำนวนที่จัดสรรได้, ตำแหน่งสุดท้ายของชุดนี้, ควรทำชุดถัดไปหรือไม่)
+    """
+    with write_atomic():
+        waiting = RequestPandham.objects.filter(
+            book_inventory_id=book_inventory_id, is_waiting=True,
+        )
+        if after is not None:
+            created_at, pk = after
+            waiting = waiting.filter(Q(created_at__gt=created_at) | Q(created_at=created_at, pk__gt=pk))
+        waiting = list(waiting.order_by('created_at', 'pk').values_list(
+            'pk', 'created_at', 'number_of_books', 'recipient_category_id', 'reference_number',
+        )[:batch_size])
+        if not waiting:
+            return 0, after, False
+        last = (waiting[-1][1], waiting[-1][0])
+
+        stock = PandhamStock.objects.filter(
+            book_inventory_id=book_inventory_id,
+        ).values_list('current_stock', flat=True).first() or 0
+        if stock <= 0:
+            return 0, last, False
+
+        # ยอดคงเหลือของ Propagation เฉพาะกลุ่มเป้าหมายของคำขอในชุดนี้ เรียงตามลำดับก่อนหลัง
+        group_ids = {group_id for _, _, _, group_id, _ in waiting if group_id}
+        remaining = dict(Propagation.objects.filter(
+            book_inventory_id=book_inventory_id, remaining_donated__gt=0, target_groups__id__in=group_ids,
+        ).order_by('created_at', 'pk').values_list('pk', 'remaining_donated').distinct())
+        position = {propagation_id: index for index, propagation_id in enumerate(remaining)}
+        pools = {}
+        for propagation_id, group_id in Propagation.target_groups.through.objects.filter(
+            propagation_id__in=remaining, pandhamtargetgroup_id__in=group_ids,
+        ).values_list('propagation_id', 'pandhamtargetgroup_id'):
+            pools.setdefault(group_id, []).append(propagation_id)
+        for group_pools in pools.values():
+            group_pools.sort(key=position.__getitem__)
+
+        # จับคู่คำขอกับ Propagation ตามลำดับ
+        assignments = {}
+        claimed = {}
+        for pk, _, number_of_books, group_id, reference_number in waiting:
+            if stock < number_of_books:
+                continue
+            for propagation_id in pools.get(group_id, []):
+                if remaining[propagation_id] >= number_of_books:
+                    remaining[propagation_id] -= number_of_books
+                    claimed[propagation_id] = claimed.get(propagation_id, 0) + number_of_books
+                    assignments[pk] = (propagation_id, number_of_books, reference_number)
+                    stock -= number_of_books
+                    break
+        more = len(waiting) == batch_size and stock > 0
+        if not assignments:
+            return 0, last, more
+
+        now = timezone.now()
+        condition = Q()
+        for propagation_id, quantity in claimed.items():
+            condition |= Q(pk=propagation_id, remaining_donated__gte=quantity)
+        claimed_case = Case(
+            *[When(pk=propagation_id, then=Value(quantity)) for propagation_id, quantity in claimed.items()],
+            output_field=IntegerField(),
+        )
+        if Propagation.objects.filter(condition).update(
+            remaining_donated=F('remaining_donated') - claimed_case,
+            requested=F('requested') + claimed_case,
+            updated_at=now,
+        ) != len(claimed):
+            raise AllocationConflict()
+
+        if RequestPandham.objects.filter(pk__in=assignments, is_waiting=True).update(
+            is_waiting=False,
+            propagation_id=Case(
+                *[When(pk=pk, then=Value(propagation_id)) for pk, (propagation_id, _, _) in assignments.items()],
+            ),
+            updated_at=now,
+        ) != len(assignments):
+            raise AllocationConflict()
+
+        try:
+            InventoryTransaction.bulk_post([
+                InventoryTransaction(
+                    book_inventory_id=book_inventory_id,
+                    transaction_type='request',
+                    quantity=number_of_books,
+                    details='request pandham : ' + reference_number,
+                )
+                for _, number_of_books, reference_number in assignments.values()
+            ])
+        except ValidationError:
+            # คลังปันธรรมถูกตัดไปก่อนระหว่างจัดสรร
+            raise AllocationConflict()
+
+        return len(assignments), last, more
@@ -71,6 +71,9 @@ INSTALLED_APPS = [
 MIDDLEWARE = [
     # Save pages to cache. Must be FIRST.
     "wagtailcache.cache.UpdateCacheMiddleware",
+    # Key cached pages by the stock generation of the books they show.
+    # Must be between UpdateCacheMiddleware and FetchFromCacheMiddleware.
+    "pandham.cache_tags.StockCacheTagMiddleware",
     # Common functionality
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
@@ -86,6 +89,8 @@ MIDDLEWARE = [
     "wagtailcache.cache.FetchFromCacheMiddleware",
     # HTMX
     "django_htmx.middleware.HtmxMiddleware",
+    # Per-view latency and query counts for pandham (only when PANDHAM_INSTRUMENTATION is on)
+    "pandham.instrumentation.PandhamInstrumentationMiddleware",
 ]
 
 ROOT_URLCONF = "ptptk.urls"
@@ -112,12 +117,71 @@ WSGI_APPLICATION = "ptptk.wsgi.application"
 # Database
 # https://docs.djangoproject.com/en/5.0/ref/settings/#databases
 
-DATABASES = {
-    "default": {
+# SQLite by default. Set POSTGRES_DB (plus POSTGRES_USER, POSTGRES_PASSWORD,
+# POSTGRES_HOST and POSTGRES_PORT) to use PostgreSQL instead; this also runs
+# the test suite against PostgreSQL.
+if os.getenv("POSTGRES_DB"):
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.postgresql",
+            "NAME": os.getenv("POSTGRES_DB"),
+            "USER": os.getenv("POSTGRES_USER", ""),
+            "PASSWORD": os.getenv("POSTGRES_PASSWORD", ""),
+            "HOST": os.getenv("POSTGRES_HOST", ""),
+            "PORT": os.getenv("POSTGRES_PORT", ""),
+            # Persistent connections, checked before each request reuses them.
+            "CONN_MAX_AGE": int(os.getenv("POSTGRES_CONN_MAX_AGE", "0")),
+            "CONN_HEALTH_CHECKS": True,
+            # Large exports stream through server-side cursors. Turn them off
+            # when connecting through PgBouncer in transaction pooling mode.
+            "DISABLE_SERVER_SIDE_CURSORS": os.getenv("POSTGRES_DISABLE_SERVER_SIDE_CURSORS", "") == "1",
+            "OPTIONS": {
+                "connect_timeout": 5,
+                "sslmode": os.getenv("POSTGRES_SSLMODE", "prefer"),
+                "application_name": "ptptk",
+            },
+        }
+    }
+else:
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.sqlite3",
+            "NAME": BASE_DIR / "db.sqlite3",
+        }
+    }
+
+# Read-only connection for admin list views, reports and exports (see
+# utils/db.py). Everything else, including all writes, uses "default".
+# SQLite: the same file opened with mode=ro. PostgreSQL: the replica at
+# POSTGRES_REPLICA_HOST, or the primary in read-only transactions.
+if os.getenv("POSTGRES_DB"):
+    DATABASES["read_only"] = {
+        **DATABASES["default"],
+        "HOST": os.getenv("POSTGRES_REPLICA_HOST", DATABASES["default"]["HOST"]),
+        "PORT": os.getenv("POSTGRES_REPLICA_PORT", DATABASES["default"]["PORT"]),
+        "OPTIONS": {
+            **DATABASES["default"]["OPTIONS"],
+            "options": "-c default_transaction_read_only=on",
+        },
+    }
+else:
+    DATABASES["read_only"] = {
         "ENGINE": "django.db.backends.sqlite3",
-        "NAME": BASE_DIR / "db.sqlite3",
+        "NAME": f"file:{BASE_DIR / 'db.sqlite3'}?mode=ro",
     }
-}
+DATABASES["read_only"]["TEST"] = {"MIRROR": "default"}
+
+DATABASE_ROUTERS = ["utils.db.ReadOnlyRouter"]
+
+
+# Sessions
+# Read through the cache, written to the database only when modified; pandham
+# pages write the session only when an OTP flow starts, never on GET.
+# Expired rows are deleted in batches by `manage.py sweep_expired_sessions`.
+# utils.sessions is cached_db with saves in write_atomic() (BEGIN IMMEDIATE on
+# utils.sqlite), so a session write waits for the lock instead of failing.
+
+SESSION_ENGINE = "utils.sessions"
 
 
 # Password validation
@@ -200,21 +264,65 @@ CRISPY_ALLOWED_TEMPLATE_PACKS = "bootstrap5"
 
 CRISPY_TEMPLATE_PACK = "bootstrap5"
 
+# Record pandham view latency, query counts and external call timings.
+# View them under Reports > Pandham performance or with `manage.py pandham_metrics`.
+PANDHAM_INSTRUMENTATION = os.getenv("PANDHAM_INSTRUMENTATION", "") == "1"
+
+# Logging goes through a queue; a background thread writes the rotating file,
+# so log I/O does not run on the request thread (see utils/log.py).
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
+    'formatters': {
+        'structured': {
+            '()': 'utils.log.StructuredFormatter',
+        },
+    },
+    'filters': {
+        # Keep 1% of the SQL statements, plus every query slower than 200ms.
+        'sample_sql': {
+            '()': 'utils.log.SampleFilter',
+            'rate': 0.01,
+            'slow_ms': 200,
+        },
+    },
     'handlers': {
         'file': {
             'level': 'DEBUG',
-            'class': 'logging.FileHandler',
-            'filename': 'django_debug.log',
+            '()': 'utils.log.BackgroundFileHandler',
+            'filename': os.getenv("LOG_FILE", BASE_DIR / "django.log"),
+            'max_bytes': 10 * 1024 * 1024,
+            'backup_count': 5,
+            'formatter': 'structured',
         },
     },
     'loggers': {
         'django': {
             'handlers': ['file'],
-            'level': 'DEBUG',
+            'level': LOG_LEVEL,
             'propagate': True,
         },
+        # SQL statements are DEBUG records, which Django only emits when DEBUG
+        # is True; the logger passes them all and sample_sql keeps a few.
+        'django.db.backends': {
+            'handlers': ['file'],
+            'level': 'DEBUG',
+            'filters': ['sample_sql'],
+            'propagate': False,
+        },
+        # Migration DDL; logger filters do not apply to child loggers.
+        'django.db.backends.schema': {
+            'level': 'INFO',
+        },
+        'pandham': {
+            'handlers': ['file'],
+            'level': LOG_LEVEL,
+        },
+        'utils': {
+            'handlers': ['file'],
+            'level': LOG_LEVEL,
+        },
     },
 }
@@ -1,3 +1,5 @@
+import os
+
 from .base import *  # noqa
 
 # SECURITY WARNING: don't run with debug turned on in production!
@@ -12,6 +14,9 @@ EMAIL_BACKEND = "django.core.mail.backends.console.EmailBackend"
 
 WAGTAIL_CACHE = False
 
+# pandham debug messages while developing.
+LOGGING["loggers"]["pandham"]["level"] = os.getenv("LOG_LEVEL", "DEBUG")  # noqa
+
 try:
     from .local import *  # noqa
 except ImportError:
@@ -1,5 +1,8 @@
+import os
+
 from .base import *  # noqa
 
+
 # SECURITY WARNING: don't run with debug turned on in production!
 DEBUG = False
 
@@ -29,8 +32,43 @@ MANAGERS = ADMINS
 # Email address used to send error messages to ADMINS.
 SERVER_EMAIL = DEFAULT_FROM_EMAIL
 
+if DATABASES["default"]["ENGINE"] == "django.db.backends.postgresql":  # noqa
+    # Keep PostgreSQL connections open for 10 minutes unless configured otherwise.
+    DATABASES["default"]["CONN_MAX_AGE"] = int(os.getenv("POSTGRES_CONN_MAX_AGE", "600"))  # noqa
+    DATABASES["read_only"]["CONN_MAX_AGE"] = DATABASES["default"]["CONN_MAX_AGE"]  # noqa
+else:
+    # SQLite with WAL, busy_timeout and BEGIN IMMEDIATE for write_atomic()
+    # (see utils/sqlite/base.py and utils/db.py). pandham writes and session
+    # saves use write_atomic(); other plain transaction.atomic() writers, such
+    # as Wagtail admin saves, still BEGIN deferred and can fail with "database
+    # is locked" when another worker writes between their first read and write.
+    DATABASES["default"]["ENGINE"] = "utils.sqlite"  # noqa
+    DATABASES["read_only"]["ENGINE"] = "utils.sqlite"  # noqa
+
+# Only warnings from Django itself; rotate the log file daily and keep two weeks.
+LOGGING["loggers"]["django"]["level"] = os.getenv("LOG_LEVEL", "WARNING")  # noqa
+LOGGING["handlers"]["file"]["when"] = "midnight"  # noqa
+LOGGING["handlers"]["file"]["backup_count"] = 14  # noqa
+# With DEBUG = False Django logs no SQL statements, so there is nothing to
+# sample; keep only database warnings and errors.
+LOGGING["loggers"]["django.db.backends"]["level"] = "WARNING"  # noqa
+LOGGING["loggers"]["django.db.backends"]["filters"] = []  # noqa
+
+# In-process LRU in front of the shared file cache (see utils/cache.py).
+# Full pages from wagtail-cache (Django's cache_page keys) stay in the shared
+# tier only, so the local tier holds small values such as availability entries.
 CACHES = {
     "default": {
+        "BACKEND": "utils.cache.TieredCache",
+        "TIMEOUT": 14400,  # in seconds
+        "OPTIONS": {
+            "SHARED": "shared",
+            "LOCAL_MAX_ENTRIES": 500,
+            "LOCAL_SKIP_PREFIXES": ["views.decorators.cache."],
+            "CHECK_INTERVAL": 1,  # in seconds
+        },
+    },
+    "shared": {
         "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
         "LOCATION": BASE_DIR / "cache",  # noqa
         "KEY_PREFIX": "coderedcms",
@@ -1,7 +1,7 @@
-var countdownElement = document.getElementById("countdown");
-var resendOTPButton = document.getElementById("resend-otp-btn");
-
+// ส่วนยืนยัน OTP อาจถูกแทรกเข้ามาภายหลังด้วย htmx จึงค้นหา element ทุกครั้งที่ใช้งาน
 function startCountdown() {
+    var countdownElement = document.getElementById("countdown");
+    var resendOTPButton = document.getElementById("resend-otp-btn");
     if (resendOTPButton) {
         var countdown = 60;
         resendOTPButton.disabled = true;
@@ -23,6 +23,44 @@ function resendOTP() {
     startCountdown(); // Start the countdown
 }
 
+// ตรวจสอบสถานะการส่ง SMS OTP จนกว่าจะส่งสำเร็จหรือล้มเหลว
+var otpStatusMessages = {
+    "sending": "กำลังส่ง SMS OTP...",
+    "sent": "ส่ง SMS OTP แล้ว",
+    "failed": "ส่ง SMS OTP ไม่สำเร็จ กรุณากดขอรหัส OTP ใหม่",
+};
+var otpStatusTimer = null;
+
+function pollOtpStatus() {
+    var statusElement = document.getElementById("otp-sms-status");
+    if (!statusElement) {
+        return;
+    }
+    clearTimeout(otpStatusTimer);
+    fetch(statusElement.dataset.url, {credentials: "same-origin"})
+        .then(function(response) { return response.json(); })
+        .then(function(data) {
+            statusElement.innerText = otpStatusMessages[data.sms_status] || "";
+            if (data.sms_status === "sending") {
+                otpStatusTimer = setTimeout(pollOtpStatus, 2000);
+            }
+        });
+}
+
 document.addEventListener("DOMContentLoaded", function() {
     // startCountdown();
+    pollOtpStatus();
+})
+
+document.addEventListener("htmx:afterRequest", function(event) {
+    if (event.detail.elt.id === "resend-otp-btn") {
+        pollOtpStatus();
+    }
+})
+
+document.addEventListener("htmx:afterSwap", function(event) {
+    // ส่วนยืนยัน OTP ถูกแทรกเข้ามาแทนแบบฟอร์ม
+    if (event.detail.target.id !== "otp-sms-status" && document.getElementById("otp-panel")) {
+        pollOtpStatus();
+    }
 })
@@ -0,0 +1,210 @@
+"""
+cache backend สองชั้น: LRU ในหน่วยความจำของ process วางหน้า cache ที่ใช้ร่วมกัน (เช่น FileBasedCache)
+
+ทุกค่าที่เขียนลงชั้นร่วมมี stamp กำกับไว้ใน key แยก ค่าในหน่วยความจำใช้ได้ทันทีภายใน
+CHECK_INTERVAL วินาทีหลังตรวจล่าสุด เมื่อเกินกำหนดจะอ่านเพียง stamp จากชั้นร่วมมาเทียบ
+หาก worker อื่นเขียนทับหรือลบค่านั้นไปแล้ว stamp จะไม่ตรงและต้องอ่านค่าใหม่จากชั้นร่วม
+
+key ที่ขึ้นต้นด้วย LOCAL_SKIP_PREFIXES (เช่น หน้าเว็บทั้งหน้าของ wagtail-cache) เก็บเฉพาะชั้นร่วม
+เพื่อไม่ให้ค่าขนาดใหญ่ค้างอยู่ในหน่วยความจำของทุก worker
+
+ตัวอย่าง settings:
+    CACHES = {
+        "default": {
+            "BACKEND": "utils.cache.TieredCache",
+            "OPTIONS": {
+                "SHARED": "shared",
+                "LOCAL_MAX_ENTRIES": 1000,
+                "LOCAL_SKIP_PREFIXES": ["views.decorators.cache."],
+                "CHECK_INTERVAL": 1,
+            },
+        },
+        "shared": {"BACKEND": "django.core.cache.backends.filebased.FileBasedCache", ...},
+    }
+"""
+import pickle
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.core.cache.backends.base import BaseCache
+
+
+_STAMP_SUFFIX = ':tier-stamp'
+
+
+class TieredCache(BaseCache):
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self._shared_alias = options.get('SHARED', location or 'shared')
+        self._local_max_entries = int(options.get('LOCAL_MAX_ENTRIES', 1000))
+        self._local_skip_prefixes = tuple(options.get('LOCAL_SKIP_PREFIXES', ()))
+        self._check_interval = float(options.get('CHECK_INTERVAL', 1))
+        # {shared key: (stamp, ค่าที่ pickle แล้ว, เวลาหมดอายุ, เวลาที่ตรวจ stamp ล่าสุด)}
+        self._local = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {
+            'local': {'hits': 0, 'misses': 0},
+            'shared': {'hits': 0, 'misses': 0},
+        }
+
+    @property
+    def shared(self):
+        return caches[self._shared_alias]
+
+    def _local_key(self, key, version):
+        return self.shared.make_and_validate_key(key, version=version)
+
+    def _use_local(self, key):
+        return not key.startswith(self._local_skip_prefixes)
+
+    def _count(self, tier, result):
+        with self._lock:
+            self._stats[tier][result] += 1
+
+    # ====================================
+    # ชั้นในหน่วยความจำ
+    # ====================================
+    def _local_get(self, local_key):
+        with self._lock:
+            entry = self._local.get(local_key)
+            if entry is None:
+                return None
+            if entry[2] is not None and entry[2] <= time.time():
+                del self._local[local_key]
+                return None
+            self._local.move_to_end(local_key)
+            return entry
+
+    def _local_set(self, local_key, stamp, pickled, expires_at):
+        with self._lock:
+            self._local[local_key] = (stamp, pickled, expires_at, time.monotonic())
+            self._local.move_to_end(local_key)
+            while len(self._local) > self._local_max_entries:
+                self._local.popitem(last=False)
+
+    def _local_touch(self, local_key, expires_at=None, checked=False):
+        with self._lock:
+            entry = self._local.get(local_key)
+            if entry is None:
+                return
+            stamp, pickled, old_expires_at, checked_at = entry
+            self._local[local_key] = (
+                stamp, pickled,
+                old_expires_at if expires_at is None else expires_at,
+                time.monotonic() if checked else checked_at,
+            )
+
+    def _local_delete(self, local_key):
+        with self._lock:
+            self._local.pop(local_key, None)
+
+    # ====================================
+    # API ของ cache
+    # ====================================
+    def _store(self, key, value, timeout, version, add=False):
+        stamp = uuid.uuid4().hex
+        shared = self.shared
+        if timeout is DEFAULT_TIMEOUT:
+            timeout = self.default_timeout
+        if add:
+            if not shared.add(key, (stamp, value), timeout, version=version):
+                return False
+            shared.set(key + _STAMP_SUFFIX, stamp, timeout, version=version)
+        else:
+            # เขียน stamp ก่อนค่า worker อื่นจึงไม่มีทางเห็น stamp เดิมคู่กับค่าใหม่ค้างอยู่
+            shared.set(key + _STAMP_SUFFIX, stamp, timeout, version=version)
+            shared.set(key, (stamp, value), timeout, version=version)
+        if self._use_local(key):
+            self._local_set(
+                self._local_key(key, version), stamp,
+                pickle.dumps(value, pickle.HIGHEST_PROTOCOL),
+                self.get_backend_timeout(timeout),
+            )
+        return True
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        return self._store(key, value, timeout, version, add=True)
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self._store(key, value, timeout, version)
+
+    def get(self, key, default=None, version=None):
+        if not self._use_local(key):
+            stored = self.shared.get(key, version=version)
+            self._count('shared', 'misses' if stored is None else 'hits')
+            return default if stored is None else stored[1]
+
+        local_key = self._local_key(key, version)
+        entry = self._local_get(local_key)
+        if entry is not None:
+            # _local_get ตัดค่าที่หมดอายุทิ้งแล้ว แม้จะยังไม่ครบ CHECK_INTERVAL
+            stamp, pickled, _, checked_at = entry
+            if time.monotonic() - checked_at < self._check_interval:
+                self._count('local', 'hits')
+                return pickle.loads(pickled)
+            # ตรวจว่า worker อื่นเปลี่ยนค่านี้หรือไม่ โดยอ่านเพียง stamp
+            if self.shared.get(key + _STAMP_SUFFIX, version=version) == stamp:
+                self._local_touch(local_key, checked=True)
+                self._count('local', 'hits')
+                return pickle.loads(pickled)
+            self._local_delete(local_key)
+        self._count('local', 'misses')
+
+        stored = self.shared.get(key, version=version)
+        if stored is None:
+            self._count('shared', 'misses')
+            return default
+        self._count('shared', 'hits')
+        stamp, value = stored
+        # ไม่ทราบเวลาหมดอายุจริงในชั้นร่วม ให้ตรวจ stamp เมื่อครบ CHECK_INTERVAL แทน
+        self._local_set(local_key, stamp, pickle.dumps(value, pickle.HIGHEST_PROTOCOL), None)
+        return value
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        if timeout is DEFAULT_TIMEOUT:
+            timeout = self.default_timeout
+        if not self.shared.touch(key, timeout, version=version):
+            self._local_delete(self._local_key(key, version))
+            return False
+        self.shared.touch(key + _STAMP_SUFFIX, timeout, version=version)
+        self._local_touch(self._local_key(key, version), expires_at=self.get_backend_timeout(timeout))
+        return True
+
+    def delete(self, key, version=None):
+        # ค่าที่คืนมาจากชั้นร่วม ใช้ตัดสินว่าใครเป็นผู้ลบ (เช่น การใช้รหัส OTP)
+        self._local_delete(self._local_key(key, version))
+        self.shared.delete(key + _STAMP_SUFFIX, version=version)
+        return self.shared.delete(key, version=version)
+
+    def has_key(self, key, version=None):
+        return self.get(key, self._missing_key, version=version) is not self._missing_key
+
+    def clear(self):
+        with self._lock:
+            self._local.clear()
+        self.shared.clear()
+
+    def close(self, **kwargs):
+        self.shared.close(**kwargs)
+
+    # ====================================
+    # สถิติ
+    # ====================================
+    def stats(self):
+        """
+        คืนจำนวน hit/miss ของแต่ละชั้นใน process นี้ และจำนวนค่าในหน่วยความจำ
+        """
+        with self._lock:
+            stats = {tier: dict(counts) for tier, counts in self._stats.items()}
+            stats['local']['entries'] = len(self._local)
+        return stats
+
+    def reset_stats(self):
+        with self._lock:
+            for counts in self._stats.values():
+                counts.update(hits=0, misses=0)
@@ -0,0 +1,67 @@
+"""
+database router สำหรับ alias read_only (ดู DATABASES ใน settings)
+- ทุก query ใช้ default ตามปกติ ยกเว้น queryset ที่เลือก read_only เองด้วย .using(READ_ONLY_DB)
+  เช่นหน้ารายการใน Wagtail admin และคำสั่ง export จึงไม่แย่ง connection กับฟอร์มของผู้ใช้
+- การเขียนไปที่ default เสมอ แม้ instance จะโหลดมาจาก read_only
+- migrate เฉพาะ default (read_only คือไฟล์เดียวกันหรือ replica)
+
+write_atomic() คือ transaction.atomic สำหรับงานที่รู้ว่าจะเขียน
+บน SQLite (utils.sqlite) transaction นอกสุดจะเปิดด้วย BEGIN IMMEDIATE ส่วน atomic ปกติใช้ BEGIN
+"""
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+from django.db import transaction
+
+
+READ_ONLY_DB = 'read_only'
+
+
+def read_only_db():
+    """
+    alias สำหรับงานอ่านอย่างเดียว หรือ default ถ้าไม่ได้ตั้ง read_only ไว้
+    """
+    return READ_ONLY_DB if READ_ONLY_DB in settings.DATABASES else DEFAULT_DB_ALIAS
+
+
+class ReadOnlyRouter:
+    def db_for_read(self, model, **hints):
+        # None ให้ Django ใช้ฐานข้อมูลของ instance ใน hints หรือ default
+        return None
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, READ_ONLY_DB}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db == READ_ONLY_DB:
+            return False
+        return None
+
+
+class WriteAtomic(transaction.Atomic):
+    """
+    เปิด transaction นอกสุดโดยบอก backend ว่าจะเขียน (ดู utils.sqlite)
+    ถ้าอยู่ใน transaction อยู่แล้วจะทำงานเหมือน transaction.atomic ทุกอย่าง
+    """
+
+    def __enter__(self):
+        connection = transaction.get_connection(self.using)
+        if connection.in_atomic_block:
+            return super().__enter__()
+        connection.begin_immediate = True
+        try:
+            return super().__enter__()
+        finally:
+            connection.begin_immediate = False
+
+
+def write_atomic(using=None, savepoint=True, durable=False):
+    # ใช้ได้ทั้ง @write_atomic, @write_atomic(...) และ with write_atomic(...)
+    if callable(using):
+        return WriteAtomic(DEFAULT_DB_ALIAS, savepoint, durable)(using)
+    return WriteAtomic(using, savepoint, durable)
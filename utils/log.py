@@ -0,0 +1,130 @@
+"""
+ส่วนประกอบของ LOGGING ใน settings
+- BackgroundFileHandler: ส่ง log เข้าคิว แล้วให้ thread เบื้องหลังเขียนลงไฟล์ที่หมุนตามขนาดหรือเวลา
+- SampleFilter: สุ่มเก็บ log ระดับ DEBUG (เช่น SQL ของ django.db.backends) แต่เก็บ query ที่ช้าเสมอ
+- StructuredFormatter: จัดรูปแบบ log เป็น key=value พร้อมค่าที่ส่งมาทาง extra
+"""
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import threading
+
+
+# ====================================
+# Handler เบื้องหลัง
+# ====================================
+class BackgroundFileHandler(logging.handlers.QueueHandler):
+    """
+    request thread เพียงใส่ record ลงคิว การเขียนไฟล์และหมุนไฟล์ทำใน QueueListener
+    หมุนไฟล์ตามเวลาเมื่อกำหนด when (เช่น 'midnight') มิฉะนั้นหมุนตามขนาด max_bytes
+    """
+
+    def __init__(self, filename, max_bytes=10 * 1024 * 1024, backup_count=5, when=None,
+                 encoding='utf-8', queue_size=10000):
+        super().__init__(queue.Queue(queue_size))
+        self.filename = os.fspath(filename)
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.when = when
+        self.encoding = encoding
+        self._listener = None
+        self._pid = None
+        self._listener_lock = threading.Lock()
+
+    def _build_target(self):
+        if self.when:
+            return logging.handlers.TimedRotatingFileHandler(
+                self.filename, when=self.when, backupCount=self.backup_count,
+                encoding=self.encoding, delay=True)
+        return logging.handlers.RotatingFileHandler(
+            self.filename, maxBytes=self.max_bytes, backupCount=self.backup_count,
+            encoding=self.encoding, delay=True)
+
+    def _ensure_listener(self):
+        # เริ่ม listener ใหม่เมื่อยังไม่มี หรือหลังจาก worker process ถูก fork มา
+        if self._listener is not None and self._pid == os.getpid():
+            return
+        with self._listener_lock:
+            if self._listener is not None and self._pid == os.getpid():
+                return
+            self.queue = queue.Queue(self.queue.maxsize)
+            self._listener = logging.handlers.QueueListener(
+                self.queue, self._build_target(), respect_handler_level=False)
+            self._pid = os.getpid()
+            self._listener.start()
+            atexit.register(self._stop_listener, self._listener)
+
+    @staticmethod
+    def _stop_listener(listener):
+        try:
+            listener.stop()
+        except Exception:
+            pass
+
+    def enqueue(self, record):
+        # คิวเต็มให้ทิ้ง record แทนการรอ เพื่อไม่ให้ request ช้าลง
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            pass
+
+    def emit(self, record):
+        self._ensure_listener()
+        super().emit(record)
+
+    def close(self):
+        listener, self._listener = self._listener, None
+        if listener is not None and self._pid == os.getpid():
+            self._stop_listener(listener)
+        super().close()
+
+
+# ====================================
+# Filter สุ่มเก็บ log
+# ====================================
+class SampleFilter(logging.Filter):
+    """
+    เก็บ record ระดับต่ำกว่า INFO เพียงสัดส่วน rate
+    record ที่มี duration (วินาที) ตั้งแต่ slow_ms ขึ้นไปถูกเก็บเสมอ
+    """
+
+    def __init__(self, rate=0.01, slow_ms=None):
+        super().__init__()
+        self.rate = float(rate)
+        self.slow_ms = slow_ms
+
+    def filter(self, record):
+        if record.levelno >= logging.INFO:
+            return True
+        duration = getattr(record, 'duration', None)
+        if self.slow_ms is not None and duration is not None and duration * 1000 >= self.slow_ms:
+            return True
+        return random.random() < self.rate
+
+
+# ====================================
+# Formatter แบบ key=value
+# ====================================
+# attribute มาตรฐานของ LogRecord ที่ไม่นับเป็นค่าจาก extra
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+class StructuredFormatter(logging.Formatter):
+    def __init__(self, fmt='%(asctime)s level=%(levelname)s logger=%(name)s pid=%(process)d %(message)s',
+                 datefmt=None, style='%', **kwargs):
+        super().__init__(fmt, datefmt, style, **kwargs)
+
+    def format(self, record):
+        message = super().format(record)
+        extra = ' '.join(
+            f"{key}={value!r}" for key, value in record.__dict__.items()
+            if key not in _RECORD_ATTRS and not key.startswith('_')
+        )
+        if not extra:
+            return message
+        # traceback อยู่หลังข้อความเสมอ
+        head, sep, tail = message.partition('\n')
+        return f"{head} {extra}{sep}{tail}"
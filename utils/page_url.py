@@ -0,0 +1,52 @@
+import time
+from urllib.parse import urlsplit
+
+from django.core.cache import cache
+from django.http import Http404
+from wagtail.models import Page
+
+
+# URL ของหน้า CMS ที่ resolve แล้ว (ล้างทั้งหมดด้วยการเปลี่ยน version)
+PAGE_URL_TIMEOUT = 60 * 60 * 24
+PAGE_URL_VERSION_KEY = 'utils:page_url:version'
+
+
+class PageNotFound(Http404):
+    pass
+
+
+def _page_url_key(slug, version):
+    return f"utils:page_url:{version}:{slug}"
+
+
+def _page_url_version():
+    version = cache.get(PAGE_URL_VERSION_KEY)
+    if version is None:
+        cache.add(PAGE_URL_VERSION_KEY, time.time_ns(), None)
+        version = cache.get(PAGE_URL_VERSION_KEY)
+    return version
+
+
+def get_page_url(slug, request=None):
+    # คืน URL ของหน้าที่เผยแพร่อยู่ตาม slug หากไม่พบให้ raise PageNotFound (404)
+    # เป็น path แบบ relative เมื่อหน้าอยู่ใน site เดียวกับ request นอกนั้นเป็น URL เต็ม
+    key = _page_url_key(slug, _page_url_version())
+    parts = cache.get(key)
+    if parts is None:
+        page = Page.objects.live().filter(slug=slug).order_by('path').first()
+        url_parts = page.get_url_parts() if page else None
+        # เก็บค่าว่างไว้ด้วย เพื่อไม่ต้อง query หน้าที่ไม่มีอยู่ซ้ำทุกครั้ง
+        # และเก็บ root_url กับ path แยกกัน เพราะ URL แบบ relative ขึ้นกับ site ของ request
+        parts = (url_parts[1], url_parts[2]) if url_parts else ()
+        cache.set(key, parts, PAGE_URL_TIMEOUT)
+    if not parts:
+        raise PageNotFound(f"ไม่พบหน้าที่เผยแพร่อยู่ของ slug '{slug}'")
+    root_url, page_path = parts
+    if request is not None and urlsplit(root_url).netloc == request.get_host():
+        return page_path
+    return root_url + page_path
+
+
+def invalidate_page_urls(**kwargs):
+    # การย้าย เผยแพร่ หรือยกเลิกเผยแพร่หน้า อาจเปลี่ยน URL ของหน้าลูกด้วย จึงล้างทั้งหมด
+    cache.set(PAGE_URL_VERSION_KEY, time.time_ns(), None)
@@ -0,0 +1,15 @@
+"""
+session backend แบบ cached_db ที่บันทึกลงฐานข้อมูลด้วย write_atomic
+บน SQLite (utils.sqlite) การบันทึก session จึงรอ write lock ตั้งแต่ BEGIN IMMEDIATE
+แทนที่จะได้ SQLITE_BUSY ทันทีเมื่อ transaction ที่เริ่มด้วยการอ่านต้องอัปเกรดเป็นการเขียน
+"""
+from django.contrib.sessions.backends import cached_db
+from django.db import router
+
+from utils.db import write_atomic
+
+
+class SessionStore(cached_db.SessionStore):
+    def save(self, must_create=False):
+        with write_atomic(using=router.db_for_write(self.model)):
+            super().save(must_create)
@@ -0,0 +1,57 @@
+"""
+backend SQLite สำหรับ production
+- ตั้งค่า PRAGMA (WAL, busy_timeout, synchronous=NORMAL, mmap, cache_size) ทุกครั้งที่เปิด connection
+- transaction ที่เปิดด้วย utils.db.write_atomic ใช้ BEGIN IMMEDIATE ให้จองสิทธิ์เขียนตั้งแต่ต้น
+  ส่วน transaction.atomic ปกติใช้ BEGIN (deferred) งานอ่านจึงไม่ต้องรอคิวผู้เขียน
+
+ใช้งาน: DATABASES["default"]["ENGINE"] = "utils.sqlite"
+ปรับ PRAGMA เพิ่มเติมได้ด้วย DATABASES["default"]["PRAGMAS"] = {"cache_size": -32000}
+connection ที่เปิดด้วย mode=ro (เช่น alias read_only) ใช้ BEGIN ปกติและไม่ตั้ง journal_mode
+"""
+from django.db.backends.signals import connection_created
+from django.db.backends.sqlite3 import base
+from django.dispatch import receiver
+
+
+DEFAULT_PRAGMAS = {
+    # ผู้อ่านไม่ถูกผู้เขียนบล็อก และ commit เพียงต่อท้าย WAL
+    'journal_mode': 'WAL',
+    # รอ lock แทนการตอบ "database is locked" ทันที (มิลลิวินาที)
+    'busy_timeout': 5000,
+    # ใน WAL ข้อมูลไม่เสียหายเมื่อ process ล่ม อาจเสียเฉพาะ commit ล่าสุดเมื่อเครื่องดับ
+    'synchronous': 'NORMAL',
+    'mmap_size': 256 * 1024 * 1024,
+    # ค่าติดลบคือขนาดเป็น KiB
+    'cache_size': -64000,
+    'temp_store': 'MEMORY',
+}
+
+
+# PRAGMA ที่เขียนลงไฟล์ฐานข้อมูล ตั้งได้เฉพาะ connection ที่เขียนได้
+WRITE_PRAGMAS = {'journal_mode'}
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    # ตั้งโดย WriteAtomic ระหว่างเปิด transaction นอกสุด
+    begin_immediate = False
+
+    @property
+    def is_read_only(self):
+        return 'mode=ro' in str(self.settings_dict['NAME'])
+
+    def _start_transaction_under_autocommit(self):
+        if self.is_read_only or not self.begin_immediate:
+            return super()._start_transaction_under_autocommit()
+        # BEGIN แบบ deferred จะขอ lock เขียนเมื่อถึงคำสั่งเขียนแรก หากมี transaction อื่นเขียนอยู่
+        # SQLite จะตอบ SQLITE_BUSY ทันทีโดยไม่รอ busy_timeout (เพื่อกัน deadlock)
+        # BEGIN IMMEDIATE ขอ lock ตั้งแต่ต้นจึงรอคิวตาม busy_timeout ได้
+        self.cursor().execute("BEGIN IMMEDIATE")
+
+
+@receiver(connection_created, sender=DatabaseWrapper)
+def apply_pragmas(sender, connection, **kwargs):
+    pragmas = {**DEFAULT_PRAGMAS, **connection.settings_dict.get('PRAGMAS', {})}
+    for name, value in pragmas.items():
+        if connection.is_read_only and name in WRITE_PRAGMAS:
+            continue
+        connection.connection.execute(f"PRAGMA {name} = {value}")